@@ -1,22 +1,24 @@
 import os
 import uuid
 import json
-import jwt
-import shutil
-import asyncio
+import codecs
+import hashlib
 from datetime import datetime
-from app.db import (
-    insert_document,
-    update_document_status,
-    insert_summary,
-    get_db_connection,
-)
-from app.cache import (
-    redis_client,
-    load_policies_into_cache,
-    get_prohibited_keywords,
-    get_max_words_free,
-    get_template_for_doc_type,
+from typing import NamedTuple
+from app.writer import UnitOfWork
+from app.streams import add_review_entry, add_processed_notification
+from app.event_log import event_log, EVENT_LOG_FILE, POLICY_EXCEPTIONS_FILE
+from app.metrics import span, count_document
+from app.cache import get_policy_snapshot
+from app.classifier import classify_async
+from app.extraction import extract_pdf, extract_image_text, PageLimitExceeded
+from app.summarizer import summarize_document
+from app.summary_cache import (
+    CachedSummary,
+    content_hash,
+    template_hash,
+    lookup_summary,
+    remember_summary,
 )
 from fastapi import HTTPException, UploadFile
 
@@ -24,52 +26,98 @@ from fastapi import HTTPException, UploadFile
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Uploads are read from the spooled file in chunks of this size. The request
+# body itself is cut off at the role's ceiling while it is received
+# (RateLimitMiddleware), and at most max_bytes of one file is read here: a
+# text upload's decoded text is kept, so its peak memory is up to max_bytes.
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Used when the policies table has no template for a doc_type
+DEFAULT_TEMPLATE = "Produce a 200-word summary of this text."
+
 def now_iso() -> str:
     return datetime.utcnow().isoformat()
 
 def generate_doc_id() -> str:
     return str(uuid.uuid4())
 
-async def run_ocr(uploaded_file: UploadFile) -> str:
+async def iter_upload_chunks(uploaded_file: UploadFile, max_bytes: int):
     """
-    Placeholder OCR function. In a real system, call Tesseract or similar.
-    Here, we just read the bytes and pretend it's plain text.
+    Yield the upload in UPLOAD_CHUNK_SIZE pieces. Aborts with 413 as soon as
+    more than `max_bytes` have been received (the rest is never read).
     """
-    # Save the upload temporarily
-    file_location = os.path.join(UPLOAD_DIR, f"ocr_{uuid.uuid4().hex}.tmp")
-    with open(file_location, "wb") as out_file:
-        contents = await uploaded_file.read()
-        out_file.write(contents)
-    # For this demo, just return an empty string or a placeholder.
-    # In practice, use pytesseract.image_to_string()
-    return ""  # Or return "Recognized text..."
-
-def classify_document_type(text: str) -> str:
+    total = 0
+    while True:
+        chunk = await uploaded_file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Upload exceeds the {max_bytes}-byte limit for this role"
+            )
+        yield chunk
+
+
+class IngestedText(NamedTuple):
+    text: str
+    word_count: int
+    word_limit_exceeded: bool
+    content_hash: str       # sha256 of the bytes read
+
+
+async def read_text_upload(uploaded_file: UploadFile, max_bytes: int, max_words: int | None) -> IngestedText:
     """
-    Very simple keyword-based classification:
-      - If it contains "abstract" or "introduction" or "references" → academic
-      - If it has many line breaks and is shortish → slides
-      - If it looks like HTML or has "news" → news
-      - Else, "other"
+    Stream a plain-text upload through an incremental UTF-8 decoder while
+    keeping a running word count (same definition as str.split()) and a
+    running content hash.
+    If `max_words` is given, stop reading as soon as it is crossed and return
+    the text read so far with word_limit_exceeded=True. The text read is held
+    in memory, so this costs up to max_bytes (plus decoding) per upload.
     """
-    lowered = text.lower()
-    if any(keyword in lowered for keyword in ["abstract", "introduction", "references"]):
-        return "academic"
-    if len(text) < 500 and text.count("\n") > 5:
-        return "slides"
-    if "<!doctype html" in lowered or "news" in lowered:
-        return "news"
-    return "other"
-
-def simple_text_summarizer(text: str, style_prompt: str) -> str:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    hasher = hashlib.sha256()
+    parts: list[str] = []
+    word_count = 0
+    in_word = False     # did the previous piece end in the middle of a word?
+    exceeded = False
+
+    def consume(piece: str):
+        nonlocal word_count, in_word
+        if not piece:
+            return
+        words = len(piece.split())
+        if in_word and not piece[0].isspace():
+            words -= 1  # word continues across the chunk boundary
+        word_count += words
+        in_word = not piece[-1].isspace()
+        parts.append(piece)
+
+    async for chunk in iter_upload_chunks(uploaded_file, max_bytes):
+        hasher.update(chunk)
+        consume(decoder.decode(chunk))
+        if max_words is not None and word_count > max_words:
+            exceeded = True
+            break
+    if not exceeded:
+        consume(decoder.decode(b"", final=True))
+        exceeded = max_words is not None and word_count > max_words
+    return IngestedText("".join(parts), word_count, exceeded, hasher.hexdigest())
+
+
+async def extract_upload_text(uploaded_file: UploadFile, max_bytes: int, max_pages: int) -> str:
     """
-    Placeholder summarizer. In real code, call an LLM (OpenAI GPT, etc.).
-    Here, we just truncate or echo a dummy summary.
+    Read a PDF or image upload into memory (aborting with 413 past max_bytes)
+    and extract its text in the extraction process pool (app/extraction.py).
+    PDFs with more than `max_pages` pages are rejected with PageLimitExceeded.
     """
-    # For demo: return first N characters depending on style
-    # style_prompt might contain "500-word", "5 bullet", etc.
-    # We'll ignore and just take the first 300 chars as a placeholder.
-    return text[:300] + "\n\n[Summary truncated for demo.]"
+    data = b"".join([chunk async for chunk in iter_upload_chunks(uploaded_file, max_bytes)])
+    if uploaded_file.filename.endswith(".pdf") or data.startswith(b"%PDF"):
+        extraction = await extract_pdf(data, max_pages, uploaded_file.filename)
+    else:
+        extraction = await extract_image_text(data, uploaded_file.filename)
+    return extraction.text
 
 def simple_note_generator(text: str, doc_type: str) -> str:
     """
@@ -85,147 +133,200 @@ def simple_note_generator(text: str, doc_type: str) -> str:
     }
     return json.dumps(dummy_notes)
 
-async def process_document(user_id: str, role: str, uploaded_file: UploadFile):
+async def process_document(user_id: str, role: str, uploaded_file: UploadFile, doc_id: str | None = None):
     """
     Core function that implements:
     1) Ingest & Preprocess (OCR if needed)
     2) Classification (academic/news/slides/other)
     3) Governance check (word limit, prohibited keywords)
     4) Summarization & Note generation
-    5) Store in SQL
+    5) Store in SQL (all of this document's writes commit as one unit of work)
     6) Notify via Redis Streams
     7) Logging
+    Each stage is timed as a 'pipeline.*' span (see app/metrics.py).
+    `uploaded_file` may be any object with filename, content_type and an async
+    read(size) (e.g. a queued job's StoredUpload). Pass `doc_id` to reuse an id.
     """
     # 1. Generate a new doc_id
-    doc_id = generate_doc_id()
+    doc_id = doc_id or generate_doc_id()
     filename = uploaded_file.filename
+    uow = UnitOfWork()
 
-    # 2. Ingest & Preprocess
-    #    If it's a PDF or image → run OCR; else, read as plain text
-    if filename.endswith(".pdf") or uploaded_file.content_type.startswith("image/"):
-        raw_text = await run_ocr(uploaded_file)
-    else:
-        raw_text_bytes = await uploaded_file.read()
-        raw_text = raw_text_bytes.decode("utf-8", errors="replace")
+    # Pin the in-process policy snapshot for this request (no network round trip)
+    policy = get_policy_snapshot()
+    max_bytes = policy.max_upload_bytes_for(role)
+    max_free = policy.max_words_free
+    word_limit = max_free if role == "FreeUser" else None
+
+    # 2. Ingest & Preprocess (streamed; oversize uploads abort with 413)
+    #    If it's a PDF or image → extract its text; else, read as plain text
+    try:
+        if filename.endswith(".pdf") or uploaded_file.content_type.startswith("image/"):
+            with span("pipeline.ocr"):
+                raw_text = await extract_upload_text(uploaded_file, max_bytes, policy.max_pdf_pages_for(role))
+            word_count = len(raw_text.split())
+            word_limit_exceeded = word_limit is not None and word_count > word_limit
+            chash = content_hash(raw_text.encode("utf-8"))
+        else:
+            with span("pipeline.decode"):
+                raw_text, word_count, word_limit_exceeded, chash = await read_text_upload(
+                    uploaded_file, max_bytes, word_limit
+                )
+    except HTTPException as he:
+        if he.status_code == 413:
+            reason = "page_limit_exceeded" if isinstance(he, PageLimitExceeded) else "upload_size_exceeded"
+            log_event_flagged(doc_id, user_id, reason, role)
+            count_document("rejected", None, role)
+        raise
 
-    word_count = len(raw_text.split())
+    # 3. Look up the content hash: an identical upload summarized with the
+    #    current template can reuse its doc_type, summary and notes.
+    cached = None
+    if not word_limit_exceeded:
+        with span("pipeline.dedup_lookup"):
+            cached = await lookup_summary(chash)
+        if cached is not None:
+            current_template = policy.templates.get(cached.doc_type) or DEFAULT_TEMPLATE
+            if cached.template_hash != template_hash(current_template):
+                cached = None
 
-    # 3. Insert initial document record with status "ingested"
-    insert_document(
+    # Record initial document row with status "ingested". A dedup hit does not
+    # store the text again; it points at the document that owns the summary.
+    uow.insert_document(
         doc_id=doc_id,
         user_id=user_id,
         filename=filename,
-        raw_text=raw_text,
+        raw_text=None if cached else raw_text,
         doc_type="",            # to be updated
-        status="ingested"
+        status="ingested",
+        content_hash=chash,
+        summary_source_doc_id=cached.source_doc_id if cached else None,
     )
 
-    # 4. Load policies into cache (if not already loaded)
-    load_policies_into_cache()
-
-    # 5. Enforce word count limit for FreeUser
-    max_free = get_max_words_free()
-    if role == "FreeUser" and word_count > max_free:
+    # 4. Enforce word count limit for FreeUser (ingest already stopped at the limit)
+    if word_limit_exceeded:
         # Auto-reject
+        uow.update_document_status(doc_id, status="rejected")
+        await uow.commit()
         log_event_flagged(
             doc_id, user_id, "word_limit_exceeded", role
         )
-        update_document_status(doc_id, status="rejected")
+        count_document("rejected", None, role)
         raise HTTPException(
             status_code=403,
             detail=f"Word limit exceeded ({word_count} > {max_free}) for FreeUser"
         )
 
-    # 6. Classify document type
-    doc_type = classify_document_type(raw_text)
+    # 5. Classify document type (reused on a dedup hit)
+    with span("pipeline.classify"):
+        doc_type = cached.doc_type if cached else await classify_async(raw_text)
 
-    # 7. Check for prohibited keywords
-    prohibited_keywords = get_prohibited_keywords()
-    flagged_word = None
-    for word in raw_text.lower().split():
-        if word in prohibited_keywords:
-            flagged_word = word
-            break
+    # 6. Check for prohibited keywords (single linear pass over the text)
+    with span("pipeline.keyword_scan"):
+        matches = policy.matcher.find_all(raw_text)
+    flagged_word = matches[0].keyword if matches else None
 
     if flagged_word:
         # Found prohibited content
         if role == "PremiumUser":
+            # Commit before routing so reviewers never see a doc that isn't in SQL yet
+            uow.update_document_status(doc_id, status="pending_review", doc_type=doc_type)
+            await uow.commit()
             # Route to Review queue
-            redis_client.xadd(
-                "review_queue",
-                {
-                    "doc_id": doc_id,
-                    "user_id": user_id,
-                    "reason": f"keyword_match:{flagged_word}",
-                    "timestamp": now_iso()
-                }
-            )
-            update_document_status(doc_id, status="pending_review", doc_type=doc_type)
+            with span("pipeline.redis_xadd"):
+                await add_review_entry(
+                    doc_id,
+                    {
+                        "doc_id": doc_id,
+                        "user_id": user_id,
+                        "reason": f"keyword_match:{flagged_word}",
+                        "matches": json.dumps([{ "keyword": m.keyword, "offset": m.start } for m in matches]),
+                        "timestamp": now_iso()
+                    }
+                )
             log_event_flagged(doc_id, user_id, flagged_word, role)
+            count_document("pending_review", doc_type, role)
             return { "status": "pending_review", "reason": f"Flagged for keyword: {flagged_word}" }
         else:
             # Auto-reject (FreeUser or anonymous)
+            uow.update_document_status(doc_id, status="rejected", doc_type=doc_type)
+            await uow.commit()
             log_event_flagged(doc_id, user_id, flagged_word, role)
-            update_document_status(doc_id, status="rejected", doc_type=doc_type)
+            count_document("rejected", doc_type, role)
             raise HTTPException(
                 status_code=403,
                 detail=f"Prohibited content detected: '{flagged_word}'"
             )
 
-    # 8. Summarize & Generate Notes
-    template = get_template_for_doc_type(doc_type)
-    if template is None:
-        # Use a default summary template if not provided
-        template = "Produce a 200-word summary of this text."
-
-    summary_text = simple_text_summarizer(raw_text, template)
-    notes_json = simple_note_generator(raw_text, doc_type)
-
-    # 9. Store summary & update document status in SQL
-    insert_summary(doc_id, summary_text, notes_json)
-    update_document_status(doc_id, status="completed", doc_type=doc_type)
-
-    # 10. Notify processed via Redis Stream
-    redis_client.xadd(
-        "processed_notifications",
-        {
-            "doc_id": doc_id,
-            "user_id": user_id,
-            "doc_type": doc_type,
-            "timestamp": now_iso()
-        }
-    )
+    # 7. Summarize & Generate Notes
+    if cached:
+        # Same content + same template: answer from the dedup cache. The new
+        # document still gets its own summaries row (digests, search, fetch)
+        summary_text = cached.summary_text
+        uow.insert_summary(doc_id, cached.summary_text, cached.notes_json)
+        uow.update_document_status(doc_id, status="completed", doc_type=doc_type)
+        await uow.commit()
+    else:
+        template = policy.templates.get(doc_type)
+        if template is None:
+            # Use a default summary template if not provided
+            template = DEFAULT_TEMPLATE
+
+        with span("pipeline.summarize"):
+            summary_text = (await summarize_document(raw_text, template, uow)).text
+        with span("pipeline.notes"):
+            notes_json = simple_note_generator(raw_text, doc_type)
+
+        # 8. Store summary, dedup cache entry & update document status in SQL
+        entry = CachedSummary(doc_type, template_hash(template), doc_id, summary_text, notes_json)
+        uow.insert_summary(doc_id, summary_text, notes_json)
+        uow.cache_summary(chash, *entry)
+        uow.update_document_status(doc_id, status="completed", doc_type=doc_type)
+        await uow.commit()
+        await remember_summary(chash, entry)
+
+    # 9. Notify processed via Redis Stream
+    with span("pipeline.redis_xadd"):
+        await add_processed_notification(
+            {
+                "doc_id": doc_id,
+                "user_id": user_id,
+                "doc_type": doc_type,
+                "timestamp": now_iso()
+            }
+        )
 
-    # 11. Log event
-    log_event_processed(doc_id, user_id, doc_type, len(summary_text.split()))
+    # 10. Log event
+    log_event_processed(doc_id, user_id, doc_type, len(summary_text.split()), role)
+    count_document("completed", doc_type, role)
 
-    return { "status": "completed", "doc_id": doc_id }
+    result = { "status": "completed", "doc_id": doc_id }
+    if cached:
+        result["deduplicated_from"] = cached.source_doc_id
+    return result
 
 
 # ----------------- Observability Helpers -----------------
 
-def log_event_processed(doc_id: str, user_id: str, doc_type: str, summary_length: int):
-    """Log a successful processing event in logs/event_log.json."""
-    import datetime
+def log_event_processed(doc_id: str, user_id: str, doc_type: str, summary_length: int, role: str | None = None):
+    """Log a successful processing event in logs/event_log.json (buffered, non-blocking)."""
     entry = {
-        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "timestamp": now_iso(),
         "agent_id": "note_agent_v1",
         "user_id": user_id,
         "doc_id": doc_id,
         "doc_type": doc_type,
         "summary_length": summary_length,
-        "decision": "summarized"
+        "decision": "summarized",
+        "role": role
     }
-    os.makedirs(os.path.join(os.path.dirname(__file__), "logs"), exist_ok=True)
-    with open(os.path.join(os.path.dirname(__file__), "logs", "event_log.json"), "a") as f:
-        f.write(json.dumps(entry) + "\n")
+    event_log.write(EVENT_LOG_FILE, entry)
 
 
 def log_event_flagged(doc_id: str, user_id: str, reason: str, role: str):
-    """Log a flagged (policy exception) event in logs/policy_exceptions.json."""
-    import datetime
+    """Log a flagged (policy exception) event in logs/policy_exceptions.json (buffered, non-blocking)."""
     entry = {
-        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "timestamp": now_iso(),
         "agent_id": "note_agent_v1",
         "user_id": user_id,
         "doc_id": doc_id,
@@ -233,6 +334,4 @@ def log_event_flagged(doc_id: str, user_id: str, reason: str, role: str):
         "action": "flagged_for_review" if role == "PremiumUser" else "auto_reject",
         "role_checked": role
     }
-    os.makedirs(os.path.join(os.path.dirname(__file__), "logs"), exist_ok=True)
-    with open(os.path.join(os.path.dirname(__file__), "logs", "policy_exceptions.json"), "a") as f:
-        f.write(json.dumps(entry) + "\n")
+    event_log.write(POLICY_EXCEPTIONS_FILE, entry)
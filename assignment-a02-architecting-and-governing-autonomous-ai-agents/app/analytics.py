@@ -0,0 +1,270 @@
+"""
+Analytics over the JSONL event logs (logs/event_log.json and
+logs/policy_exceptions.json, plus their rotated segments).
+
+Each run first ingests only what was appended since the previous run into an
+indexed SQLite store (analytics.db), then answers the query from there:
+
+    python -m app.analytics docs-per-type --hours 24
+    python -m app.analytics top-flagged --limit 10
+    python -m app.analytics rejection-rate --since 2025-06-01
+    python -m app.analytics ingest
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+
+from app.db import _connect
+from app.event_log import LOG_DIR, EVENT_LOG_FILE, POLICY_EXCEPTIONS_FILE
+
+ANALYTICS_DB_PATH = os.path.join(os.path.dirname(__file__), "analytics.db")
+ANALYTICS_BATCH_LINES = 10_000      # rows inserted per executemany
+
+# Log file → event kind stored in the events table
+LOG_KINDS = {
+    EVENT_LOG_FILE: "processed",
+    POLICY_EXCEPTIONS_FILE: "flagged",
+}
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        ts TEXT NOT NULL,               -- ISO-8601 UTC
+        hour TEXT NOT NULL,             -- 'YYYY-MM-DDTHH', for hourly group-bys
+        kind TEXT NOT NULL,             -- 'processed' | 'flagged'
+        user_id TEXT,
+        role TEXT,
+        doc_id TEXT,
+        doc_type TEXT,                  -- processed events
+        summary_length INTEGER,         -- processed events
+        reason TEXT,                    -- flagged events
+        action TEXT                     -- flagged events: 'auto_reject' | 'flagged_for_review'
+    );
+    """,
+    # Covering indexes: each query below is answered from one index alone
+    "CREATE INDEX IF NOT EXISTS idx_events_doc_types ON events(kind, ts, hour, doc_type);",
+    "CREATE INDEX IF NOT EXISTS idx_events_flagged_users ON events(kind, user_id, ts, action, reason);",
+    "CREATE INDEX IF NOT EXISTS idx_events_roles ON events(kind, ts, role, action, doc_type, reason);",
+    # One row per log file ever read, keyed by a fingerprint of its first line
+    # so a file is recognised after it is rotated (renamed and gzipped).
+    """
+    CREATE TABLE IF NOT EXISTS log_checkpoints (
+        fingerprint TEXT PRIMARY KEY,
+        log_name TEXT NOT NULL,
+        byte_offset INTEGER NOT NULL,   -- uncompressed bytes already ingested
+        complete INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL
+    );
+    """,
+]
+
+INSERT_EVENT_SQL = """
+    INSERT INTO events (ts, hour, kind, user_id, role, doc_id, doc_type, summary_length, reason, action)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+UPSERT_CHECKPOINT_SQL = """
+    INSERT INTO log_checkpoints (fingerprint, log_name, byte_offset, complete, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(fingerprint) DO UPDATE SET
+        byte_offset=excluded.byte_offset,
+        complete=excluded.complete,
+        updated_at=excluded.updated_at;
+"""
+
+
+def connect(db_path: str = ANALYTICS_DB_PATH):
+    conn = _connect(db_path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+def _open_log(path: str):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def _fingerprint(path: str) -> str | None:
+    """sha256 of the first line (timestamp + doc_id make it unique), None if no full line yet."""
+    with _open_log(path) as f:
+        first = f.readline()
+    if not first.endswith(b"\n"):
+        return None
+    return hashlib.sha256(first).hexdigest()
+
+
+def log_sources(log_dir: str, log_name: str) -> list[tuple[str, bool]]:
+    """
+    The files holding `log_name`'s events, oldest first, as (path, is_active):
+    rotated segments <stem>.<date>.<n><ext>[.gz], then the active file.
+    """
+    stem, ext = os.path.splitext(log_name)
+    segment_re = re.compile(rf"^{re.escape(stem)}\.(\d{{4}}-\d{{2}}-\d{{2}})\.(\d+){re.escape(ext)}(\.gz)?$")
+    segments = []
+    for name in os.listdir(log_dir) if os.path.isdir(log_dir) else []:
+        match = segment_re.match(name)
+        if match:
+            segments.append(((match.group(1), int(match.group(2))), os.path.join(log_dir, name)))
+    sources = [(path, False) for _, path in sorted(segments)]
+    active = os.path.join(log_dir, log_name)
+    if os.path.exists(active):
+        sources.append((active, True))
+    return sources
+
+
+def _event_row(kind: str, entry: dict) -> tuple:
+    ts = entry.get("timestamp", "")
+    if kind == "processed":
+        return (ts, ts[:13], kind, entry.get("user_id"), entry.get("role"), entry.get("doc_id"),
+                entry.get("doc_type"), entry.get("summary_length"), None, None)
+    return (ts, ts[:13], kind, entry.get("user_id"), entry.get("role_checked"), entry.get("doc_id"),
+            None, None, entry.get("flagged_reason"), entry.get("action"))
+
+
+def ingest_source(conn, path: str, is_active: bool, log_name: str) -> int:
+    """
+    Read the complete lines appended to one log file since its checkpoint and
+    insert them, together with the new checkpoint, in one transaction.
+    Returns the number of events ingested.
+    """
+    fingerprint = _fingerprint(path)
+    if fingerprint is None:
+        return 0
+    row = conn.execute("SELECT byte_offset, complete FROM log_checkpoints WHERE fingerprint = ?;",
+                       (fingerprint,)).fetchone()
+    if row is not None and row["complete"]:
+        return 0
+    offset = row["byte_offset"] if row else 0
+    kind = LOG_KINDS[log_name]
+
+    count = 0
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        with _open_log(path) as f:
+            f.seek(offset)
+            batch = []
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break       # the writer is mid-line; pick it up next run
+                offset += len(line)
+                try:
+                    batch.append(_event_row(kind, json.loads(line)))
+                except (json.JSONDecodeError, AttributeError):
+                    continue
+                if len(batch) >= ANALYTICS_BATCH_LINES:
+                    conn.executemany(INSERT_EVENT_SQL, batch)
+                    count += len(batch)
+                    batch.clear()
+            conn.executemany(INSERT_EVENT_SQL, batch)
+            count += len(batch)
+        conn.execute(UPSERT_CHECKPOINT_SQL, (fingerprint, log_name, offset, int(not is_active),
+                                             datetime.utcnow().isoformat()))
+        conn.execute("COMMIT;")
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    return count
+
+
+def ingest(conn, log_dir: str = LOG_DIR) -> int:
+    """Ingest new events from every log (rotated segments first). Returns events added."""
+    return sum(
+        ingest_source(conn, path, is_active, log_name)
+        for log_name in LOG_KINDS
+        for path, is_active in log_sources(log_dir, log_name)
+    )
+
+
+# ----------------- Queries -----------------
+# Reviewer overrides are logged with the pseudo doc_type 'review_override' /
+# reason 'review_reject'; they are not uploads, so upload stats skip them.
+
+def docs_per_type_per_hour(conn, since: str, until: str) -> list[tuple]:
+    return conn.execute("""
+        SELECT hour, doc_type, COUNT(*) AS documents
+        FROM events
+        WHERE kind = 'processed' AND ts >= ? AND ts < ? AND doc_type != 'review_override'
+        GROUP BY hour, doc_type
+        ORDER BY hour, documents DESC;
+    """, (since, until)).fetchall()
+
+
+def top_flagged_users(conn, since: str, until: str, limit: int) -> list[tuple]:
+    return conn.execute("""
+        SELECT user_id, COUNT(*) AS flags,
+               SUM(action = 'auto_reject') AS auto_rejected,
+               SUM(action = 'flagged_for_review') AS sent_to_review
+        FROM events
+        WHERE kind = 'flagged' AND ts >= ? AND ts < ? AND reason != 'review_reject'
+        GROUP BY user_id
+        ORDER BY flags DESC, user_id
+        LIMIT ?;
+    """, (since, until, limit)).fetchall()
+
+
+def rejection_rate_by_role(conn, since: str, until: str) -> list[tuple]:
+    return conn.execute("""
+        SELECT COALESCE(role, 'unknown') AS role,
+               COUNT(*) AS uploads,
+               SUM(kind = 'flagged' AND action = 'auto_reject') AS rejected,
+               ROUND(100.0 * SUM(kind = 'flagged' AND action = 'auto_reject') / COUNT(*), 2) AS rejection_pct
+        FROM events
+        WHERE ts >= ? AND ts < ?
+          AND ((kind = 'processed' AND doc_type != 'review_override')
+               OR (kind = 'flagged' AND reason != 'review_reject'))
+        GROUP BY 1
+        ORDER BY rejection_pct DESC;
+    """, (since, until)).fetchall()
+
+
+def _print_table(headers: list[str], rows: list[tuple]):
+    table = [headers] + [["" if v is None else str(v) for v in row] for row in rows]
+    widths = [max(len(r[i]) for r in table) for i in range(len(headers))]
+    for i, r in enumerate(table):
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+        if i == 0:
+            print("  ".join("-" * w for w in widths))
+
+
+def _window(args) -> tuple[str, str]:
+    until = args.until or "9999"
+    if args.since:
+        return args.since, until
+    if args.hours:
+        return (datetime.utcnow() - timedelta(hours=args.hours)).isoformat(), until
+    return "", until
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate the NoteGPT event logs.")
+    parser.add_argument("query", choices=["ingest", "docs-per-type", "top-flagged", "rejection-rate"])
+    parser.add_argument("--since", help="start of the window (ISO date/time, UTC)")
+    parser.add_argument("--until", help="end of the window, exclusive (ISO date/time, UTC)")
+    parser.add_argument("--hours", type=int, help="window = the last N hours")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--log-dir", default=LOG_DIR)
+    parser.add_argument("--db", default=ANALYTICS_DB_PATH)
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    started = time.perf_counter()
+    added = ingest(conn, args.log_dir)
+    print(f"Ingested {added} new events in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+    if args.query == "ingest":
+        sys.exit(0)
+
+    since, until = _window(args)
+    started = time.perf_counter()
+    if args.query == "docs-per-type":
+        _print_table(["hour", "doc_type", "documents"], docs_per_type_per_hour(conn, since, until))
+    elif args.query == "top-flagged":
+        _print_table(["user_id", "flags", "auto_rejected", "sent_to_review"],
+                     top_flagged_users(conn, since, until, args.limit))
+    else:
+        _print_table(["role", "uploads", "rejected", "rejection_pct"], rejection_rate_by_role(conn, since, until))
+    print(f"Query took {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
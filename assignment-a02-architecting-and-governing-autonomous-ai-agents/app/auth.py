@@ -1,18 +1,94 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 import jwt
+import time
+import heapq
+import threading
+from collections import OrderedDict
 from typing import Tuple
 
 # Choose a strong secret key in production!
 SECRET_KEY = "supersecretkey"
 ALGORITHM = "HS256"
 
+# Verified tokens kept per process (0 disables the cache)
+TOKEN_CACHE_SIZE = 10_000
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+
+class TokenCache:
+    """
+    Bounded LRU of already-verified tokens → (user_id, role), each entry
+    dropped at its token's `exp`. A lookup at or after `exp` is a miss (the
+    token is then decoded again and rejected as expired), so a cached token
+    never outlives its expiry. Tokens without `exp` are not cached.
+    """
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[float, Tuple[str, str]]] = OrderedDict()
+        self._expiries: list[tuple[float, str]] = []    # min-heap of (exp, token)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str, now: float | None = None) -> Tuple[str, str] | None:
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, identity: Tuple[str, str], exp, now: float | None = None):
+        now = time.time() if now is None else now
+        if self.maxsize <= 0 or not isinstance(exp, (int, float)) or exp <= now:
+            return
+        with self._lock:
+            self._evict_expired(now)
+            self._entries[token] = (exp, identity)
+            self._entries.move_to_end(token)
+            heapq.heappush(self._expiries, (exp, token))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            # Heap items of LRU-evicted tokens linger until their exp; rebuild
+            # once they dominate so the heap stays O(maxsize)
+            if len(self._expiries) > 2 * self.maxsize:
+                self._expiries = [(e, t) for t, (e, _) in self._entries.items()]
+                heapq.heapify(self._expiries)
+
+    def _evict_expired(self, now: float):
+        while self._expiries and self._expiries[0][0] <= now:
+            exp, token = heapq.heappop(self._expiries)
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] == exp:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._expiries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+token_cache = TokenCache()
+
 def validate_jwt_and_get_role(token: str = Depends(oauth2_scheme)) -> Tuple[str, str]:
     """
     Decode the JWT, ensure it's valid, and return (user_id, role).
+    Tokens verified before (and not yet expired) are answered from token_cache.
     """
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("user_id")
@@ -23,6 +99,7 @@ def validate_jwt_and_get_role(token: str = Depends(oauth2_scheme)) -> Tuple[str,
                 detail="Invalid token: missing user_id or role",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        token_cache.put(token, (user_id, role), payload.get("exp"))
         return user_id, role
     except jwt.ExpiredSignatureError:
         raise HTTPException(
@@ -0,0 +1,240 @@
+import io
+import json
+import lzma
+import zlib
+import asyncio
+import tarfile
+import zipfile
+import mimetypes
+import posixpath
+
+from fastapi import HTTPException, UploadFile
+
+from app.agent_logic import process_document, generate_doc_id, log_event_flagged
+from app.cache import get_policy_snapshot
+from app.metrics import RATE_LIMITED, count_document
+from app.rate_limit import acquire_document
+
+BATCH_CONCURRENCY = 8           # documents processed concurrently per batch by default
+BATCH_MAX_CONCURRENCY = 32
+BATCH_MAX_FILES = 500           # files (or archive members) accepted per batch
+
+ZIP_SUFFIXES = (".zip",)
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# Errors raised while opening or decompressing a single member: encrypted zip
+# members (RuntimeError), unsupported compression methods, corrupt or truncated
+# data (bz2 raises OSError) and bad CRCs.
+MEMBER_ERRORS = (RuntimeError, NotImplementedError, zlib.error, lzma.LZMAError, EOFError, OSError,
+                 zipfile.BadZipFile, tarfile.TarError)
+
+
+class MemberUpload:
+    """
+    An archive member held in memory that quacks like fastapi.UploadFile for
+    process_document (filename, content_type and an async read(size)).
+    `data` is None when the member was larger than the role's byte ceiling or
+    could not be read; `error` then says why it could not be read.
+    """
+
+    def __init__(self, filename: str, data: bytes | None, size: int, error: str | None = None):
+        self.filename = filename
+        self.content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        self.size = size
+        self._buffer = io.BytesIO(data or b"")
+        self.error = error
+        self.oversize = data is None and error is None
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._buffer.read(size)
+
+
+def archive_kind(upload: UploadFile) -> str | None:
+    """'zip', 'tar' or None (a regular document)."""
+    name = (upload.filename or "").lower()
+    if name.endswith(ZIP_SUFFIXES) or upload.content_type in ("application/zip", "application/x-zip-compressed"):
+        return "zip"
+    if name.endswith(TAR_SUFFIXES) or upload.content_type in ("application/x-tar", "application/gzip"):
+        return "tar"
+    return None
+
+
+def _skip_member(name: str) -> bool:
+    # Directories are filtered by the callers; also skip macOS metadata and dotfiles
+    base = posixpath.basename(name.rstrip("/"))
+    return not base or base.startswith(".") or name.startswith("__MACOSX/")
+
+
+def _read_bounded(stream, max_bytes: int) -> bytes | None:
+    data = stream.read(max_bytes + 1)
+    return None if len(data) > max_bytes else data
+
+
+def iter_archive_members(fileobj, kind: str, max_bytes: int):
+    """
+    Yield a MemberUpload per regular file in a zip or tar archive, reading
+    (decompressing) members one at a time straight from the upload, without
+    extracting to disk. At most max_bytes + 1 bytes of a member are ever
+    decompressed, so an archive bomb costs no more than an oversize upload.
+    A member that can't be read (MEMBER_ERRORS) is yielded with `error` set;
+    a zip continues with its next member, while a tar stream stops there,
+    since nothing after a corrupt block can be located.
+    Blocking: iterate from a worker thread.
+    """
+    if kind == "zip":
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or _skip_member(info.filename):
+                    continue
+                try:
+                    with zf.open(info) as member:
+                        data = _read_bounded(member, max_bytes)
+                except MEMBER_ERRORS as e:
+                    yield MemberUpload(info.filename, None, info.file_size, error=str(e) or type(e).__name__)
+                    continue
+                yield MemberUpload(info.filename, data, info.file_size)
+    else:
+        # Stream mode ('r|*'): one forward pass, works for compressed tars too
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+            for info in tf:
+                if not info.isfile() or _skip_member(info.name):
+                    continue
+                try:
+                    data = _read_bounded(tf.extractfile(info), max_bytes)
+                except MEMBER_ERRORS as e:
+                    yield MemberUpload(info.name, None, info.size, error=str(e) or type(e).__name__)
+                    return
+                yield MemberUpload(info.name, data, info.size)
+
+
+async def _process_one(user_id: str, role: str, index: int, upload) -> dict:
+    """Run the normal pipeline on one file; governance outcomes become per-file results."""
+    line = { "index": index, "filename": upload.filename }
+    try:
+        # Members rejected before the pipeline are logged and counted like
+        # process_document's own 413s
+        if getattr(upload, "error", None):
+            log_event_flagged(generate_doc_id(), user_id, "archive_member_unreadable", role)
+            count_document("rejected", None, role)
+            raise HTTPException(status_code=422, detail=f"Could not read archive member: {upload.error}")
+        if getattr(upload, "oversize", False):
+            log_event_flagged(generate_doc_id(), user_id, "upload_size_exceeded", role)
+            count_document("rejected", None, role)
+            max_bytes = get_policy_snapshot().max_upload_bytes_for(role)
+            raise HTTPException(status_code=413, detail=f"Upload exceeds the {max_bytes}-byte limit for this role")
+        line.update(await process_document(user_id, role, upload))
+    except HTTPException as he:
+        line.update({ "status": "rejected", "status_code": he.status_code, "detail": he.detail })
+    except Exception as e:
+        line.update({ "status": "error", "status_code": 500, "detail": f"Internal processing error: {str(e)}" })
+    return line
+
+
+async def _iter_uploads(files: list[UploadFile], role: str):
+    """Yield the documents of a batch: each archive member, or each plain file."""
+    max_bytes = get_policy_snapshot().max_upload_bytes_for(role)
+    for upload in files:
+        kind = archive_kind(upload)
+        if kind is None:
+            yield upload
+            continue
+        members = iter_archive_members(upload.file, kind, max_bytes)
+        try:
+            while True:
+                member = await asyncio.to_thread(next, members, None)
+                if member is None:
+                    break
+                yield member
+        except MEMBER_ERRORS as e:
+            raise HTTPException(status_code=400, detail=f"Invalid {kind} archive '{upload.filename}': {e}")
+        finally:
+            members.close()
+
+
+async def run_batch(user_id: str, role: str, files: list[UploadFile], concurrency: int = BATCH_CONCURRENCY):
+    """
+    Process every document of a batch through process_document with at most
+    `concurrency` in flight, yielding one NDJSON line per document as it
+    finishes, then a summary line (always, with an "error" if the batch stopped
+    early). The concurrent pipelines' writes are merged by the group-commit
+    writer, so a batch commits in a few grouped transactions rather than one
+    per file. Every document after the first takes a rate-limit token (the
+    request itself paid for the first); when the user's bucket is empty the
+    batch stops there with `rate_limited` and `retry_after` in the summary.
+    A member is only read out of the
+    archive once a slot is free, which bounds memory to `concurrency` files.
+    """
+    slots = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue()
+    counts: dict[str, int] = {}
+    truncated = False
+    error = None
+    retry_after = None
+
+    async def run(index: int, upload):
+        try:
+            await results.put(await _process_one(user_id, role, index, upload))
+        finally:
+            slots.release()
+
+    async def produce():
+        nonlocal truncated, error, retry_after
+        tasks = []
+        index = 0
+        uploads = _iter_uploads(files, role)
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    upload = await uploads.__anext__()
+                except StopAsyncIteration:
+                    slots.release()
+                    break
+                if index >= BATCH_MAX_FILES:
+                    slots.release()
+                    truncated = True
+                    break
+                if index > 0:
+                    decision = await acquire_document(user_id, role)
+                    if not decision.allowed:
+                        slots.release()
+                        RATE_LIMITED.inc(role, decision.limit)
+                        truncated = True
+                        retry_after = decision.retry_after
+                        error = f"Rate limit reached after {index} documents"
+                        break
+                tasks.append(asyncio.create_task(run(index, upload)))
+                index += 1
+        except HTTPException as he:
+            error = he.detail
+        finally:
+            await uploads.aclose()
+            await asyncio.gather(*tasks)
+            await results.put(None)
+
+    def summary_line() -> str:
+        summary = { "done": True, "total": sum(counts.values()), "counts": counts, "truncated": truncated }
+        if error:
+            summary["error"] = error
+        if retry_after is not None:
+            summary["rate_limited"] = True
+            summary["retry_after"] = retry_after
+        return json.dumps(summary) + "\n"
+
+    producer = asyncio.create_task(produce())
+    finished = False
+    try:
+        while (line := await results.get()) is not None:
+            counts[line["status"]] = counts.get(line["status"], 0) + 1
+            yield json.dumps(line) + "\n"
+        await producer
+        finished = True
+    except Exception as e:
+        error = error or f"Internal batch error: {e}"
+        finished = True
+    finally:
+        producer.cancel()
+        # Not when the client went away (GeneratorExit) or the request was
+        # cancelled: an async generator can't yield while being closed
+        if finished:
+            yield summary_line()
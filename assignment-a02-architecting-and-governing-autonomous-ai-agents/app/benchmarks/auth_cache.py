@@ -0,0 +1,76 @@
+"""
+Per-request auth cost with and without the verified-token cache, and the
+cost of /token/'s user insert with and without the known-users set.
+
+    python -m app.benchmarks.auth_cache [--requests 20000] [--users 50]
+
+Each of --users tokens is validated --requests / --users times, as polling
+clients would; the user inserts run against a scratch database.
+"""
+import os
+import time
+import argparse
+import tempfile
+import datetime
+
+import jwt
+
+import app.db as db
+from app.auth import SECRET_KEY, ALGORITHM, token_cache, validate_jwt_and_get_role
+
+
+def make_tokens(users: int) -> list[str]:
+    exp = datetime.datetime.utcnow() + datetime.timedelta(hours=2)
+    return [jwt.encode({ "user_id": f"user{i}", "role": "PremiumUser", "exp": exp }, SECRET_KEY, algorithm=ALGORITHM)
+            for i in range(users)]
+
+
+def time_validate(tokens: list[str], requests: int, cached: bool) -> float:
+    """Mean microseconds per validate_jwt_and_get_role call."""
+    token_cache.clear()
+    start = time.perf_counter()
+    for i in range(requests):
+        if not cached:
+            token_cache.clear()
+        validate_jwt_and_get_role(tokens[i % len(tokens)])
+    return (time.perf_counter() - start) * 1e6 / requests
+
+
+def time_user_inserts(users: int, requests: int, known_users: bool) -> float:
+    """Mean microseconds per /token/ user insert."""
+    db._known_users.clear()
+    insert = db.ensure_user if known_users else db.insert_user
+    start = time.perf_counter()
+    for i in range(requests):
+        user_id = f"user{i % users}"
+        insert(user_id, user_id, "PremiumUser", "Premium")
+    return (time.perf_counter() - start) * 1e6 / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    tokens = make_tokens(args.users)
+    uncached = time_validate(tokens, args.requests, cached=False)
+    cached = time_validate(tokens, args.requests, cached=True)
+    print(f"Token validation ({args.users} tokens, {args.requests} requests)")
+    print(f"  decode + verify every time:  {uncached:8.2f} us/request")
+    print(f"  verified-token cache:        {cached:8.2f} us/request   ({uncached / cached:.1f}x faster)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db._pool = db.ConnectionPool(os.path.join(tmp, "bench.db"))
+        db.initialize_database()
+        inserts = args.requests // 10
+        always = time_user_inserts(args.users, inserts, known_users=False)
+        skipped = time_user_inserts(args.users, inserts, known_users=True)
+        db._pool.close_all()
+    print(f"User insert on /token/ ({args.users} users, {inserts} token issues)")
+    print(f"  INSERT OR IGNORE every time: {always:8.2f} us/issue")
+    print(f"  known-users set:             {skipped:8.2f} us/issue   ({always / skipped:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
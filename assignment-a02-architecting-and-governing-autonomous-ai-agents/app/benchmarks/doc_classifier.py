@@ -0,0 +1,76 @@
+"""
+Accuracy and throughput of the document-type classifiers: the keyword
+heuristic against the linear model in app/models/doc_classifier.npz.
+
+    python -m app.benchmarks.doc_classifier [--per-class 500] [--seed 99] [--batch-size 256]
+
+The evaluation corpus is synthetic: it comes from the same generator as the
+training data, only with a different seed (app.classifier train uses seed 1).
+Its accuracy shows that the model learned the generator, not how it does on
+real uploads. The only real, hand-labelled documents are the few
+test-documents/ files, scored separately. Throughput is measured one document
+at a time and in batches of --batch-size.
+"""
+import time
+import argparse
+
+from app.classifier import DOC_TYPES, Classifier, HeuristicClassifier, LinearClassifier
+from app.benchmarks.doc_corpus import generate_corpus, test_documents
+
+
+def accuracy(predicted: list[str], labels: list[str]) -> float:
+    return sum(p == l for p, l in zip(predicted, labels)) / len(labels)
+
+
+def per_class_recall(predicted: list[str], labels: list[str]) -> dict[str, float]:
+    recall = {}
+    for doc_type in DOC_TYPES:
+        rows = [p for p, l in zip(predicted, labels) if l == doc_type]
+        recall[doc_type] = sum(p == doc_type for p in rows) / len(rows) if rows else 0.0
+    return recall
+
+
+def throughput(classifier: Classifier, texts: list[str], batch_size: int) -> float:
+    """Documents per second, classifying batch_size documents per call."""
+    start = time.perf_counter()
+    if batch_size == 1:
+        for text in texts:
+            classifier.classify(text)
+    else:
+        for i in range(0, len(texts), batch_size):
+            classifier.classify_batch(texts[i:i + batch_size])
+    return len(texts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--per-class", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=99)
+    parser.add_argument("--batch-size", type=int, default=256)
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.per_class, seed=args.seed)
+    texts = [text for text, _ in corpus]
+    labels = [label for _, label in corpus]
+    samples = test_documents()
+    classifiers = [HeuristicClassifier(), LinearClassifier.load()]
+
+    print(f"Synthetic evaluation corpus: {len(texts)} generated documents ({args.per_class} per class, "
+          f"seed {args.seed}); test-docs: {len(samples)} real labelled documents")
+    print(f"{'':12}{'accuracy':>10}" + "".join(f"{t:>10}" for t in DOC_TYPES)
+          + f"{'test-docs':>11}{'1 by 1':>12}{f'batch {args.batch_size}':>12}")
+    for classifier in classifiers:
+        predicted = classifier.classify_batch(texts)
+        recall = per_class_recall(predicted, labels)
+        sample_hits = sum(p == l for p, (_, l) in zip(classifier.classify_batch([t for t, _ in samples]), samples))
+        single = throughput(classifier, texts, 1)
+        batched = throughput(classifier, texts, args.batch_size)
+        print(f"{classifier.name:12}{accuracy(predicted, labels):>10.3f}"
+              + "".join(f"{recall[t]:>10.3f}" for t in DOC_TYPES)
+              + f"{f'{sample_hits}/{len(samples)}':>11}{single:>10.0f}/s{batched:>10.0f}/s")
+    print("(accuracy and per-type recall are on the synthetic corpus only, not a measure of real-world "
+          "accuracy; throughput is documents per second)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+A labelled corpus for the document-type classifier, generated from sentence
+templates so it can be rebuilt anywhere without shipping data files.
+
+Every class draws its subject matter from the same topic list, so the topic
+alone gives nothing away, and a share of the documents carry the words that
+trip the old keyword heuristic: news stories about "the introduction of" a
+policy, slide decks that mention "references", memos about the "news".
+generate_corpus(n, seed) with different seeds gives disjoint train and
+evaluation sets.
+"""
+import os
+import random
+
+TOPICS = [
+    "renewable energy", "urban transit", "machine learning", "public health", "water supply",
+    "housing costs", "climate adaptation", "online education", "supply chains", "data privacy",
+    "small businesses", "crop yields", "cybersecurity", "tourism", "electric vehicles",
+    "remote work", "river pollution", "vaccination", "broadband access", "food prices",
+    "artificial intelligence", "education", "classroom technology", "automated grading", "student wellbeing",
+]
+PLACES = ["Denver", "Lagos", "Osaka", "Lyon", "Toronto", "Pune", "Leeds", "Santiago", "Perth", "Gdansk"]
+PEOPLE = ["Maria Lopez", "James Chen", "Aisha Bello", "Tom Becker", "Priya Nair", "Lena Novak", "Omar Haddad"]
+NUMBERS = ["12", "37", "4.5", "68", "250", "1,200", "9", "83", "15,000", "2.3"]
+
+ACADEMIC = [
+    "In this paper we investigate the relationship between {topic} and regional outcomes.",
+    "We propose a framework for modelling {topic} using longitudinal data.",
+    "Our results indicate a statistically significant effect (p < 0.05) across {n} cohorts.",
+    "Prior work (Smith et al., 2019; {person} et al., 2021) has examined {topic} in isolation.",
+    "The methodology combines a survey of {n} participants with a regression analysis.",
+    "Section 3 describes the dataset, and Section 4 reports the empirical findings.",
+    "We hypothesize that {topic} mediates the observed variance in the outcome variable.",
+    "Table 2 summarizes the descriptive statistics for the sample.",
+    "These findings contribute to the literature on {topic} and suggest directions for future research.",
+    "Limitations of this study include the cross-sectional design and self-reported measures.",
+    "The proposed estimator is consistent under mild assumptions, as shown in Appendix B.",
+    "We evaluate the model on a held-out test set and report precision and recall.",
+    "Keywords: {topic}; empirical analysis; policy evaluation.",
+    "Data were collected between 2018 and 2022 and analysed with mixed-effects models.",
+    "Theoretical implications for {topic} are discussed in the conclusion.",
+    "This paper explores the impact of {topic} on modern institutions.",
+    "This study aims to examine both the practical applications and theoretical implications of {topic}.",
+    "We analyze recent trends, benefits, and potential drawbacks of {topic}.",
+    "Empirical evidence on {topic} remains limited, motivating the present study.",
+    "The remainder of this paper is organized as follows.",
+    "Future research should address the ethical considerations raised by {topic}.",
+]
+# Inline "Heading: text" paragraphs, as in many plain-text papers
+ACADEMIC_INLINE_HEADINGS = ["Abstract", "Introduction", "Background", "Methodology", "Findings",
+                            "Discussion", "Conclusion"]
+ACADEMIC_HEADINGS = ["Abstract", "1. Introduction", "2. Related Work", "3. Methods", "4. Results",
+                     "5. Discussion", "6. Conclusion", "References"]
+ACADEMIC_REFERENCES = [
+    "[{i}] {person}. A study of {topic}. Journal of Applied Research, {n}(2), 2020.",
+    "[{i}] {person} and others. Revisiting {topic}. Proceedings of the Annual Conference, 2021.",
+]
+
+NEWS = [
+    "{place} officials announced on Tuesday a new plan to address {topic}.",
+    "The mayor said the city would spend ${n} million over the next three years.",
+    "According to a report released Monday, {topic} costs rose {n} percent last year.",
+    "\"We are committed to getting this right,\" a spokesperson told reporters.",
+    "Critics of the measure, including {person}, warned it could delay other projects.",
+    "The announcement comes weeks after protests outside city hall in {place}.",
+    "Shares of local firms fell {n} percent in early trading after the news.",
+    "The council is expected to vote on the proposal next month.",
+    "Residents interviewed on Wednesday were divided over the plan.",
+    "The introduction of the new rules has been postponed until spring, officials said.",
+    "{person}, who chairs the committee, declined to comment on Thursday.",
+    "Police said no one was injured in the incident, which is under investigation.",
+    "The governor is scheduled to visit {place} on Friday to discuss {topic}.",
+    "Economists said the figures were better than expected.",
+    "The story was first reported by a local newspaper in {place}.",
+]
+NEWS_LEADS = ["{place} — ", "{place} (Reuters) — ", "BREAKING: ", "UPDATED {n}:00 — ", ""]
+
+SLIDES = [
+    "{topic}: where we are", "Agenda", "Key takeaways", "Next steps", "Q{q} roadmap",
+    "Why {topic} matters", "Timeline", "Budget overview", "Risks and mitigations", "Team",
+    "Questions?", "Thank you!", "Goals for Q{q}", "Metrics we track", "Open issues",
+]
+SLIDE_BULLETS = [
+    "{n}% growth in {topic}", "Launch pilot in {place}", "Owner: {person}", "Hire 2 engineers",
+    "Reduce costs by {n}%", "Ship v2 by end of Q{q}", "Customer interviews", "Review vendor contracts",
+    "Align with legal on {topic}", "Dashboard for weekly metrics", "References: see appendix",
+    "Intro to {topic}", "Pilot results", "Stakeholder feedback", "Decision needed",
+]
+
+OTHER = [
+    "Hi team, just a reminder that the {topic} meeting moved to Thursday at 3pm.",
+    "Preheat the oven to 180 degrees and grease a large baking tray.",
+    "Add the flour gradually and stir until the mixture is smooth.",
+    "Thanks for your order! Your package will ship within {n} business days.",
+    "She looked out over the harbour in {place} and wondered whether he would come back.",
+    "Please find attached the invoice for last month's {topic} consulting work.",
+    "Dear {person}, I am writing to follow up on our conversation last week.",
+    "To reset your password, click the link below and follow the instructions.",
+    "The hotel is a short walk from the old town and has free breakfast.",
+    "Let me know if you have any news about the contract.",
+    "Step {q}: tighten the screws and attach the side panel.",
+    "Our book club will discuss the second half of the novel next week.",
+    "Warranty: this product is covered for {n} months from the date of purchase.",
+    "Minutes: attendees agreed to revisit the {topic} budget in the next session.",
+    "Cheers, and have a great weekend!",
+    "This document is a placeholder for testing purposes only.",
+    "The attached file contains a draft that should not be shared outside the team.",
+]
+
+
+MIXED_BANKS = [ACADEMIC, NEWS, OTHER]
+
+
+def _fill(template: str, rng: random.Random, i: int = 1) -> str:
+    return template.format(topic=rng.choice(TOPICS), place=rng.choice(PLACES), person=rng.choice(PEOPLE),
+                           n=rng.choice(NUMBERS), q=rng.randint(1, 4), i=i)
+
+
+def _mix_in(paragraphs: list[str], rng: random.Random) -> list[str]:
+    """Occasionally append a sentence from another class's bank."""
+    return [p + " " + _fill(rng.choice(rng.choice(MIXED_BANKS)), rng) if rng.random() < 0.15 else p
+            for p in paragraphs]
+
+
+def _sentences(bank: list[str], count: int, rng: random.Random) -> list[str]:
+    return [_fill(rng.choice(bank), rng) for _ in range(count)]
+
+
+def _references(rng: random.Random) -> str:
+    return "\n".join(_fill(rng.choice(ACADEMIC_REFERENCES), rng, i) for i in range(1, rng.randint(3, 8)))
+
+
+def academic(rng: random.Random) -> str:
+    parts = []
+    style = rng.random()
+    if style < 0.4:
+        for heading in ACADEMIC_HEADINGS:
+            body = _references(rng) if heading == "References" else " ".join(_sentences(ACADEMIC, rng.randint(2, 6), rng))
+            parts.append(f"{heading}\n{body}")
+    elif style < 0.8:
+        for heading in ACADEMIC_INLINE_HEADINGS[:rng.randint(2, len(ACADEMIC_INLINE_HEADINGS))]:
+            parts.append(f"{heading}: " + " ".join(_sentences(ACADEMIC, rng.randint(1, 5), rng)))
+        if rng.random() < 0.7:
+            parts.append("References:\n" + _references(rng))
+    else:   # no headings at all
+        parts = [" ".join(_sentences(ACADEMIC, rng.randint(2, 5), rng)) for _ in range(rng.randint(1, 4))]
+    return "\n\n".join(_mix_in(parts, rng))
+
+
+def news(rng: random.Random) -> str:
+    headline = _fill(rng.choice(NEWS), rng).rstrip(".")
+    paragraphs = [" ".join(_sentences(NEWS, rng.randint(1, 3), rng)) for _ in range(rng.randint(3, 8))]
+    paragraphs[0] = _fill(rng.choice(NEWS_LEADS), rng) + paragraphs[0]
+    paragraphs = _mix_in(paragraphs, rng)
+    text = headline + "\n\n" + "\n\n".join(paragraphs)
+    if rng.random() < 0.1:
+        text = f"<!DOCTYPE html><html><body><h1>{headline}</h1><p>" + "</p><p>".join(paragraphs) + "</p></body></html>"
+    return text
+
+
+def slides(rng: random.Random) -> str:
+    slides_out = []
+    for number in range(1, rng.randint(2, 9)):
+        bullets = "\n".join(rng.choice(["- ", "• ", "* "]) + _fill(rng.choice(SLIDE_BULLETS), rng)
+                            for _ in range(rng.randint(2, 5)))
+        title = _fill(rng.choice(SLIDES), rng)
+        slides_out.append(f"Slide {number}: {title}\n{bullets}" if rng.random() < 0.5 else f"{title}\n{bullets}")
+    return "\n\n".join(slides_out)
+
+
+def other(rng: random.Random) -> str:
+    paragraphs = [" ".join(_sentences(OTHER, rng.randint(1, 4), rng)) for _ in range(rng.randint(1, 5))]
+    return "\n\n".join(_mix_in(paragraphs, rng))
+
+
+GENERATORS = { "academic": academic, "news": news, "slides": slides, "other": other }
+
+
+def generate_corpus(per_class: int, seed: int = 0) -> list[tuple[str, str]]:
+    """per_class documents of each type as (text, label), shuffled."""
+    rng = random.Random(seed)
+    corpus = [(generate(rng), label) for label, generate in GENERATORS.items() for _ in range(per_class)]
+    rng.shuffle(corpus)
+    return corpus
+
+
+# The hand-written files in test-documents/ and their types
+TEST_DOCUMENT_LABELS = {
+    "test_academic.txt": "academic",
+    "large_test_academic.txt": "academic",
+    "test_flagged.txt": "other",
+}
+TEST_DOCUMENTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "test-documents")
+
+
+def test_documents() -> list[tuple[str, str]]:
+    corpus = []
+    for name, label in TEST_DOCUMENT_LABELS.items():
+        with open(os.path.join(TEST_DOCUMENTS_DIR, name), encoding="utf-8") as f:
+            corpus.append((f.read(), label))
+    return corpus
@@ -0,0 +1,108 @@
+"""
+Compare database size with raw text stored inline in documents.raw_text
+(the old layout) versus compressed out-of-row in document_texts.
+
+    python -m app.benchmarks.raw_text_storage [--copies 200]
+
+Each file in test-documents/ is inserted --copies times into two scratch
+databases, which are then VACUUMed and measured.
+"""
+import os
+import time
+import uuid
+import sqlite3
+import argparse
+import tempfile
+
+from app.db import compress_text, TEXT_CODEC
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "test-documents")
+
+
+def load_corpus() -> list[str]:
+    texts = []
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+            texts.append(f.read())
+    return texts
+
+
+def build_inline(path: str, texts: list[str], copies: int):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE documents (
+            doc_id TEXT PRIMARY KEY, user_id TEXT, original_filename TEXT, raw_text TEXT,
+            doc_type TEXT, status TEXT, created_at TIMESTAMP, updated_at TIMESTAMP
+        );
+    """)
+    with conn:
+        for _ in range(copies):
+            for text in texts:
+                conn.execute("INSERT INTO documents VALUES (?, 'u', 'f.txt', ?, 'academic', 'completed', '', '');",
+                             (str(uuid.uuid4()), text))
+    conn.execute("VACUUM;")
+    conn.close()
+
+
+def build_out_of_row(path: str, texts: list[str], copies: int):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE documents (
+            doc_id TEXT PRIMARY KEY, user_id TEXT, original_filename TEXT, raw_size INTEGER,
+            doc_type TEXT, status TEXT, created_at TIMESTAMP, updated_at TIMESTAMP
+        );
+    """)
+    conn.execute("""
+        CREATE TABLE document_texts (
+            doc_id TEXT PRIMARY KEY, codec TEXT NOT NULL, raw_size INTEGER NOT NULL, data BLOB NOT NULL
+        );
+    """)
+    with conn:
+        for _ in range(copies):
+            for text in texts:
+                doc_id = str(uuid.uuid4())
+                raw_size = len(text.encode("utf-8"))
+                conn.execute("INSERT INTO documents VALUES (?, 'u', 'f.txt', ?, 'academic', 'completed', '', '');",
+                             (doc_id, raw_size))
+                conn.execute("INSERT INTO document_texts VALUES (?, ?, ?, ?);",
+                             (doc_id, TEXT_CODEC, raw_size, compress_text(text)))
+    conn.execute("VACUUM;")
+    conn.close()
+
+
+def table_scan_ms(path: str) -> float:
+    """Time a status scan over documents (what status updates/digest joins walk)."""
+    conn = sqlite3.connect(path)
+    start = time.perf_counter()
+    for _ in range(20):
+        conn.execute("SELECT count(*) FROM documents WHERE status = 'completed';").fetchone()
+    elapsed = (time.perf_counter() - start) * 1000 / 20
+    conn.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=200)
+    args = parser.parse_args()
+
+    texts = load_corpus()
+    raw_bytes = sum(len(t.encode("utf-8")) for t in texts) * args.copies
+    with tempfile.TemporaryDirectory() as tmp:
+        inline_db = os.path.join(tmp, "inline.db")
+        out_of_row_db = os.path.join(tmp, "out_of_row.db")
+        build_inline(inline_db, texts, args.copies)
+        build_out_of_row(out_of_row_db, texts, args.copies)
+        inline_size = os.path.getsize(inline_db)
+        out_of_row_size = os.path.getsize(out_of_row_db)
+        inline_scan = table_scan_ms(inline_db)
+        out_of_row_scan = table_scan_ms(out_of_row_db)
+
+    print(f"Corpus: {len(texts)} files x {args.copies} copies = {raw_bytes / 1024:.1f} KiB of text")
+    print(f"Inline raw_text DB:        {inline_size / 1024:10.1f} KiB   status scan {inline_scan:.2f} ms")
+    print(f"Compressed out-of-row DB:  {out_of_row_size / 1024:10.1f} KiB   status scan {out_of_row_scan:.2f} ms")
+    print(f"Size reduction: {100 * (1 - out_of_row_size / inline_size):.1f}%")
+
+
+if __name__ == "__main__":
+    main()
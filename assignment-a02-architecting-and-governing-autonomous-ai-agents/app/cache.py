@@ -1,65 +1,461 @@
 import redis
+import redis.asyncio
+import redis.asyncio.retry
+import redis.backoff
 import json
-from app.db import fetch_policies
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+from app.db import fetch_policies, run_in_db
+from app.matcher import KeywordMatcher
+from app.metrics import timed
 
-# Connect to Redis (host and port can be changed if needed)
-redis_client = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+REDIS_HOST = "localhost"
+REDIS_PORT = 6379
+REDIS_MAX_CONNECTIONS = 64
+# Evictable caches (the summary cache tier) live on a separate instance run
+# with maxmemory-policy allkeys-lru. The main instance above runs noeviction,
+# so job status hashes, review index keys and rate-limit buckets are never
+# evicted (see docker-compose.yml).
+REDIS_CACHE_HOST = "localhost"
+REDIS_CACHE_PORT = 6380
+REDIS_CACHE_TIMEOUT = 0.5           # seconds; a slow cache is skipped, not waited on
 
+# Pub/sub channel on which policy writers announce a new policy version
+POLICY_INVALIDATION_CHANNEL = "policy_invalidations"
+DEFAULT_MAX_WORDS_FREE = 2000
+# Hard ceiling on upload size per role (policy key 'max_upload_bytes', JSON
+# object { role: bytes }); "default" applies to roles not listed.
+DEFAULT_MAX_UPLOAD_BYTES = {
+    "FreeUser": 2 * 1024 * 1024,
+    "PremiumUser": 50 * 1024 * 1024,
+    "default": 10 * 1024 * 1024,
+}
+# Most pages a PDF upload may have per role (policy key 'max_pdf_pages', same
+# shape as max_upload_bytes); longer PDFs are rejected before extraction.
+DEFAULT_MAX_PDF_PAGES = {
+    "FreeUser": 20,
+    "PremiumUser": 500,
+    "default": 100,
+}
 
-def load_policies_into_cache():
+
+class RateLimit(NamedTuple):
+    requests_per_minute: float      # per-user token bucket refill rate
+    burst: int                      # per-user bucket size
+    max_concurrent: int             # per-user documents in flight (0 = unlimited)
+    role_requests_per_minute: float = 0     # shared by every user of the role (0 = unlimited)
+    role_burst: int = 0                     # defaults to role_requests_per_minute
+    max_queued_jobs: int = 0                # per-user async jobs not yet finished (0 = unlimited)
+
+
+# Submission limits per role (policy key 'rate_limits', JSON object
+# { role: { field: value } } with RateLimit's fields; fields left out keep
+# these defaults). "default" applies to roles not listed.
+DEFAULT_RATE_LIMITS = {
+    "FreeUser": RateLimit(requests_per_minute=10, burst=5, max_concurrent=2, max_queued_jobs=5),
+    "PremiumUser": RateLimit(requests_per_minute=120, burst=30, max_concurrent=8, max_queued_jobs=50),
+    "default": RateLimit(requests_per_minute=60, burst=20, max_concurrent=4, max_queued_jobs=20),
+}
+
+# Swaps fully-built staged hashes into the live keys, but only if this version
+# is not older than what is already published (two writers racing can't roll
+# the mirror back). Runs atomically inside Redis.
+#   KEYS: policies, prohibited_keywords, templates, staged keywords, staged templates
+#   ARGV: policy_version, max_words_free
+_SWAP_POLICIES_LUA = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'policy_version') or '-1')
+if tonumber(ARGV[1]) < current then
+    redis.call('DEL', KEYS[4], KEYS[5])
+    return 0
+end
+if redis.call('EXISTS', KEYS[4]) == 1 then
+    redis.call('RENAME', KEYS[4], KEYS[2])
+else
+    redis.call('DEL', KEYS[2])
+end
+if redis.call('EXISTS', KEYS[5]) == 1 then
+    redis.call('RENAME', KEYS[5], KEYS[3])
+else
+    redis.call('DEL', KEYS[3])
+end
+redis.call('HSET', KEYS[1], 'max_words_free', ARGV[2], 'policy_version', ARGV[1])
+return 1
+"""
+
+# Connect to Redis (host and port can be changed if needed).
+# Synchronous client for scripts and the blocking consumer loop.
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+
+# Asyncio client for the request path; all coroutines share one connection pool.
+async_redis_pool = redis.asyncio.ConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=0,
+    decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
+)
+async_redis_client = redis.asyncio.Redis(connection_pool=async_redis_pool)
+
+# Asyncio client for the evictable cache instance.
+async_cache_redis_client = redis.asyncio.Redis(
+    host=REDIS_CACHE_HOST,
+    port=REDIS_CACHE_PORT,
+    db=0,
+    decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_connect_timeout=REDIS_CACHE_TIMEOUT,
+    socket_timeout=REDIS_CACHE_TIMEOUT,
+    retry=redis.asyncio.retry.Retry(redis.backoff.NoBackoff(), 0),
+)
+
+
+def _parse_json(value: str | None, default):
+    if value is None:
+        return default
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return default
+
+
+@dataclass(frozen=True)
+class PolicySnapshot:
     """
-    Load all policy data from SQLite into Redis Hashes for quick lookups.
-    Specifically:
-      - 'prohibited_keywords' → Redis Hash: key = keyword, value = 1
-      - 'max_words_free' → Redis Hash 'policies' field 'max_words_free'
-      - 'templates' → Redis Hash 'templates' with field 'template_<doc_type>'
+    Immutable view of the policies table at one policy version.
+    Requests read the current snapshot from process memory (no Redis or SQL
+    round trip); a new snapshot is swapped in whenever the version changes.
     """
-    policies = fetch_policies()  # { key_name: value }
+    version: int
+    prohibited_keywords: tuple[str, ...]
+    max_words_free: int
+    templates: Mapping[str, str]
+    max_upload_bytes: Mapping[str, int]
+    max_pdf_pages: Mapping[str, int]
+    rate_limits: Mapping[str, RateLimit]
+    matcher: KeywordMatcher = field(repr=False)
+    raw: Mapping[str, str] = field(repr=False)   # every key_name → value, unparsed
+
+    def max_upload_bytes_for(self, role: str) -> int:
+        return self.max_upload_bytes.get(role, self.max_upload_bytes["default"])
+
+    def max_pdf_pages_for(self, role: str) -> int:
+        return self.max_pdf_pages.get(role, self.max_pdf_pages["default"])
+
+    def rate_limit_for(self, role: str) -> RateLimit:
+        return self.rate_limits.get(role, self.rate_limits["default"])
+
+
+def _parse_rate_limits(value: str | None) -> dict[str, RateLimit]:
+    """DEFAULT_RATE_LIMITS overlaid with the policy; malformed roles keep their defaults."""
+    limits = dict(DEFAULT_RATE_LIMITS)
+    overrides = _parse_json(value, {})
+    if not isinstance(overrides, dict):
+        return limits
+    for role, fields in overrides.items():
+        base = limits.get(role, limits["default"])
+        try:
+            limit = base._replace(**fields)
+            limits[role] = RateLimit(
+                float(limit.requests_per_minute), int(limit.burst), int(limit.max_concurrent),
+                float(limit.role_requests_per_minute), int(limit.role_burst), int(limit.max_queued_jobs),
+            )
+        except (TypeError, ValueError):
+            continue
+    return limits
+
 
-    # 1) Prohibited keywords (stored as JSON array)
-    pk_json = policies.get("prohibited_keywords", "[]")
+def _role_limit(n) -> int | None:
+    """A per-role limit as a positive int, or None if it isn't one."""
+    if isinstance(n, bool):
+        return None
     try:
-        prohibited_list = json.loads(pk_json)
-    except json.JSONDecodeError:
-        prohibited_list = []
-    # Flush old prohibited list
-    redis_client.delete("prohibited_keywords")
-    for kw in prohibited_list:
-        redis_client.hset("prohibited_keywords", kw, 1)
-
-    # 2) max_words_free (store as integer in "policies" hash)
-    max_free = policies.get("max_words_free", "2000")
-    redis_client.hset("policies", "max_words_free", int(max_free))
-
-    # 3) templates stored as JSON object string, e.g. { "academic": "...", ... }
-    templates_json = policies.get("templates", "{}")
+        n = int(n)
+    except (TypeError, ValueError):
+        return None
+    return n if n > 0 else None
+
+
+def _parse_role_limits(value: str | None, defaults: dict[str, int]) -> dict[str, int]:
+    """defaults overlaid with the policy's {role: n}; malformed roles keep their defaults."""
+    limits = dict(defaults)
+    overrides = _parse_json(value, {})
+    if not isinstance(overrides, dict):
+        return limits
+    for role, n in overrides.items():
+        n = _role_limit(n)
+        if n is not None:
+            limits[role] = n
+    return limits
+
+
+def _log(msg: str):
+    print(f"[{datetime.utcnow().isoformat()}] [POLICY] {msg}")
+
+
+def _load_json(value: str):
     try:
-        templates_dict = json.loads(templates_json)
-    except json.JSONDecodeError:
-        templates_dict = {}
-    # Flush old templates
-    redis_client.delete("templates")
-    for doc_type, template_text in templates_dict.items():
-        redis_client.hset("templates", f"template_{doc_type}", template_text)
+        return json.loads(value)
+    except (TypeError, json.JSONDecodeError):
+        raise ValueError("not valid JSON")
+
+
+def _strict_keywords(value: str) -> tuple[str, ...]:
+    keywords = _load_json(value)
+    if not isinstance(keywords, list) or not all(isinstance(k, str) for k in keywords):
+        raise ValueError("expected a JSON array of strings")
+    return tuple(keywords)
+
+
+def _strict_templates(value: str) -> dict[str, str]:
+    templates = _load_json(value)
+    if not isinstance(templates, dict) or not all(isinstance(t, str) for t in templates.values()):
+        raise ValueError("expected a JSON object of doc_type → template string")
+    return templates
+
+
+def _strict_positive_int(value: str) -> int:
+    n = _role_limit(value)
+    if n is None:
+        raise ValueError("expected a positive integer")
+    return n
+
+
+def _strict_role_limits(value: str) -> dict[str, int]:
+    overrides = _load_json(value)
+    if not isinstance(overrides, dict):
+        raise ValueError("expected a JSON object of role → limit")
+    bad = [role for role, n in overrides.items() if _role_limit(n) is None]
+    if bad:
+        raise ValueError(f"limits must be positive integers (check {', '.join(sorted(bad))})")
+    return overrides
+
+
+def _strict_rate_limits(value: str) -> dict:
+    overrides = _load_json(value)
+    if not isinstance(overrides, dict) or not all(isinstance(f, dict) for f in overrides.values()):
+        raise ValueError("expected a JSON object of role → { field: value }")
+    for role, fields in overrides.items():
+        unknown = set(fields) - set(RateLimit._fields)
+        if unknown:
+            raise ValueError(f"unknown fields for {role}: {', '.join(sorted(unknown))}")
+        if any(isinstance(v, bool) or not isinstance(v, (int, float)) or v < 0 for v in fields.values()):
+            raise ValueError(f"fields for {role} must be non-negative numbers")
+    return overrides
+
+
+# key_name → strict parser of its stored value (raises ValueError if unusable).
+# update_policy rejects such values with 400; a snapshot build that still meets
+# one (e.g. written straight to SQLite) logs it and keeps the last good value.
+POLICY_PARSERS = {
+    "prohibited_keywords": _strict_keywords,
+    "templates": _strict_templates,
+    "max_words_free": _strict_positive_int,
+    "max_upload_bytes": _strict_role_limits,
+    "max_pdf_pages": _strict_role_limits,
+    "rate_limits": _strict_rate_limits,
+}
+
+
+def policy_value_error(key_name: str, value: str) -> str | None:
+    """Why value can't be stored under key_name, or None if it can (unknown keys are free-form)."""
+    parse = POLICY_PARSERS.get(key_name)
+    if parse is None:
+        return None
+    try:
+        parse(value)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def _parse_policy(policies: dict[str, str], key_name: str, fallback):
+    """policies[key_name] parsed, or `fallback` if it is missing or invalid (logged)."""
+    value = policies.get(key_name)
+    if value is None:
+        return fallback
+    try:
+        return POLICY_PARSERS[key_name](value)
+    except ValueError as e:
+        _log(f"Ignoring invalid '{key_name}' policy ({e}); keeping the last good value")
+        return fallback
+
+
+def _build_snapshot(policies: dict[str, str], previous: "PolicySnapshot | None") -> PolicySnapshot:
+    prohibited = _parse_policy(policies, "prohibited_keywords",
+                               previous.prohibited_keywords if previous is not None else ())
+    # The compiled matcher is only rebuilt when the keyword list itself changed
+    if previous is not None and previous.prohibited_keywords == prohibited:
+        matcher = previous.matcher
+    else:
+        matcher = KeywordMatcher(prohibited)
+    try:
+        version = int(policies.get("policy_version", 0))
+    except (TypeError, ValueError):
+        version = previous.version if previous is not None else 0
+    return PolicySnapshot(
+        version=version,
+        prohibited_keywords=prohibited,
+        max_words_free=_parse_policy(policies, "max_words_free",
+                                     previous.max_words_free if previous is not None else DEFAULT_MAX_WORDS_FREE),
+        templates=MappingProxyType(dict(_parse_policy(policies, "templates",
+                                                      previous.templates if previous is not None else {}))),
+        max_upload_bytes=MappingProxyType(
+            _parse_role_limits(policies.get("max_upload_bytes"), DEFAULT_MAX_UPLOAD_BYTES)
+        ),
+        max_pdf_pages=MappingProxyType(
+            _parse_role_limits(policies.get("max_pdf_pages"), DEFAULT_MAX_PDF_PAGES)
+        ),
+        rate_limits=MappingProxyType(_parse_rate_limits(policies.get("rate_limits"))),
+        matcher=matcher,
+        raw=MappingProxyType(dict(policies)),
+    )
+
+
+_snapshot: PolicySnapshot = _build_snapshot({}, None)
+_snapshot_lock = threading.Lock()
+
+
+@timed("cache.reload_policy_snapshot")
+def reload_policy_snapshot() -> PolicySnapshot:
+    """
+    Re-read the policies table and swap in a new snapshot (blocking; call via
+    run_in_db from async code). Requests already holding the old snapshot keep
+    a consistent view until they finish.
+    """
+    global _snapshot
+    policies = fetch_policies()  # { key_name: value }
+    with _snapshot_lock:
+        _snapshot = _build_snapshot(policies, _snapshot)
+    return _snapshot
+
+
+def get_policy_snapshot() -> PolicySnapshot:
+    """Returns the current in-process policy snapshot."""
+    return _snapshot
+
+
+@timed("cache.publish_policies_to_redis")
+async def publish_policies_to_redis(snapshot: PolicySnapshot) -> bool:
+    """
+    Mirror a policy snapshot into Redis Hashes for external tools (redis-cli,
+    dashboards):
+      - 'prohibited_keywords' → Redis Hash: key = keyword, value = 1
+      - 'templates' → Redis Hash 'templates' with field 'template_<doc_type>'
+      - 'policies' → Redis Hash with 'max_words_free' and 'policy_version'
+    The new hashes are written to staged keys and renamed into place by a Lua
+    script, all in one MULTI/EXEC pipeline: one network round trip however many
+    keywords there are, and readers never see an empty or half-written policy.
+    Returns False if a newer version was already published.
+    """
+    suffix = f"staged:{snapshot.version}:{uuid.uuid4().hex}"
+    staged_keywords = f"prohibited_keywords:{suffix}"
+    staged_templates = f"templates:{suffix}"
+
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        # 1) Prohibited keywords
+        if snapshot.prohibited_keywords:
+            pipe.hset(staged_keywords, mapping={ kw: 1 for kw in snapshot.prohibited_keywords })
+        # 2) templates, e.g. { "academic": "...", ... }
+        if snapshot.templates:
+            pipe.hset(staged_templates, mapping={
+                f"template_{doc_type}": template_text
+                for doc_type, template_text in snapshot.templates.items()
+            })
+        # 3) swap staged → live and stamp the version
+        pipe.eval(
+            _SWAP_POLICIES_LUA, 5,
+            "policies", "prohibited_keywords", "templates", staged_keywords, staged_templates,
+            snapshot.version, snapshot.max_words_free,
+        )
+        results = await pipe.execute()
+    return bool(results[-1])
+
+
+@timed("cache.load_policies_into_cache")
+async def load_policies_into_cache():
+    """
+    Load all policy data from SQLite into the in-process snapshot, and
+    publish it to the Redis mirror.
+    """
+    snapshot = await run_in_db(reload_policy_snapshot)
+    await publish_policies_to_redis(snapshot)
+
+
+@timed("cache.publish_policy_invalidation")
+async def publish_policy_invalidation(version: int):
+    """Tell every API/consumer process that policy `version` is now current."""
+    await async_redis_client.publish(POLICY_INVALIDATION_CHANNEL, str(version))
+
+
+def _policy_listener_loop():
+    while True:
+        pubsub = None
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(POLICY_INVALIDATION_CHANNEL)
+            # Invalidations may have been missed while (re)connecting
+            reload_policy_snapshot()
+            while True:
+                message = pubsub.get_message(timeout=1.0)
+                if message is None:
+                    continue
+                try:
+                    version = int(message["data"])
+                except (TypeError, ValueError):
+                    version = None
+                if version is None or version != _snapshot.version:
+                    reload_policy_snapshot()
+        except Exception as e:
+            print(f"[{datetime.utcnow().isoformat()}] Policy listener error: {e}; reconnecting")
+            time.sleep(1)
+        finally:
+            if pubsub is not None:
+                pubsub.close()
+
+
+_listener_thread = None
+
+
+def start_policy_listener() -> threading.Thread:
+    """
+    Start (once per process) a daemon thread that reloads the policy snapshot
+    whenever a new version is published on POLICY_INVALIDATION_CHANNEL.
+    """
+    global _listener_thread
+    if _listener_thread is None or not _listener_thread.is_alive():
+        _listener_thread = threading.Thread(target=_policy_listener_loop, name="policy-listener", daemon=True)
+        _listener_thread.start()
+    return _listener_thread
 
 
 def get_prohibited_keywords() -> list[str]:
     """
-    Returns the list of prohibited keywords from the Redis Hash.
+    Returns the list of prohibited keywords from the current policy snapshot.
+    """
+    return list(_snapshot.prohibited_keywords)
+
+
+def get_prohibited_matcher() -> KeywordMatcher:
+    """
+    Returns the compiled matcher for the currently loaded prohibited keywords.
     """
-    return list(redis_client.hkeys("prohibited_keywords"))
+    return _snapshot.matcher
 
 
 def get_max_words_free() -> int:
     """
-    Returns the integer value of 'max_words_free' from Redis Hash 'policies'.
+    Returns the integer value of 'max_words_free' from the current policy snapshot.
     """
-    val = redis_client.hget("policies", "max_words_free")
-    return int(val) if val is not None else 2000
+    return _snapshot.max_words_free
 
 
 def get_template_for_doc_type(doc_type: str) -> str | None:
     """
     Returns the template string for a given doc_type, or None if not set.
     """
-    return redis_client.hget("templates", f"template_{doc_type}")
+    return _snapshot.templates.get(doc_type)
@@ -0,0 +1,377 @@
+"""
+Document-type classification (academic / news / slides / other).
+
+The default classifier is a linear model over hashed bag-of-words features:
+each document's bounded prefix becomes a sparse vector of HASH_DIM hashed
+token counts (plus a few layout features such as line density and bullets),
+and a batch of documents is scored in one sparse NumPy product with the
+(HASH_DIM, n_labels) weight matrix.
+Weights are trained offline and loaded from CLASSIFIER_MODEL_PATH:
+
+    python -m app.classifier train              # writes app/models/doc_classifier.npz
+    python -m app.classifier classify FILE...
+
+The previous keyword heuristic remains available as HeuristicClassifier and
+is used when no model file exists.
+
+The pipeline classifies through `classify_async`: documents from concurrent
+pipelines (e.g. the members of one /submit_batch/) are queued to a single
+background thread that scores them together with one classify_batch call,
+the same way the group-commit writer merges their writes.
+"""
+import os
+import re
+import sys
+import zlib
+import time
+import queue
+import atexit
+import asyncio
+import argparse
+import threading
+from concurrent.futures import Future
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+DOC_TYPES = ("academic", "news", "slides", "other")
+CLASSIFIER_BACKEND = "linear"           # "linear" or "heuristic"
+CLASSIFIER_MODEL_PATH = os.path.join(os.path.dirname(__file__), "models", "doc_classifier.npz")
+CLASSIFIER_PREFIX_CHARS = 8000          # only this much of a document is read
+HASH_DIM = 2 ** 14                      # hashed feature space
+CLASSIFIER_BATCH_WAIT = 0.002           # seconds to wait for more documents after the first one arrives
+CLASSIFIER_MAX_BATCH = 64               # max documents scored in one classify_batch call
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# token → crc32, so each distinct word is hashed once per process
+_TOKEN_HASHES: dict[str, int] = {}
+_TOKEN_HASHES_MAX = 200_000
+
+
+def _log(msg: str):
+    print(f"[{datetime.utcnow().isoformat()}] [CLASSIFIER] {msg}")
+
+
+def classify_document_type(text: str) -> str:
+    """
+    Very simple keyword-based classification:
+      - If it contains "abstract" or "introduction" or "references" → academic
+      - If it has many line breaks and is shortish → slides
+      - If it looks like HTML or has "news" → news
+      - Else, "other"
+    """
+    lowered = text.lower()
+    if any(keyword in lowered for keyword in ["abstract", "introduction", "references"]):
+        return "academic"
+    if len(text) < 500 and text.count("\n") > 5:
+        return "slides"
+    if "<!doctype html" in lowered or "news" in lowered:
+        return "news"
+    return "other"
+
+
+def _bucket(value: float, edges: tuple) -> int:
+    return sum(value >= edge for edge in edges)
+
+
+def _layout_features(prefix: str) -> list[str]:
+    lines = [line.strip() for line in prefix.splitlines() if line.strip()]
+    n_lines = max(1, len(lines))
+    avg_line = sum(len(line) for line in lines) / n_lines
+    bullets = sum(line[0] in "-*•>" or line[:2].rstrip(".)").isdigit() for line in lines) / n_lines
+    features = [
+        f"__lines_{_bucket(len(lines), (3, 6, 12, 25, 50))}",
+        f"__avg_line_{_bucket(avg_line, (20, 40, 80, 160, 320))}",
+        f"__bullets_{_bucket(bullets, (0.1, 0.3, 0.6))}",
+        f"__length_{_bucket(len(prefix), (200, 500, 1500, 4000))}",
+    ]
+    if "<html" in prefix[:1000].lower() or "<!doctype" in prefix[:1000].lower():
+        features.append("__html")
+    return features
+
+
+def _token_hash(token: str) -> int:
+    value = _TOKEN_HASHES.get(token)
+    if value is None:
+        if len(_TOKEN_HASHES) >= _TOKEN_HASHES_MAX:
+            _TOKEN_HASHES.clear()
+        value = _TOKEN_HASHES[token] = zlib.crc32(token.encode())
+    return value
+
+
+def extract_features(text: str, prefix_chars: int = CLASSIFIER_PREFIX_CHARS,
+                     dim: int = HASH_DIM) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hashed bag-of-words of the text's first `prefix_chars` characters:
+    (feature indices, weights) with sublinear term frequency (1 + log tf),
+    L2-normalized. Tokens are hashed with crc32, which is stable across
+    processes (unlike hash()).
+    """
+    prefix = text[:prefix_chars]
+    counts: dict[int, int] = {}
+    for token, count in Counter(_TOKEN_RE.findall(prefix.lower())).items():
+        index = _token_hash(token) % dim
+        counts[index] = counts.get(index, 0) + count
+    for feature in _layout_features(prefix):
+        index = _token_hash(feature) % dim
+        counts[index] = counts.get(index, 0) + 3
+    if not counts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    values /= np.linalg.norm(values)
+    return indices, values
+
+
+def feature_matrix(texts: list[str], prefix_chars: int = CLASSIFIER_PREFIX_CHARS,
+                   dim: int = HASH_DIM) -> np.ndarray:
+    """Dense (len(texts), dim) float32 matrix of extract_features rows."""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        indices, values = extract_features(text, prefix_chars, dim)
+        matrix[row, indices] = values
+    return matrix
+
+
+class Classifier:
+    """Interface: classify one document or a batch of them into DOC_TYPES."""
+
+    name = "base"
+
+    def classify(self, text: str) -> str:
+        return self.classify_batch([text])[0]
+
+    def classify_batch(self, texts: list[str]) -> list[str]:
+        raise NotImplementedError
+
+
+class HeuristicClassifier(Classifier):
+    """The original keyword/newline rules, one document at a time."""
+
+    name = "heuristic"
+
+    def classify_batch(self, texts: list[str]) -> list[str]:
+        return [classify_document_type(text) for text in texts]
+
+
+class LinearClassifier(Classifier):
+    """Softmax-linear model over hashed features: scores = X @ W + b."""
+
+    name = "linear"
+
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, labels: tuple[str, ...],
+                 prefix_chars: int = CLASSIFIER_PREFIX_CHARS):
+        self.weights = np.ascontiguousarray(weights, dtype=np.float32)     # (dim, n_labels)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.labels = tuple(labels)
+        self.prefix_chars = prefix_chars
+        self.dim = self.weights.shape[0]
+
+    def scores(self, texts: list[str]) -> np.ndarray:
+        """
+        (len(texts), n_labels) scores. Equivalent to feature_matrix(texts) @ W + b
+        without the dense matrix: the rows of W for every feature in the batch
+        are gathered at once, scaled, and summed per document.
+        """
+        rows = [extract_features(text, self.prefix_chars, self.dim) for text in texts]
+        indices = np.concatenate([row[0] for row in rows])
+        values = np.concatenate([row[1] for row in rows])
+        owners = np.repeat(np.arange(len(rows)), [len(row[0]) for row in rows])
+        scores = np.tile(self.bias, (len(rows), 1))
+        np.add.at(scores, owners, self.weights[indices] * values[:, None])
+        return scores
+
+    def classify_batch(self, texts: list[str]) -> list[str]:
+        if not texts:
+            return []
+        return [self.labels[i] for i in self.scores(texts).argmax(axis=1)]
+
+    @classmethod
+    def load(cls, path: str = CLASSIFIER_MODEL_PATH) -> "LinearClassifier":
+        with np.load(path, allow_pickle=False) as model:
+            return cls(model["weights"], model["bias"], tuple(str(label) for label in model["labels"]),
+                       int(model["prefix_chars"]))
+
+    def save(self, path: str = CLASSIFIER_MODEL_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, weights=self.weights.astype(np.float16), bias=self.bias,
+                            labels=np.array(self.labels), prefix_chars=np.int64(self.prefix_chars))
+
+
+def train_linear_classifier(texts: list[str], labels: list[str], epochs: int = 300, learning_rate: float = 2.0,
+                            l2: float = 1e-4, prefix_chars: int = CLASSIFIER_PREFIX_CHARS,
+                            dim: int = HASH_DIM) -> LinearClassifier:
+    """Fit softmax regression by full-batch gradient descent."""
+    x = feature_matrix(texts, prefix_chars, dim)
+    y = np.array([DOC_TYPES.index(label) for label in labels])
+    targets = np.eye(len(DOC_TYPES), dtype=np.float32)[y]
+    weights = np.zeros((dim, len(DOC_TYPES)), dtype=np.float32)
+    bias = np.zeros(len(DOC_TYPES), dtype=np.float32)
+    for _ in range(epochs):
+        logits = x @ weights + bias
+        logits -= logits.max(axis=1, keepdims=True)
+        probs = np.exp(logits)
+        probs /= probs.sum(axis=1, keepdims=True)
+        error = (probs - targets) / len(texts)
+        weights -= learning_rate * (x.T @ error + l2 * weights)
+        bias -= learning_rate * error.sum(axis=0)
+    return LinearClassifier(weights, bias, DOC_TYPES, prefix_chars)
+
+
+_classifier: Classifier | None = None
+_classifier_lock = threading.Lock()
+
+
+def load_classifier(backend: str = CLASSIFIER_BACKEND, model_path: str = CLASSIFIER_MODEL_PATH) -> Classifier:
+    if backend == "linear":
+        try:
+            return LinearClassifier.load(model_path)
+        except (OSError, KeyError, ValueError) as e:
+            _log(f"Could not load {model_path} ({e}); using the heuristic classifier")
+    return HeuristicClassifier()
+
+
+def get_classifier() -> Classifier:
+    """The process-wide classifier (loaded on first use)."""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = load_classifier()
+    return _classifier
+
+
+def classify_documents(texts: list[str]) -> list[str]:
+    """Classify a batch of documents with the process-wide classifier."""
+    return get_classifier().classify_batch(texts)
+
+
+class BatchingClassifier:
+    """
+    Single background thread that classifies for every pipeline in the process.
+    Documents are queued; the thread takes the first one, waits up to
+    `batch_wait` for more (or until `max_batch` are queued) and scores them
+    with one classify_batch call, off the event loop.
+    """
+
+    def __init__(self, batch_wait: float = CLASSIFIER_BATCH_WAIT, max_batch: int = CLASSIFIER_MAX_BATCH):
+        self.batch_wait = batch_wait
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0        # classify_batch calls
+        self.documents = 0      # documents classified
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._ensure_started()
+        # Only the prefix is read; don't keep whole documents queued
+        self._queue.put((text[:CLASSIFIER_PREFIX_CHARS], future))
+        return future
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "documents": self.documents,
+            "avg_batch": round(self.documents / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def shutdown(self, timeout: float = 5.0):
+        """Classify everything already queued, then stop the thread."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            thread, self._thread = self._thread, None
+        thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="doc-classifier", daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self, first) -> tuple[list, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                stop, batch = True, []
+                while True:
+                    try:
+                        extra = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if extra is not None:
+                        batch.append(extra)
+            else:
+                batch, stop = self._collect_batch(item)
+            if batch:
+                self._classify(batch)
+            if stop:
+                return
+
+    def _classify(self, batch: list):
+        try:
+            labels = get_classifier().classify_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.documents += len(batch)
+        for (_, future), label in zip(batch, labels):
+            future.set_result(label)
+
+
+batching_classifier = BatchingClassifier()
+atexit.register(batching_classifier.shutdown)
+
+
+async def classify_async(text: str) -> str:
+    """Classify one document, batched with those of concurrent pipelines."""
+    return await asyncio.wrap_future(batching_classifier.submit(text))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train or run the document-type classifier.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="fit the linear model on the generated labelled corpus")
+    train.add_argument("--per-class", type=int, default=250)
+    train.add_argument("--seed", type=int, default=1)
+    train.add_argument("--out", default=CLASSIFIER_MODEL_PATH)
+    run = sub.add_parser("classify", help="classify text files")
+    run.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        from app.benchmarks.doc_corpus import generate_corpus
+        corpus = generate_corpus(args.per_class, seed=args.seed)
+        model = train_linear_classifier([text for text, _ in corpus], [label for _, label in corpus])
+        model.save(args.out)
+        print(f"Trained on {len(corpus)} documents; weights written to {args.out}")
+        sys.exit(0)
+
+    texts = []
+    for path in args.files:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            texts.append(f.read(CLASSIFIER_PREFIX_CHARS))
+    for path, label in zip(args.files, classify_documents(texts)):
+        print(f"{label}\t{path}")
@@ -1,28 +1,61 @@
-import asyncio
-import redis
+import os
+import sys
+import json
 import time
+import redis
+import socket
+import asyncio
+import argparse
+import threading
 from datetime import datetime
 from typing import Any
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
 from pydantic import BaseModel
+from starlette.responses import StreamingResponse
 
 from app.auth import validate_jwt_and_get_role
-from app.db import update_document_status
+from app.db import update_document_status, run_in_db
 from app.agent_logic import log_event_processed, log_event_flagged
+from app.event_log import event_log
+from app.metrics import instrument_app, REVIEW_MESSAGES, REVIEW_PENDING, REVIEW_LAG
+from app.cache import reload_policy_snapshot, start_policy_listener
+from app.review_feed import ReviewFeed, STREAM_ID_RE
+from app.streams import REVIEW_STREAM, REVIEW_GROUP, ack_review_entry
+
+REVIEW_CONSUMERS = 4                # consumer threads per process
+REVIEW_BATCH_SIZE = 100             # entries per XREADGROUP / XAUTOCLAIM
+REVIEW_BLOCK_MS = 5000              # XREADGROUP block time
+REVIEW_CLAIM_IDLE_MS = 60_000       # an entry pending longer than this is reclaimed
+REVIEW_CLAIM_INTERVAL = 30          # seconds between XAUTOCLAIM sweeps, per consumer
+REVIEW_STATS_INTERVAL = 30          # seconds between lag/pending reports
 
 # Redis connection
 redis_client = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
 
 # FastAPI app for reviewer override (optional if you want to POST overrides).
 app = FastAPI(title="Reviewer Consumer API")
+_stats_stop = threading.Event()
+# Live feed of review_queue for GET /review/stream (one shared reader per process)
+review_feed = ReviewFeed(REVIEW_STREAM)
+# Request timing, slow-request log and GET /metrics (Prometheus text format)
+instrument_app(app)
+
+@app.on_event("startup")
+async def startup():
+    # Keep this process's policy snapshot in sync with /update_policy/
+    await run_in_db(reload_policy_snapshot)
+    start_policy_listener()
+    # Report review_queue lag/pending on this app's /metrics
+    await asyncio.to_thread(ensure_review_group)
+    start_stats_reporter(_stats_stop, log_stats=False)
 
-# Ensure the consumer group exists
-try:
-    redis_client.xgroup_create("review_queue", "reviewers", id="0", mkstream=True)
-except redis.exceptions.ResponseError:
-    # Group already exists
-    pass
+@app.on_event("shutdown")
+async def shutdown():
+    _stats_stop.set()
+    await review_feed.close()
+    # Write out buffered event log lines before the process exits
+    await asyncio.to_thread(event_log.shutdown)
 
 class ReviewOverrideRequest(BaseModel):
     doc_id: str
@@ -41,44 +74,207 @@ async def override_review(
     if req.action not in ["approve", "reject"]:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid action")
     new_status = "completed" if req.action == "approve" else "rejected"
-    update_document_status(req.doc_id, new_status)
+    await run_in_db(update_document_status, req.doc_id, new_status)
+    # The decision is made: drop the document's entry from review_queue
+    await ack_review_entry(req.doc_id)
 
     # Log reviewer override
     if req.action == "approve":
-        log_event_processed(req.doc_id, user_id, "review_override", 0)
+        log_event_processed(req.doc_id, user_id, "review_override", 0, role)
     else:
         log_event_flagged(req.doc_id, user_id, "review_reject", role)
 
-    # Acknowledge the message in Redis if it exists (optional)
-    # We could search for the message ID in the pending list, but for demo we skip that step.
-
     return { "status": f"document {req.doc_id} {req.action}d by reviewer {user_id}" }
 
 
-def review_consumer_loop():
+@app.get("/review/stream")
+async def review_stream(
+    request: Request,
+    last_event_id: str | None = Query(None, description="replay entries after this id (or send Last-Event-ID)"),
+    user_data = Depends(validate_jwt_and_get_role)
+):
+    """
+    Server-sent events: one 'flagged' event per new review_queue entry, with
+    the stream id as the event id. Reconnecting with Last-Event-ID (browsers
+    do this automatically) replays the entries missed in between.
+    """
+    _, role = user_data
+    if role != "Reviewer":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Reviewer privileges required")
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    if last_event_id and not STREAM_ID_RE.match(last_event_id):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Last-Event-ID")
+
+    async def events():
+        yield "retry: 2000\n\n"
+        async for event in review_feed.subscribe(last_event_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            message_id, fields = event
+            yield f"id: {message_id}\nevent: flagged\ndata: {json.dumps(fields)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={ "Cache-Control": "no-cache", "X-Accel-Buffering": "no" })
+
+
+def ensure_review_group():
+    try:
+        redis_client.xgroup_create(REVIEW_STREAM, REVIEW_GROUP, id="0", mkstream=True)
+    except redis.exceptions.ResponseError:
+        # Group already exists
+        pass
+
+
+def consumer_names(count: int, prefix: str | None = None) -> list[str]:
+    """Names unique across hosts and processes: <hostname>-<pid>-<n>."""
+    prefix = prefix or f"{socket.gethostname()}-{os.getpid()}"
+    return [f"{prefix}-{n}" for n in range(1, count + 1)]
+
+
+def handle_review_messages(consumer_name: str, messages: list) -> list[str]:
     """
-    Continuously read flagged documents from 'review_queue'.
-    For each message, print details. A real dashboard would push these to a UI.
+    Show each flagged document (a real dashboard would push these to a UI).
+    Returns the ids to acknowledge, including entries deleted from the stream
+    while they were pending (their fields come back empty).
     """
+    for message_id, msg_data in messages:
+        if not msg_data:
+            continue
+        print(f"[{datetime.utcnow().isoformat()}] [REVIEWER CONSUMER {consumer_name}] "
+              f"Document '{msg_data.get('doc_id')}' flagged by user '{msg_data.get('user_id')}', "
+              f"reason: {msg_data.get('reason')}, time: {msg_data.get('timestamp')}")
+    return [message_id for message_id, _ in messages]
+
+
+def reclaim_pending(consumer_name: str) -> list[str]:
+    """
+    Take over entries another consumer left pending for longer than
+    REVIEW_CLAIM_IDLE_MS (it crashed or stalled), handle them and return
+    their ids to acknowledge.
+    """
+    ack_ids = []
+    start_id = "0-0"
     while True:
+        claimed = redis_client.xautoclaim(REVIEW_STREAM, REVIEW_GROUP, consumer_name,
+                                          min_idle_time=REVIEW_CLAIM_IDLE_MS, start_id=start_id,
+                                          count=REVIEW_BATCH_SIZE)
+        # Redis 7 drops entries deleted from the stream out of the PEL itself
+        # (claimed[2]); Redis 6.2 returns them here with empty fields.
+        start_id, messages = claimed[0], claimed[1]
+        ack_ids.extend(handle_review_messages(consumer_name, messages))
+        REVIEW_MESSAGES.inc("reclaimed", amount=len(messages))
+        if start_id == "0-0":
+            return ack_ids
+
+
+def review_consumer_loop(consumer_name: str = "consumer1", stop: threading.Event | None = None):
+    """
+    Continuously read flagged documents from 'review_queue' as `consumer_name`.
+    The acknowledgements for one batch go out in the same pipeline (one round
+    trip) as the blocking read for the next, so the loop never sleeps while
+    there is work. Every REVIEW_CLAIM_INTERVAL seconds it also reclaims
+    entries stuck pending on dead consumers.
+    """
+    stop = stop or threading.Event()
+    ack_ids: list[str] = []
+    next_claim = time.monotonic()
+    while not stop.is_set():
         try:
-            entries = redis_client.xreadgroup("reviewers", "consumer1", {"review_queue": ">"}, count=5, block=1000)
-            if entries:
-                for stream_name, messages in entries:
-                    for message_id, msg_data in messages:
-                        doc_id = msg_data.get("doc_id")
-                        user_id = msg_data.get("user_id")
-                        reason = msg_data.get("reason")
-                        timestamp = msg_data.get("timestamp")
-                        print(f"[{datetime.utcnow().isoformat()}] "
-                              f"[REVIEWER CONSUMER] Document '{doc_id}' flagged by user '{user_id}', reason: {reason}, time: {timestamp}")
-                        # Acknowledge immediately so this example does not block indefinitely
-                        redis_client.xack("review_queue", "reviewers", message_id)
+            if time.monotonic() >= next_claim:
+                ack_ids.extend(reclaim_pending(consumer_name))
+                next_claim = time.monotonic() + REVIEW_CLAIM_INTERVAL
+            with redis_client.pipeline(transaction=False) as pipe:
+                if ack_ids:
+                    pipe.xack(REVIEW_STREAM, REVIEW_GROUP, *ack_ids)
+                pipe.xreadgroup(REVIEW_GROUP, consumer_name, { REVIEW_STREAM: ">" },
+                                count=REVIEW_BATCH_SIZE, block=REVIEW_BLOCK_MS)
+                results = pipe.execute()
+            ack_ids = []
+            for _, messages in results[-1] or []:
+                ack_ids.extend(handle_review_messages(consumer_name, messages))
+                REVIEW_MESSAGES.inc("new", amount=len(messages))
         except Exception as e:
-            print(f"[{datetime.utcnow().isoformat()}] Error in review_consumer_loop: {e}")
-        time.sleep(1)
+            # Unacknowledged ids are kept and retried with the next read
+            print(f"[{datetime.utcnow().isoformat()}] Error in review_consumer_loop ({consumer_name}): {e}")
+            stop.wait(1)
+    if ack_ids:
+        redis_client.xack(REVIEW_STREAM, REVIEW_GROUP, *ack_ids)
+
+
+def review_queue_stats() -> dict:
+    """
+    Consumer group state: 'lag' (entries not yet delivered to any consumer;
+    None if Redis cannot tell) and 'pending' (delivered, not yet acknowledged),
+    overall and per consumer.
+    """
+    group = next((g for g in redis_client.xinfo_groups(REVIEW_STREAM) if g["name"] == REVIEW_GROUP), None)
+    if group is None:
+        return { "lag": None, "pending": 0, "consumers": {} }
+    consumers = redis_client.xinfo_consumers(REVIEW_STREAM, REVIEW_GROUP)
+    return {
+        "lag": group.get("lag"),
+        "pending": group["pending"],
+        "consumers": { c["name"]: { "pending": c["pending"], "idle_ms": c["idle"] } for c in consumers },
+    }
+
+
+def _stats_reporter_loop(stop: threading.Event, log_stats: bool):
+    while True:
+        try:
+            stats = review_queue_stats()
+            if stats["lag"] is not None:
+                REVIEW_LAG.set(stats["lag"])
+            for name, consumer in stats["consumers"].items():
+                REVIEW_PENDING.set(consumer["pending"], name)
+            if log_stats:
+                print(f"[{datetime.utcnow().isoformat()}] [REVIEWER CONSUMER] review_queue lag={stats['lag']} "
+                      f"pending={stats['pending']} consumers={len(stats['consumers'])}")
+        except Exception as e:
+            print(f"[{datetime.utcnow().isoformat()}] Error reading review_queue stats: {e}")
+        if stop.wait(REVIEW_STATS_INTERVAL):
+            return
+
+
+def start_stats_reporter(stop: threading.Event, log_stats: bool = True) -> threading.Thread:
+    """Refresh the review-queue gauges (and optionally log them) every REVIEW_STATS_INTERVAL seconds."""
+    thread = threading.Thread(target=_stats_reporter_loop, args=(stop, log_stats),
+                              name="review-queue-stats", daemon=True)
+    thread.start()
+    return thread
+
+
+def run_review_consumers(count: int = REVIEW_CONSUMERS, prefix: str | None = None,
+                         stop: threading.Event | None = None):
+    """Run `count` consumers (one thread each) in this process until `stop` is set."""
+    stop = stop or threading.Event()
+    ensure_review_group()
+    threads = [
+        threading.Thread(target=review_consumer_loop, args=(name, stop), name=f"review-consumer-{name}", daemon=True)
+        for name in consumer_names(count, prefix)
+    ]
+    for thread in threads:
+        thread.start()
+    start_stats_reporter(stop)
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join(REVIEW_BLOCK_MS / 1000 + 1)
 
 
 if __name__ == "__main__":
-    print("Starting Review Consumer Loop (listening for flagged docs)...")
-    review_consumer_loop()
+    parser = argparse.ArgumentParser(description="Run review_queue consumers.")
+    parser.add_argument("--consumers", type=int, default=REVIEW_CONSUMERS, help="consumers in this process")
+    parser.add_argument("--name", default=None, help="consumer name prefix (default: <hostname>-<pid>)")
+    parser.add_argument("--stats", action="store_true", help="print review_queue lag/pending and exit")
+    args = parser.parse_args()
+    if args.stats:
+        print(json.dumps(review_queue_stats(), indent=2))
+        sys.exit(0)
+    print(f"Starting {args.consumers} review consumers (listening for flagged docs)...")
+    start_policy_listener()
+    run_review_consumers(args.consumers, args.name)
@@ -1,165 +1,485 @@
 import os
+import zlib
+import queue
 import sqlite3
+import asyncio
+import functools
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 
+from app.metrics import timed
+
 DB_PATH = os.path.join(os.path.dirname(__file__), "notegpt.db")
 
-def initialize_database():
+# Connection pool / pragma tuning
+DB_POOL_SIZE = 8                      # max open connections per process
+DB_POOL_TIMEOUT = 10.0                # seconds to wait for a free connection
+DB_BUSY_TIMEOUT_MS = 5000             # how long SQLite retries on a locked database
+DB_MMAP_SIZE = 256 * 1024 * 1024      # memory-map up to 256 MB of the DB file
+DB_CACHE_SIZE_KB = 16000              # page cache per connection (negative pragma = KiB)
+DB_STATEMENT_CACHE_SIZE = 128         # prepared statements cached per connection
+
+# user_ids already in the users table, remembered per process so repeated
+# token issues skip the INSERT (cleared when it reaches KNOWN_USERS_MAX)
+KNOWN_USERS_MAX = 100_000
+_known_users: set[str] = set()
+
+# Out-of-row raw text storage (document_texts table)
+TEXT_CODEC = "zlib"
+TEXT_COMPRESSION_LEVEL = 6
+
+def utc_now() -> str:
     """
-    Creates the SQLite database and all required tables if they don't exist.
-    """
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Create users table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            username TEXT NOT NULL,
-            role TEXT NOT NULL,                -- FreeUser, PremiumUser, Reviewer, Admin
-            subscription_tier TEXT NOT NULL     -- e.g., Free, Premium
-        );
-    """)
-
-    # Create documents table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS documents (
-            doc_id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            original_filename TEXT,
-            raw_text TEXT,
-            doc_type TEXT,
-            status TEXT NOT NULL,
-            created_at TIMESTAMP NOT NULL,
-            updated_at TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        );
-    """)
-
-    # Create summaries table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS summaries (
-            summary_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            doc_id TEXT NOT NULL,
-            summary_text TEXT,
-            notes_json TEXT,
-            created_at TIMESTAMP NOT NULL,
-            FOREIGN KEY (doc_id) REFERENCES documents(doc_id)
-        );
-    """)
-
-    # Create policies table (key_name, value stored as JSON or string)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS policies (
-            policy_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            key_name TEXT UNIQUE NOT NULL,
-            value TEXT NOT NULL
-        );
-    """)
-
-    # Create digests table
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS digests (
-            digest_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            digest_date DATE NOT NULL,
-            file_path TEXT NOT NULL
-        );
-    """)
-
-    conn.commit()
-    conn.close()
+    Current UTC time as an ISO-8601 string ('YYYY-MM-DDTHH:MM:SS.ffffff').
+    Every timestamp column is written in this form, so comparing the strings
+    (and the indexes on them) orders rows by time.
+    """
+    return datetime.utcnow().isoformat(timespec="microseconds")
 
 
-def get_db_connection():
-    """Helper to get a new SQLite connection with row access by column name."""
-    conn = sqlite3.connect(DB_PATH)
+# SQL used by the helpers below. Keeping the text identical between calls lets
+# each pooled connection reuse its cached prepared statement.
+INSERT_USER_SQL = """
+    INSERT OR IGNORE INTO users (user_id, username, role, subscription_tier)
+    VALUES (?, ?, ?, ?);
+"""
+INSERT_DOCUMENT_SQL = """
+    INSERT OR IGNORE INTO documents
+    (doc_id, user_id, original_filename, raw_size, doc_type, status, created_at,
+     content_hash, summary_source_doc_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+"""
+INSERT_DOCUMENT_TEXT_SQL = """
+    INSERT OR IGNORE INTO document_texts (doc_id, codec, raw_size, data)
+    VALUES (?, ?, ?, ?);
+"""
+UPDATE_DOCUMENT_STATUS_AND_TYPE_SQL = """
+    UPDATE documents
+    SET status = ?, doc_type = ?, updated_at = ?
+    WHERE doc_id = ?;
+"""
+UPDATE_DOCUMENT_STATUS_SQL = """
+    UPDATE documents
+    SET status = ?, updated_at = ?
+    WHERE doc_id = ?;
+"""
+# One summary per document (unique on doc_id): a retried or re-processed job
+# overwrites its own row instead of adding a second one. The rewritten row gets
+# a new, highest summary_id (AUTOINCREMENT never reuses one), so consumers that
+# follow summary_id (the digest watermark) see it as a new summary.
+UPSERT_SUMMARY_SQL = """
+    INSERT INTO summaries (doc_id, summary_text, notes_json, created_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(doc_id) DO UPDATE SET
+        summary_id=(
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'summaries'), 0),
+                       (SELECT MAX(summary_id) FROM summaries)) + 1
+        ),
+        summary_text=excluded.summary_text,
+        notes_json=excluded.notes_json,
+        created_at=excluded.created_at;
+"""
+UPSERT_SUMMARY_CACHE_SQL = """
+    INSERT INTO summary_cache
+    (content_hash, doc_type, template_hash, source_doc_id, summary_text, notes_json, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(content_hash) DO UPDATE SET
+        doc_type=excluded.doc_type,
+        template_hash=excluded.template_hash,
+        source_doc_id=excluded.source_doc_id,
+        summary_text=excluded.summary_text,
+        notes_json=excluded.notes_json,
+        created_at=excluded.created_at;
+"""
+SELECT_SUMMARY_CACHE_SQL = """
+    SELECT content_hash, doc_type, template_hash, source_doc_id, summary_text, notes_json
+    FROM summary_cache
+    WHERE content_hash = ?;
+"""
+UPSERT_CHUNK_SUMMARY_SQL = """
+    INSERT INTO summary_chunks (chunk_key, summary_text, created_at)
+    VALUES (?, ?, ?)
+    ON CONFLICT(chunk_key) DO UPDATE SET
+        summary_text=excluded.summary_text,
+        created_at=excluded.created_at;
+"""
+SELECT_POLICIES_SQL = "SELECT key_name, value FROM policies;"
+UPSERT_POLICY_SQL = """
+    INSERT INTO policies (key_name, value)
+    VALUES (?, ?)
+    ON CONFLICT(key_name) DO UPDATE SET value=excluded.value;
+"""
+# 'policy_version' is a counter row in the policies table, bumped on every policy write.
+BUMP_POLICY_VERSION_SQL = """
+    INSERT INTO policies (key_name, value)
+    VALUES ('policy_version', '1')
+    ON CONFLICT(key_name) DO UPDATE SET value=CAST(CAST(value AS INTEGER) + 1 AS TEXT);
+"""
+SELECT_POLICY_VERSION_SQL = "SELECT value FROM policies WHERE key_name = 'policy_version';"
+
+
+class CompressedText:
+    """
+    Raw document text that is compressed only when SQLite binds it as a
+    parameter (via the __conform__ protocol). Statements recorded on the event
+    loop therefore pay for compression later, on the writer thread.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __conform__(self, protocol):
+        if protocol is sqlite3.PrepareProtocol:
+            return compress_text(self.text)
+
+
+def compress_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"), TEXT_COMPRESSION_LEVEL)
+
+
+def decompress_text(codec: str, data: bytes) -> str:
+    if codec == "zlib":
+        return zlib.decompress(data).decode("utf-8")
+    if codec == "plain":
+        return data.decode("utf-8")
+    raise ValueError(f"Unknown text codec: {codec}")
+
+
+def document_statements(doc_id: str, user_id: str, filename: str, raw_text: str | None, doc_type: str,
+                        status: str, created_at: str, content_hash: str = None,
+                        summary_source_doc_id: str = None) -> list[tuple[str, tuple]]:
+    """
+    SQL to insert a document: the row itself keeps only the original size, and
+    the text goes compressed into document_texts (skipped when raw_text is None).
+    """
+    raw_size = len(raw_text.encode("utf-8")) if raw_text is not None else None
+    statements = [(INSERT_DOCUMENT_SQL, (doc_id, user_id, filename, raw_size, doc_type, status, created_at,
+                                         content_hash, summary_source_doc_id))]
+    if raw_text is not None:
+        statements.append((INSERT_DOCUMENT_TEXT_SQL, (doc_id, TEXT_CODEC, raw_size, CompressedText(raw_text))))
+    return statements
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    """
+    Open a tuned SQLite connection:
+      - WAL journal so readers never block behind the writer
+      - synchronous=NORMAL (durable at checkpoints, no fsync per commit in WAL)
+      - busy_timeout instead of failing fast with 'database is locked'
+      - mmap + larger page cache for read-heavy queries
+    Transactions are managed explicitly (isolation_level=None), see transaction().
+    """
+    conn = sqlite3.connect(
+        db_path,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=DB_STATEMENT_CACHE_SIZE,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS};")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE};")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB};")
+    conn.execute("PRAGMA temp_store=MEMORY;")
     return conn
 
 
+class ConnectionPool:
+    """
+    Bounded pool of reusable SQLite connections.
+    Connections are created lazily up to `size`; callers beyond that wait
+    (up to `timeout` seconds) for one to be returned.
+    """
+
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Connections must not be shared across fork(); each process gets its own pool.
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._created = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+        if create:
+            try:
+                return _connect(self.db_path)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(
+                f"Timed out after {self.timeout}s waiting for a database connection"
+            )
+
+    def release(self, conn: sqlite3.Connection):
+        if self._pid != os.getpid():
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+
+    def close_all(self):
+        """Close idle connections (e.g. on shutdown or in tests)."""
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+
+
+_pool = ConnectionPool(DB_PATH)
+
+# Dedicated executor for blocking sqlite3 calls made from async code. Sized to
+# the pool so a queued job never waits on a connection it cannot get.
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="sqlite")
+
+
+async def run_in_db(fn, *args, **kwargs):
+    """
+    Run a blocking db.py helper on the SQLite executor and await its result,
+    so disk I/O never stalls the event loop.
+    e.g. policies = await run_in_db(fetch_policies)
+    """
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context over so spans timed on the executor thread
+    # land in the calling request's trace
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_db_executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+@contextmanager
+def get_db_connection():
+    """Borrow a pooled SQLite connection (autocommit mode, row access by column name)."""
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+
+@contextmanager
+def transaction():
+    """
+    Borrow a pooled connection and run the block in a single write transaction.
+    BEGIN IMMEDIATE takes the write lock up front so concurrent writers wait on
+    busy_timeout instead of failing on a lock upgrade. Commits on success,
+    rolls back on error.
+    """
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+@timed("db.initialize_database")
+def initialize_database():
+    """
+    Create or upgrade the schema by applying any pending migrations
+    (see app/migrations.py). Safe to call on every startup.
+    """
+    from app.migrations import apply_migrations   # migrations imports this module
+    return apply_migrations()
+
+
+@timed("db.insert_user")
 def insert_user(user_id: str, username: str, role: str, tier: str):
     """Insert a new user into the users table."""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT OR IGNORE INTO users (user_id, username, role, subscription_tier)
-        VALUES (?, ?, ?, ?);
-    """, (user_id, username, role, tier))
-    conn.commit()
-    conn.close()
-
-
-def insert_document(doc_id: str, user_id: str, filename: str, raw_text: str, doc_type: str, status: str):
-    """Insert a new document record."""
-    now = datetime.utcnow()
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT OR IGNORE INTO documents
-        (doc_id, user_id, original_filename, raw_text, doc_type, status, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?);
-    """, (doc_id, user_id, filename, raw_text, doc_type, status, now))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(INSERT_USER_SQL, (user_id, username, role, tier))
+
+
+def ensure_user(user_id: str, username: str, role: str, tier: str) -> bool:
+    """
+    insert_user, skipped for user_ids this process has already inserted.
+    Returns True if the INSERT was issued.
+    """
+    if user_id in _known_users:
+        return False
+    insert_user(user_id, username, role, tier)
+    if len(_known_users) >= KNOWN_USERS_MAX:
+        _known_users.clear()
+    _known_users.add(user_id)
+    return True
+
 
+@timed("db.insert_document")
+def insert_document(doc_id: str, user_id: str, filename: str, raw_text: str, doc_type: str, status: str,
+                    content_hash: str = None, summary_source_doc_id: str = None):
+    """Insert a new document record (raw text is stored compressed in document_texts)."""
+    now = utc_now()
+    with transaction() as conn:
+        for sql, params in document_statements(doc_id, user_id, filename, raw_text, doc_type, status, now,
+                                               content_hash, summary_source_doc_id):
+            conn.execute(sql, params)
 
+
+@timed("db.update_document_status")
 def update_document_status(doc_id: str, status: str, doc_type: str = None):
     """Update status (and optionally doc_type) of an existing document."""
-    now = datetime.utcnow()
-    conn = get_db_connection()
-    cur = conn.cursor()
-    if doc_type:
-        cur.execute("""
-            UPDATE documents 
-            SET status = ?, doc_type = ?, updated_at = ?
-            WHERE doc_id = ?;
-        """, (status, doc_type, now, doc_id))
-    else:
-        cur.execute("""
-            UPDATE documents 
-            SET status = ?, updated_at = ?
-            WHERE doc_id = ?;
-        """, (status, now, doc_id))
-    conn.commit()
-    conn.close()
+    now = utc_now()
+    with transaction() as conn:
+        if doc_type:
+            conn.execute(UPDATE_DOCUMENT_STATUS_AND_TYPE_SQL, (status, doc_type, now, doc_id))
+        else:
+            conn.execute(UPDATE_DOCUMENT_STATUS_SQL, (status, now, doc_id))
 
 
+@timed("db.insert_summary")
 def insert_summary(doc_id: str, summary_text: str, notes_json: str):
-    """Insert the generated summary and notes."""
-    now = datetime.utcnow()
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO summaries (doc_id, summary_text, notes_json, created_at)
-        VALUES (?, ?, ?, ?);
-    """, (doc_id, summary_text, notes_json, now))
-    conn.commit()
-    conn.close()
+    """Insert the generated summary and notes (replacing the document's previous ones)."""
+    now = utc_now()
+    with transaction() as conn:
+        conn.execute(UPSERT_SUMMARY_SQL, (doc_id, summary_text, notes_json, now))
+
+
+@timed("db.fetch_raw_text")
+def fetch_raw_text(doc_id: str) -> str | None:
+    """
+    Lazily load (and decompress) a document's text. Follows
+    summary_source_doc_id for dedup hits, and falls back to the legacy inline
+    documents.raw_text for rows that have not been migrated.
+    """
+    with get_db_connection() as conn:
+        row = conn.execute("""
+            SELECT d.raw_text, d.summary_source_doc_id, t.codec, t.data
+            FROM documents d
+            LEFT JOIN document_texts t ON t.doc_id = d.doc_id
+            WHERE d.doc_id = ?;
+        """, (doc_id,)).fetchone()
+    if row is None:
+        return None
+    if row["data"] is not None:
+        return decompress_text(row["codec"], row["data"])
+    if row["raw_text"] is not None:
+        return row["raw_text"]
+    if row["summary_source_doc_id"]:
+        return fetch_raw_text(row["summary_source_doc_id"])
+    return None
+
+
+@timed("db.migrate_raw_text_out_of_row")
+def migrate_raw_text_out_of_row(batch_size: int = 200, vacuum: bool = True) -> int:
+    """
+    Move legacy inline documents.raw_text into compressed document_texts rows,
+    one batch per transaction, then VACUUM to give the freed pages back.
+    Returns the number of documents migrated.
+    """
+    migrated = 0
+    while True:
+        with transaction() as conn:
+            rows = conn.execute("""
+                SELECT doc_id, raw_text FROM documents
+                WHERE raw_text IS NOT NULL
+                LIMIT ?;
+            """, (batch_size,)).fetchall()
+            for row in rows:
+                raw_size = len(row["raw_text"].encode("utf-8"))
+                conn.execute(INSERT_DOCUMENT_TEXT_SQL,
+                             (row["doc_id"], TEXT_CODEC, raw_size, compress_text(row["raw_text"])))
+                conn.execute("UPDATE documents SET raw_text = NULL, raw_size = ? WHERE doc_id = ?;",
+                             (raw_size, row["doc_id"]))
+        migrated += len(rows)
+        if len(rows) < batch_size:
+            break
+    if vacuum and migrated:
+        with get_db_connection() as conn:
+            conn.execute("VACUUM;")
+    return migrated
+
 
+@timed("db.fetch_cached_summary")
+def fetch_cached_summary(content_hash: str) -> dict | None:
+    """Return the summary_cache row for a content hash, or None."""
+    with get_db_connection() as conn:
+        row = conn.execute(SELECT_SUMMARY_CACHE_SQL, (content_hash,)).fetchone()
+    return dict(row) if row else None
 
+
+@timed("db.delete_cached_summaries")
+def delete_cached_summaries(doc_types: list[str]) -> int:
+    """Drop dedup cache entries for the given doc_types (their template changed)."""
+    if not doc_types:
+        return 0
+    placeholders = ",".join("?" for _ in doc_types)
+    with transaction() as conn:
+        cur = conn.execute(f"DELETE FROM summary_cache WHERE doc_type IN ({placeholders});", list(doc_types))
+        return cur.rowcount
+
+
+@timed("db.fetch_chunk_summaries")
+def fetch_chunk_summaries(chunk_keys: list[str]) -> dict[str, str]:
+    """Memoized chunk summaries for the given keys: { chunk_key: summary_text }."""
+    found = {}
+    with get_db_connection() as conn:
+        for start in range(0, len(chunk_keys), 500):
+            batch = chunk_keys[start:start + 500]
+            placeholders = ",".join("?" for _ in batch)
+            rows = conn.execute(
+                f"SELECT chunk_key, summary_text FROM summary_chunks WHERE chunk_key IN ({placeholders});", batch
+            ).fetchall()
+            found.update((row["chunk_key"], row["summary_text"]) for row in rows)
+    return found
+
+
+@timed("db.fetch_policies")
 def fetch_policies():
     """
     Return all policies as a dictionary { key_name: value }.
     The value is the raw text string stored in the table.
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT key_name, value FROM policies;")
-    rows = cur.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        rows = conn.execute(SELECT_POLICIES_SQL).fetchall()
     policies = { row["key_name"]: row["value"] for row in rows }
     return policies
 
 
-def upsert_policy(key_name: str, value: str):
-    """Insert or update a policy key/value."""
-    conn = get_db_connection()
-    cur = conn.cursor()
+@timed("db.upsert_policy")
+def upsert_policy(key_name: str, value: str) -> int:
+    """
+    Insert or update a policy key/value and bump the policy version in the
+    same transaction. Returns the new policy version.
+    """
     # If key_name exists, update; else, insert
-    cur.execute("""
-        INSERT INTO policies (key_name, value) 
-        VALUES (?, ?)
-        ON CONFLICT(key_name) DO UPDATE SET value=excluded.value;
-    """, (key_name, value))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(UPSERT_POLICY_SQL, (key_name, value))
+        conn.execute(BUMP_POLICY_VERSION_SQL)
+        return int(conn.execute(SELECT_POLICY_VERSION_SQL).fetchone()["value"])
+
+
+if __name__ == "__main__":
+    import sys
+    initialize_database()
+    print(f"Initialized database at {DB_PATH}")
+    if "--migrate-raw-text" in sys.argv:
+        print(f"Moved raw text of {migrate_raw_text_out_of_row()} documents to document_texts")
@@ -0,0 +1,195 @@
+import os
+import gzip
+import json
+import queue
+import atexit
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, date
+
+LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
+EVENT_LOG_FILE = "event_log.json"
+POLICY_EXCEPTIONS_FILE = "policy_exceptions.json"
+
+# Buffering: lines are written in one batch once this many bytes are queued,
+# or this long after the first unwritten line, whichever comes first.
+EVENT_LOG_FLUSH_BYTES = 64 * 1024
+EVENT_LOG_FLUSH_INTERVAL = 0.5          # seconds
+# Rotation: the active file keeps its name; closed segments are renamed to
+# <name>.<YYYY-MM-DD>.<n>.json (gzipped if EVENT_LOG_COMPRESS).
+EVENT_LOG_MAX_BYTES = 64 * 1024 * 1024
+EVENT_LOG_ROTATE_DAILY = True
+EVENT_LOG_COMPRESS = True
+
+
+def _log(msg: str):
+    print(f"[{datetime.utcnow().isoformat()}] [EVENT_LOG] {msg}")
+
+
+class RotatingLogFile:
+    """An append-only JSONL file rotated by size and/or UTC day."""
+
+    def __init__(self, path: str, max_bytes: int = EVENT_LOG_MAX_BYTES,
+                 rotate_daily: bool = EVENT_LOG_ROTATE_DAILY, compress: bool = EVENT_LOG_COMPRESS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self._file = None
+        self._size = 0
+        self._segment_date: date | None = None
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        # An existing file belongs to the day it was last written
+        self._segment_date = (datetime.utcfromtimestamp(os.path.getmtime(self.path)).date()
+                              if self._size else datetime.utcnow().date())
+
+    def _segment_path(self, n: int) -> str:
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}.{self._segment_date.isoformat()}.{n}{ext}"
+
+    def rotate(self):
+        """Close the active file and move it aside as a numbered segment."""
+        if self._file is None:
+            self._open()
+        self._file.close()
+        self._file = None
+        if self._size == 0:
+            return
+        n = 1
+        while os.path.exists(self._segment_path(n)) or os.path.exists(self._segment_path(n) + ".gz"):
+            n += 1
+        segment = self._segment_path(n)
+        os.replace(self.path, segment)
+        if self.compress:
+            with open(segment, "rb") as src, gzip.open(segment + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(segment)
+
+    def write(self, data: bytes):
+        if self._file is None:
+            self._open()
+        if self._size and (
+            self._size + len(data) > self.max_bytes
+            or (self.rotate_daily and datetime.utcnow().date() != self._segment_date)
+        ):
+            self.rotate()
+            self._open()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_STOP = object()
+
+
+class EventLogWriter:
+    """
+    Background writer for the JSONL event logs.
+    write() only serializes the entry and puts it on an in-memory queue, so it
+    never blocks the event loop on disk I/O. A daemon thread drains the queue
+    and appends each file's pending lines in a single write once
+    `flush_bytes` are buffered or `flush_interval` has passed.
+    shutdown() (also run at exit) writes everything still queued.
+    """
+
+    def __init__(self, log_dir: str = LOG_DIR, flush_bytes: int = EVENT_LOG_FLUSH_BYTES,
+                 flush_interval: float = EVENT_LOG_FLUSH_INTERVAL, **rotation):
+        self.log_dir = log_dir
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.rotation = rotation        # RotatingLogFile options
+        self._queue: queue.Queue = queue.Queue()
+        self._files: dict[str, RotatingLogFile] = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        self.lines = 0                  # lines written
+        self.writes = 0                 # write() calls issued to the OS
+
+    def write(self, filename: str, entry: dict):
+        self._ensure_started()
+        self._queue.put((filename, json.dumps(entry) + "\n"))
+
+    def flush(self, timeout: float = 5.0):
+        """Block until every line queued before this call is written."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put(future)
+        future.result(timeout)
+
+    def shutdown(self, timeout: float = 5.0):
+        """Write everything already queued, close the files and stop the thread."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(_STOP)
+            thread, self._thread = self._thread, None
+        thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+                self._thread.start()
+
+    def _file(self, filename: str) -> RotatingLogFile:
+        log_file = self._files.get(filename)
+        if log_file is None:
+            log_file = self._files[filename] = RotatingLogFile(os.path.join(self.log_dir, filename),
+                                                               **self.rotation)
+        return log_file
+
+    def _write_pending(self, pending: dict[str, list[str]]):
+        for filename, lines in pending.items():
+            try:
+                self._file(filename).write("".join(lines).encode("utf-8"))
+                self.lines += len(lines)
+                self.writes += 1
+            except OSError as e:
+                _log(f"Failed to write {len(lines)} lines to {filename}: {e}")
+        pending.clear()
+
+    def _run(self):
+        pending: dict[str, list[str]] = {}
+        pending_bytes = 0
+        deadline = None         # when the oldest pending line must be written
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is None or item is _STOP or isinstance(item, Future):
+                self._write_pending(pending)
+                pending_bytes, deadline = 0, None
+                if item is _STOP:
+                    for log_file in self._files.values():
+                        log_file.close()
+                    return
+                if item is not None:
+                    item.set_result(None)
+                continue
+            filename, line = item
+            pending.setdefault(filename, []).append(line)
+            pending_bytes += len(line)
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if pending_bytes >= self.flush_bytes:
+                self._write_pending(pending)
+                pending_bytes, deadline = 0, None
+
+
+event_log = EventLogWriter()
+atexit.register(event_log.shutdown)
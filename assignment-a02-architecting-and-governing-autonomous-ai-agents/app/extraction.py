@@ -0,0 +1,226 @@
+"""
+Text extraction for PDF and image uploads.
+
+All parsing and OCR runs in a process pool (EXTRACTION_WORKERS processes),
+so CPU-bound work never runs on the event loop or holds the GIL of the API
+process. A PDF is first opened once to count its pages (checked against the
+role's page limit), then its pages are split into up to EXTRACTION_WORKERS
+contiguous ranges that are extracted in parallel. For each page the PDF text
+layer is read with pypdf; a page with less than OCR_MIN_TEXT_CHARS of text
+(a scan) is rendered with pypdfium2 and OCR'd with Tesseract. Images are
+OCR'd directly.
+
+Uploads are held in memory (bounded by the role's max_upload_bytes) and sent
+to the workers as bytes; nothing is written to disk.
+
+Optional dependencies: pypdf (PDF text), pypdfium2 + pytesseract + Pillow and
+the tesseract binary (OCR). When one is missing the step is skipped: the page
+gets method "failed" and the reason is logged.
+"""
+import io
+import os
+import time
+import atexit
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import NamedTuple
+
+from fastapi import HTTPException
+
+from app.metrics import EXTRACTION_PAGES
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2 = None
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:
+    pytesseract = Image = None
+
+EXTRACTION_WORKERS = min(4, os.cpu_count() or 1)
+# PDFs shorter than this many pages per worker use fewer workers (each task
+# receives a copy of the upload, so tiny tasks cost more than they save)
+EXTRACTION_MIN_PAGES_PER_TASK = 4
+# A page whose text layer has fewer characters than this is OCR'd
+OCR_MIN_TEXT_CHARS = 20
+OCR_RENDER_DPI = 300
+OCR_LANGUAGE = "eng"
+OCR_PAGE_TIMEOUT = 60           # seconds per page; tesseract is killed after this
+
+
+def _log(msg: str):
+    print(f"[{datetime.utcnow().isoformat()}] [EXTRACTION] {msg}")
+
+
+class PageText(NamedTuple):
+    page: int           # 0-based page number
+    text: str
+    method: str         # 'text_layer' | 'ocr' | 'failed'
+    seconds: float
+    error: str = ""
+
+
+class Extraction(NamedTuple):
+    text: str
+    pages: list[PageText]
+
+
+class PageLimitExceeded(HTTPException):
+    def __init__(self, pages: int, max_pages: int):
+        super().__init__(
+            status_code=413,
+            detail=f"PDF has {pages} pages; the limit for this role is {max_pages}"
+        )
+
+
+# ----------------- Worker side (runs in the pool's processes) -----------------
+
+def _ocr(image) -> str:
+    if pytesseract is None:
+        raise RuntimeError("pytesseract and Pillow are not installed")
+    return pytesseract.image_to_string(image, lang=OCR_LANGUAGE, timeout=OCR_PAGE_TIMEOUT)
+
+
+def pdf_page_count(data: bytes) -> int:
+    return len(pypdf.PdfReader(io.BytesIO(data)).pages)
+
+
+def extract_pdf_pages(data: bytes, start: int, stop: int) -> list[PageText]:
+    """Pages [start, stop) of a PDF: text layer, with OCR for pages that have none."""
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    rendered = None         # opened with pypdfium2 on the first page that needs OCR
+    pages = []
+    for index in range(start, stop):
+        began = time.perf_counter()
+        text, method, error = "", "text_layer", ""
+        try:
+            text = reader.pages[index].extract_text() or ""
+        except Exception as e:
+            error = f"text layer: {e}"
+        if len(text.strip()) < OCR_MIN_TEXT_CHARS:
+            try:
+                if pypdfium2 is None:
+                    raise RuntimeError("pypdfium2 is not installed")
+                if rendered is None:
+                    rendered = pypdfium2.PdfDocument(data)
+                image = rendered[index].render(scale=OCR_RENDER_DPI / 72).to_pil()
+                text, method, error = _ocr(image), "ocr", ""
+            except Exception as e:
+                method, error = "failed", f"ocr: {e}"
+        pages.append(PageText(index, text, method, time.perf_counter() - began, error))
+    if rendered is not None:
+        rendered.close()
+    return pages
+
+
+def extract_image(data: bytes) -> PageText:
+    began = time.perf_counter()
+    try:
+        if Image is None:
+            raise RuntimeError("pytesseract and Pillow are not installed")
+        with Image.open(io.BytesIO(data)) as image:
+            return PageText(0, _ocr(image), "ocr", time.perf_counter() - began)
+    except Exception as e:
+        return PageText(0, "", "failed", time.perf_counter() - began, f"ocr: {e}")
+
+
+# ----------------- API side -----------------
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    The process-wide extraction pool, started on first use. Workers are
+    spawned rather than forked, so they don't inherit the API's threads,
+    sockets or locks.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown(executor: ProcessPoolExecutor | None = None):
+    """Stop the pool (or only `executor`, if it is still the current pool)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None and executor in (None, _executor):
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+async def _run_in_pool(func, *args):
+    executor = get_executor()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); the next call starts a new pool
+        shutdown(executor)
+        raise
+
+
+def page_ranges(pages: int, workers: int = EXTRACTION_WORKERS,
+                min_pages: int = EXTRACTION_MIN_PAGES_PER_TASK) -> list[range]:
+    """Split pages into at most `workers` contiguous, near-equal ranges."""
+    if pages <= 0:
+        return []
+    tasks = max(1, min(workers, pages // min_pages))
+    size = -(-pages // tasks)
+    return [range(start, min(start + size, pages)) for start in range(0, pages, size)]
+
+
+def _collect(pages: list[PageText], name: str) -> Extraction:
+    failed = [page for page in pages if page.method == "failed"]
+    for page in pages:
+        EXTRACTION_PAGES.observe(page.seconds, page.method)
+    if failed:
+        _log(f"{name}: {len(failed)} of {len(pages)} pages produced no text ({failed[0].error})")
+    return Extraction("\n\n".join(page.text for page in pages if page.text), pages)
+
+
+async def extract_pdf(data: bytes, max_pages: int | None = None, name: str = "upload") -> Extraction:
+    """
+    Extract a PDF's text, pages in parallel. Raises PageLimitExceeded (413)
+    if it has more than `max_pages` pages and 422 if it can't be parsed.
+    """
+    if pypdf is None:
+        _log(f"{name}: pypdf is not installed; PDF text can't be extracted")
+        return Extraction("", [])
+    try:
+        pages = await _run_in_pool(pdf_page_count, data)
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        _log(f"{name}: unreadable PDF ({e})")
+        raise HTTPException(status_code=422, detail="Could not read the PDF")
+    if max_pages is not None and pages > max_pages:
+        raise PageLimitExceeded(pages, max_pages)
+    chunks = await asyncio.gather(*(
+        _run_in_pool(extract_pdf_pages, data, pages_range.start, pages_range.stop)
+        for pages_range in page_ranges(pages)
+    ))
+    return _collect([page for chunk in chunks for page in chunk], name)
+
+
+async def extract_image_text(data: bytes, name: str = "upload") -> Extraction:
+    """OCR an image upload in the pool."""
+    page = await _run_in_pool(extract_image, data)
+    return _collect([page], name)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,138 @@
+import os
+import json
+import asyncio
+from datetime import datetime
+
+import redis
+from fastapi import UploadFile
+
+from app.agent_logic import UPLOAD_DIR, generate_doc_id, iter_upload_chunks
+from app.cache import async_redis_client, get_policy_snapshot
+from app.rate_limit import acquire_queued_job, release_queued_job
+
+# Redis stream + consumer group that feed the worker pool (app/worker.py)
+JOB_STREAM = "document_jobs"
+JOB_GROUP = "document_workers"
+JOB_KEY_PREFIX = "job:"
+JOB_TTL_SECONDS = 7 * 24 * 3600     # how long job status stays queryable
+
+# Uploads waiting for a worker are stored here (must be shared with the workers)
+JOB_UPLOAD_DIR = os.path.join(UPLOAD_DIR, "jobs")
+os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+
+
+class StoredUpload:
+    """
+    A stored upload that quacks like fastapi.UploadFile for process_document:
+    exposes filename/content_type and an async read(size).
+    """
+
+    def __init__(self, path: str, filename: str, content_type: str):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+        self._file = None
+
+    async def read(self, size: int = -1) -> bytes:
+        if self._file is None:
+            self._file = await asyncio.to_thread(open, self.path, "rb")
+        return await asyncio.to_thread(self._file.read, size)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def job_key(job_id: str) -> str:
+    return f"{JOB_KEY_PREFIX}{job_id}"
+
+
+async def ensure_job_group():
+    try:
+        await async_redis_client.xgroup_create(JOB_STREAM, JOB_GROUP, id="0", mkstream=True)
+    except redis.exceptions.ResponseError:
+        # Group already exists
+        pass
+
+
+def remove_upload(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _status_mapping(status: str, fields: dict) -> dict:
+    mapping = { "status": status, "updated_at": datetime.utcnow().isoformat() }
+    mapping.update({ k: v if isinstance(v, str) else json.dumps(v) for k, v in fields.items() })
+    return mapping
+
+
+async def set_job_status(job_id: str, status: str, **fields):
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(job_key(job_id), mapping=_status_mapping(status, fields))
+        pipe.expire(job_key(job_id), JOB_TTL_SECONDS)
+        await pipe.execute()
+
+
+async def enqueue_document_job(user_id: str, role: str, uploaded_file: UploadFile) -> str:
+    """
+    Store the upload on disk (streamed, with the role's byte ceiling), then
+    record a 'queued' job and add it to JOB_STREAM in one transaction. Returns
+    the job id, which is also the doc_id the worker will use. Raises 429 if
+    the user already has max_queued_jobs unfinished jobs. If anything fails
+    the stored file is removed, so no upload is left without a job.
+    """
+    job_id = generate_doc_id()
+    path = os.path.join(JOB_UPLOAD_DIR, f"{job_id}.upload")
+    max_bytes = get_policy_snapshot().max_upload_bytes_for(role)
+    now = datetime.utcnow().isoformat()
+    await acquire_queued_job(user_id, role, job_id)
+    try:
+        out_file = await asyncio.to_thread(open, path, "wb")
+    except BaseException:
+        await asyncio.shield(release_queued_job(user_id, job_id))
+        raise
+    try:
+        try:
+            async for chunk in iter_upload_chunks(uploaded_file, max_bytes):
+                await asyncio.to_thread(out_file.write, chunk)
+        finally:
+            await asyncio.to_thread(out_file.close)
+
+        async with async_redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(job_key(job_id), mapping=_status_mapping("queued", {
+                "user_id": user_id, "role": role, "doc_id": job_id,
+                "filename": uploaded_file.filename, "created_at": now, "attempts": "0",
+            }))
+            pipe.expire(job_key(job_id), JOB_TTL_SECONDS)
+            pipe.xadd(
+                JOB_STREAM,
+                {
+                    "job_id": job_id,
+                    "user_id": user_id,
+                    "role": role,
+                    "filename": uploaded_file.filename,
+                    "content_type": uploaded_file.content_type or "",
+                    "path": path,
+                    "timestamp": now,
+                }
+            )
+            await pipe.execute()
+    except BaseException:
+        await asyncio.shield(asyncio.to_thread(remove_upload, path))
+        await asyncio.shield(release_queued_job(user_id, job_id))
+        raise
+    return job_id
+
+
+async def get_job(job_id: str) -> dict | None:
+    """Return the job status hash (with 'result' decoded), or None if unknown/expired."""
+    job = await async_redis_client.hgetall(job_key(job_id))
+    if not job:
+        return None
+    if "result" in job:
+        job["result"] = json.loads(job["result"])
+    job["job_id"] = job_id
+    return job
@@ -1,23 +1,45 @@
-import os
-import uuid
-import shutil
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, status
+import asyncio
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query, status
 from pydantic import BaseModel
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, StreamingResponse
 
 from app.auth import validate_jwt_and_get_role
-from app.db import initialize_database, insert_document, update_document_status
+from app.db import initialize_database, update_document_status, run_in_db
 from app.agent_logic import process_document
+from app.classifier import get_classifier
 from app.policies import update_policy
-from app.cache import load_policies_into_cache
-from app.db import insert_user
+from app.cache import load_policies_into_cache, start_policy_listener, get_policy_snapshot
+from app.jobs import enqueue_document_job, ensure_job_group, get_job
+from app.batch import run_batch, BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY, BATCH_MAX_FILES
+from app.event_log import event_log
+from app.streams import ack_review_entry
+from app.rate_limit import RateLimitMiddleware
+from app.metrics import instrument_app
+from app.search import search_summaries, InvalidSearchCursor, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from app.db import ensure_user
 
 app = FastAPI(title="NoteGPT Assignment API")
-
-# Ensure the database and tables exist
-initialize_database()
-# Load initial policies into cache
-load_policies_into_cache()
+# Per-user/role rate limits and in-flight quotas on the submission endpoints
+# (added first so the metrics middleware below also times the 429s)
+app.add_middleware(RateLimitMiddleware)
+# Request timing, slow-request log and GET /metrics (Prometheus text format)
+instrument_app(app)
+
+@app.on_event("startup")
+async def startup():
+    # Ensure the database and tables exist
+    await run_in_db(initialize_database)
+    # Load initial policies into cache, then follow updates from other processes
+    await load_policies_into_cache()
+    start_policy_listener()
+    await ensure_job_group()
+    # Load the document classifier's weights before the first upload needs them
+    get_classifier()
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Write out buffered event log lines before the process exits
+    await asyncio.to_thread(event_log.shutdown)
 
 # ----------------- Data Models -----------------
 class UpdatePolicyRequest(BaseModel):
@@ -52,7 +74,7 @@ def get_token(user_id: str, role: str):
     if role in ["FreeUser", "PremiumUser", "Reviewer", "Admin"]:
         subscription_tier = "Free" if role == "FreeUser" else (
                             "Premium" if role == "PremiumUser" else "N/A")
-        insert_user(user_id=user_id, username=user_id, role=role, tier=subscription_tier)
+        ensure_user(user_id=user_id, username=user_id, role=role, tier=subscription_tier)
 
     return { "access_token": token, "token_type": "bearer" }
 
@@ -60,14 +82,24 @@ def get_token(user_id: str, role: str):
 @app.post("/submit_document/")
 async def submit_document(
     file: UploadFile = File(...),
+    async_mode: bool = False,
     user_data = Depends(validate_jwt_and_get_role)
 ):
     """
     Endpoint for users to submit a document (PDF, image, or plain text).
     Returns status: "completed" or "pending_review"/"rejected".
+    With ?async_mode=true the upload is queued for the worker pool instead and
+    202 is returned with a job id; poll GET /jobs/{job_id} for the outcome.
     """
     user_id, role = user_data
 
+    if async_mode:
+        job_id = await enqueue_document_job(user_id, role, file)
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={ "status": "queued", "job_id": job_id, "status_url": f"/jobs/{job_id}" },
+        )
+
     # Delegate to process_document() - returns a dict with status
     try:
         result = await process_document(user_id, role, file)
@@ -81,6 +113,62 @@ async def submit_document(
             detail=f"Internal processing error: {str(e)}"
         )
 
+@app.post("/submit_batch/")
+async def submit_batch(
+    files: list[UploadFile] = File(...),
+    concurrency: int = Query(BATCH_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY),
+    user_data = Depends(validate_jwt_and_get_role)
+):
+    """
+    Submit many documents in one request: several files, or zip/tar archives
+    whose members are processed as individual documents. Each document goes
+    through the same pipeline and governance checks as /submit_document/.
+    Streams one NDJSON line per document as it finishes, then a summary line.
+    """
+    user_id, role = user_data
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_FILES} files per batch")
+    # A batch's documents in flight count against the user's concurrency quota
+    max_concurrent = get_policy_snapshot().rate_limit_for(role).max_concurrent
+    if max_concurrent > 0:
+        concurrency = min(concurrency, max_concurrent)
+    return StreamingResponse(run_batch(user_id, role, files, concurrency), media_type="application/x-ndjson")
+
+@app.get("/jobs/{job_id}")
+async def job_status(
+    job_id: str,
+    user_data = Depends(validate_jwt_and_get_role)
+):
+    """
+    Status of an async submission: queued, running, retrying, completed,
+    pending_review, rejected or failed (with result/error once finished).
+    """
+    user_id, role = user_data
+    job = await get_job(job_id)
+    # Users only see their own jobs; Reviewers and Admins see all
+    if job is None or (job.get("user_id") != user_id and role not in ["Reviewer", "Admin"]):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/search")
+async def search(
+    q: str,
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    cursor: str | None = None,
+    user_data = Depends(validate_jwt_and_get_role)
+):
+    """
+    Full-text search over past summaries, Q&A notes, filenames and doc_types,
+    best (BM25) matches first. Pass the returned next_cursor to get the next page.
+    Users search their own documents; Reviewers and Admins search all.
+    """
+    user_id, role = user_data
+    scope = None if role in ["Reviewer", "Admin"] else user_id
+    try:
+        return await run_in_db(search_summaries, q, scope, limit, cursor)
+    except InvalidSearchCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.post("/override_review/")
 async def override_review(
     req: ReviewOverrideRequest,
@@ -97,12 +185,14 @@ async def override_review(
     if req.action not in ["approve", "reject"]:
         raise HTTPException(status_code=400, detail="Invalid action")
     new_status = "completed" if req.action == "approve" else "rejected"
-    update_document_status(req.doc_id, new_status)
+    await run_in_db(update_document_status, req.doc_id, new_status)
+    # The decision is made: drop the document's entry from review_queue
+    await ack_review_entry(req.doc_id)
 
     # Log override event
     from .agent_logic import log_event_processed, log_event_flagged
     if req.action == "approve":
-        log_event_processed(req.doc_id, user_id, "review_override", 0)
+        log_event_processed(req.doc_id, user_id, "review_override", 0, role)
     else:
         log_event_flagged(req.doc_id, user_id, "review_reject", role)
 
@@ -123,8 +213,10 @@ async def api_update_policy(
 
     try:
         # Insert/update the policy in SQLite and reload Redis cache
-        update_policy(req.key_name, req.new_value)
-        return { "status": "policy_updated", "key": req.key_name }
+        version = await update_policy(req.key_name, req.new_value)
+        return { "status": "policy_updated", "key": req.key_name, "version": version }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update policy: {str(e)}")
 
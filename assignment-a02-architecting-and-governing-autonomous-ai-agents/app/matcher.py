@@ -0,0 +1,100 @@
+import re
+import unicodedata
+from collections import deque
+from typing import Iterable, NamedTuple
+
+# A "word" is a run of Unicode letters/digits/underscore; everything else
+# (whitespace, punctuation, hyphens) is a boundary. So "hate," matches "hate",
+# and the keyword "self-harm" matches "self harm", "Self-Harm" or "self—harm".
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class Match(NamedTuple):
+    keyword: str    # the policy keyword as configured, e.g. "self-harm"
+    start: int      # character offset of the match in the original text
+    end: int        # end offset (exclusive)
+
+
+def normalize_token(token: str) -> str:
+    """NFKC + Unicode case folding, so 'ＨＡＴＥ', 'Hate' and 'hate' compare equal."""
+    return unicodedata.normalize("NFKC", token).casefold()
+
+
+def tokenize(text: str) -> list[str]:
+    return [normalize_token(m.group()) for m in _TOKEN_RE.finditer(text)]
+
+
+class KeywordMatcher:
+    """
+    Aho–Corasick automaton over normalized word tokens.
+
+    Keywords (single words or phrases) are compiled once; find_all() then scans
+    a document in one linear pass over its tokens, independent of how many
+    keywords the policy contains, and reports every match with its offsets.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = tuple(dict.fromkeys(k for k in keywords if tokenize(k)))
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[tuple[str, int]]] = [[]]   # (keyword, phrase length in tokens)
+        self._max_len = 0
+        for keyword in self.keywords:
+            self._add(keyword)
+        self._build_failure_links()
+
+    def __bool__(self) -> bool:
+        return bool(self.keywords)
+
+    def _add(self, keyword: str):
+        tokens = tokenize(keyword)
+        state = 0
+        for tok in tokens:
+            nxt = self._goto[state].get(tok)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][tok] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((keyword, len(tokens)))
+        self._max_len = max(self._max_len, len(tokens))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for tok, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and tok not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(tok, 0)
+                # Inherit matches that end at the fallback state (suffix phrases)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def _scan(self, text: str):
+        state = 0
+        # offsets of the last max_len tokens, to recover where a phrase started
+        spans = deque(maxlen=max(self._max_len, 1))
+        for m in _TOKEN_RE.finditer(text):
+            tok = normalize_token(m.group())
+            spans.append((m.start(), m.end()))
+            while state and tok not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(tok, 0)
+            for keyword, length in self._out[state]:
+                yield Match(keyword, spans[-length][0], m.end())
+
+    def find_all(self, text: str) -> list[Match]:
+        """Every keyword occurrence in `text`, in order of where it ends."""
+        if not self:
+            return []
+        return list(self._scan(text))
+
+    def search(self, text: str) -> Match | None:
+        """First match only (stops scanning as soon as one is found)."""
+        if not self:
+            return None
+        return next(self._scan(text), None)
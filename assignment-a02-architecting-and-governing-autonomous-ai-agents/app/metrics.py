@@ -0,0 +1,207 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi import FastAPI, Request
+from starlette.responses import PlainTextResponse
+
+from app.event_log import event_log
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Requests slower than this get their per-stage breakdown written to
+# logs/slow_requests.json; None turns the slow-request log off.
+SLOW_REQUEST_SECONDS = 1.0
+SLOW_REQUEST_LOG_FILE = "slow_requests.json"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Fixed-bucket histogram per label set; observe() is a bisect plus a few adds under a lock."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}     # labels → per-bucket counts, last one is +Inf
+        self._sums: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._series.get(labels)
+            if counts is None:
+                counts = self._series[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            counts[index] += 1
+            self._sums[labels] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), self._sums[labels]) for labels, counts in self._series.items()]
+        for labels, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+SPANS = Histogram("notegpt_span_seconds",
+                  "Time spent in pipeline stages and db/cache calls.", ("span",))
+REQUESTS = Histogram("notegpt_request_seconds",
+                     "HTTP request latency (until the response starts).", ("method", "route", "status"))
+DOCUMENTS = Counter("notegpt_documents_total",
+                    "Documents processed, by final status, doc_type and role.", ("status", "doc_type", "role"))
+REVIEW_MESSAGES = Counter("notegpt_review_messages_total",
+                          "review_queue entries handled by this process's consumers.", ("source",))
+REVIEW_PENDING = Gauge("notegpt_review_queue_pending",
+                       "review_queue entries delivered but not yet acknowledged, by consumer.", ("consumer",))
+REVIEW_LAG = Gauge("notegpt_review_queue_lag",
+                   "review_queue entries not yet delivered to the consumer group.", ())
+RATE_LIMITED = Counter("notegpt_rate_limited_total",
+                       "Submissions rejected with 429, by role and the limit hit.", ("role", "limit"))
+EXTRACTION_PAGES = Histogram("notegpt_extraction_page_seconds",
+                            "Time to extract one PDF page or image, by method (text_layer, ocr, failed).",
+                            ("method",), buckets=LATENCY_BUCKETS + (30.0, 60.0))
+SUMMARY_CHUNKS = Counter("notegpt_summary_chunks_total",
+                         "Chunks summarized in the map step, by source (backend call or memo hit).", ("source",))
+REGISTRY = [SPANS, REQUESTS, DOCUMENTS, REVIEW_MESSAGES, REVIEW_PENDING, REVIEW_LAG, RATE_LIMITED,
+            EXTRACTION_PAGES, SUMMARY_CHUNKS]
+
+# Spans recorded during the current request (None outside a request)
+_trace: ContextVar[list | None] = ContextVar("notegpt_trace", default=None)
+
+
+@contextmanager
+def span(name: str):
+    """Time a block into SPANS (and the current request's trace)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPANS.observe(elapsed, name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((name, elapsed))
+
+
+def timed(name: str):
+    """Decorator form of span() for sync and async functions."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_document(status: str, doc_type: str | None, role: str):
+    DOCUMENTS.inc(status, doc_type or "unknown", role)
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+def _log_slow_request(request: Request, status_code: int, elapsed: float, trace: list):
+    stages: dict[str, float] = {}
+    for name, seconds in trace:
+        stages[name] = stages.get(name, 0.0) + seconds
+    event_log.write(SLOW_REQUEST_LOG_FILE, {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+        "method": request.method,
+        "path": request.url.path,
+        "status": status_code,
+        "duration_ms": round(elapsed * 1000, 2),
+        "stages_ms": { name: round(seconds * 1000, 2)
+                       for name, seconds in sorted(stages.items(), key=lambda kv: -kv[1]) },
+    })
+
+
+def instrument_app(app: FastAPI):
+    """Add request timing (+ slow-request log) middleware and GET /metrics to an app."""
+
+    @app.middleware("http")
+    async def metrics_middleware(request: Request, call_next):
+        trace: list = []
+        token = _trace.set(trace)
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            _trace.reset(token)
+            route = request.scope.get("route")
+            REQUESTS.observe(elapsed, request.method, getattr(route, "path", "unmatched"), str(status_code))
+            if SLOW_REQUEST_SECONDS is not None and elapsed >= SLOW_REQUEST_SECONDS:
+                _log_slow_request(request, status_code, elapsed, trace)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        """Prometheus text exposition of this process's metrics."""
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,382 @@
+"""
+Versioned schema migrations for the NoteGPT SQLite database.
+
+The applied version is kept in SQLite's `PRAGMA user_version`. Each migration
+runs in its own write transaction together with the version bump, so a
+crash leaves the database at a clean version. Migrations must be safe on
+databases created by older code without a version (user_version = 0),
+which is why the early ones use IF NOT EXISTS / add-column-if-missing.
+
+    python -m app.migrations               # apply pending migrations
+    python -m app.migrations --check-plans # fail if a hot query full-scans
+"""
+import sys
+import sqlite3
+
+from app.db import transaction, get_db_connection
+from app.search import build_search_sql
+
+
+def _add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, decl: str):
+    columns = { row["name"] for row in conn.execute(f"PRAGMA table_info({table});") }
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl};")
+
+
+def _0001_base_schema(conn: sqlite3.Connection):
+    # Create users table
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            role TEXT NOT NULL,                -- FreeUser, PremiumUser, Reviewer, Admin
+            subscription_tier TEXT NOT NULL     -- e.g., Free, Premium
+        );
+    """)
+
+    # Create documents table
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS documents (
+            doc_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            original_filename TEXT,
+            raw_text TEXT,                     -- legacy inline text, see 0003
+            doc_type TEXT,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        );
+    """)
+
+    # Create summaries table
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS summaries (
+            summary_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_id TEXT NOT NULL,
+            summary_text TEXT,
+            notes_json TEXT,
+            created_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (doc_id) REFERENCES documents(doc_id)
+        );
+    """)
+
+    # Create policies table (key_name, value stored as JSON or string)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS policies (
+            policy_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key_name TEXT UNIQUE NOT NULL,
+            value TEXT NOT NULL
+        );
+    """)
+
+    # Create digests table
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS digests (
+            digest_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            digest_date DATE NOT NULL,
+            file_path TEXT NOT NULL
+        );
+    """)
+
+
+def _0002_content_dedup(conn: sqlite3.Connection):
+    _add_column_if_missing(conn, "documents", "content_hash", "TEXT")            # sha256 of the upload
+    _add_column_if_missing(conn, "documents", "summary_source_doc_id", "TEXT")   # summary reused from this doc
+    # Content hash → reusable classification/summary/notes (dedup cache)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS summary_cache (
+            content_hash TEXT PRIMARY KEY,
+            doc_type TEXT NOT NULL,
+            template_hash TEXT NOT NULL,    -- hash of the template the summary was made with
+            source_doc_id TEXT NOT NULL,    -- document that owns the summaries row
+            summary_text TEXT,
+            notes_json TEXT,
+            created_at TIMESTAMP NOT NULL
+        );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_summary_cache_doc_type ON summary_cache(doc_type);")
+
+
+def _0003_out_of_row_text(conn: sqlite3.Connection):
+    _add_column_if_missing(conn, "documents", "raw_size", "INTEGER")   # UTF-8 size of the text
+    # Compressed raw text, kept out of the documents rows so status updates
+    # and joins don't walk wide rows (see db.migrate_raw_text_out_of_row).
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS document_texts (
+            doc_id TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,            -- 'zlib' (or 'plain')
+            raw_size INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            FOREIGN KEY (doc_id) REFERENCES documents(doc_id)
+        );
+    """)
+
+
+def _0004_query_indexes(conn: sqlite3.Connection):
+    # Digest: join on summaries.doc_id, filter summaries.created_at / documents.doc_type
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_doc_id ON summaries(doc_id);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_created_at ON summaries(created_at);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_doc_type_created ON documents(doc_type, created_at);")
+    # Reviewer views: documents by status, most recently updated first
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_status_updated ON documents(status, updated_at);")
+
+
+def _0005_iso_timestamps(conn: sqlite3.Connection):
+    # Older rows were written by sqlite3's datetime adapter ('YYYY-MM-DD HH:MM:SS.ffffff').
+    # Normalise to the ISO-8601 form db.utc_now() writes, so string order = time order.
+    for table, column in [
+        ("documents", "created_at"),
+        ("documents", "updated_at"),
+        ("summaries", "created_at"),
+        ("summary_cache", "created_at"),
+    ]:
+        conn.execute(f"""
+            UPDATE {table}
+            SET {column} = replace({column}, ' ', 'T')
+            WHERE {column} LIKE '____-__-__ %';
+        """)
+
+
+def _0006_incremental_digests(conn: sqlite3.Connection):
+    # One digest per (date, doc_type), extended in place by each run
+    _add_column_if_missing(conn, "digests", "doc_type", "TEXT")
+    _add_column_if_missing(conn, "digests", "last_summary_id", "INTEGER")   # newest summary in the file
+    _add_column_if_missing(conn, "digests", "entry_count", "INTEGER")
+    _add_column_if_missing(conn, "digests", "file_size", "INTEGER")         # bytes committed to the file
+    _add_column_if_missing(conn, "digests", "updated_at", "TIMESTAMP")
+    # Older digests were academic-only, and reruns inserted duplicate rows
+    conn.execute("UPDATE digests SET doc_type = 'academic' WHERE doc_type IS NULL;")
+    conn.execute("""
+        DELETE FROM digests
+        WHERE digest_id NOT IN (SELECT MAX(digest_id) FROM digests GROUP BY digest_date, doc_type);
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_digests_date_doc_type ON digests(digest_date, doc_type);")
+    # Last summary_id folded into the digests, per doc_type
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS digest_watermarks (
+            doc_type TEXT PRIMARY KEY,
+            last_summary_id INTEGER NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        );
+    """)
+
+
+# Q&A pairs of a notes_json value as one searchable string (NULL if not valid JSON)
+_QA_TEXT_SQL = """
+    CASE WHEN json_valid({notes}) THEN (
+        SELECT group_concat(
+            coalesce(json_extract(value, '$.question'), '') || ' ' || coalesce(json_extract(value, '$.answer'), ''),
+            ' ')
+        FROM json_each({notes}, '$.questions_and_answers')
+    ) END
+"""
+
+
+def _0007_summaries_fts(conn: sqlite3.Connection):
+    # rowid = summaries.summary_id; doc_id is stored (unindexed) to join back to documents
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS summaries_fts USING fts5(
+            summary_text,
+            qa_text,
+            filename,
+            doc_type,
+            doc_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        );
+    """)
+    # Kept in sync by triggers, so every write path (db helpers and the group
+    # writer) updates the index in the same transaction as the summary.
+    insert_fts = f"""
+        INSERT INTO summaries_fts (rowid, summary_text, qa_text, filename, doc_type, doc_id)
+        VALUES (
+            new.summary_id,
+            new.summary_text,
+            {_QA_TEXT_SQL.format(notes="new.notes_json")},
+            (SELECT original_filename FROM documents WHERE doc_id = new.doc_id),
+            (SELECT doc_type FROM documents WHERE doc_id = new.doc_id),
+            new.doc_id
+        );
+    """
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS summaries_fts_ai AFTER INSERT ON summaries BEGIN
+            {insert_fts}
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS summaries_fts_ad AFTER DELETE ON summaries BEGIN
+            DELETE FROM summaries_fts WHERE rowid = old.summary_id;
+        END;
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS summaries_fts_au AFTER UPDATE ON summaries BEGIN
+            DELETE FROM summaries_fts WHERE rowid = old.summary_id;
+            {insert_fts}
+        END;
+    """)
+    # The pipeline sets doc_type after the summary row exists
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS summaries_fts_documents_au
+        AFTER UPDATE OF original_filename, doc_type ON documents BEGIN
+            UPDATE summaries_fts
+            SET filename = new.original_filename, doc_type = new.doc_type
+            WHERE rowid IN (SELECT summary_id FROM summaries WHERE doc_id = new.doc_id);
+        END;
+    """)
+    conn.execute(f"""
+        INSERT INTO summaries_fts (rowid, summary_text, qa_text, filename, doc_type, doc_id)
+        SELECT s.summary_id, s.summary_text, {_QA_TEXT_SQL.format(notes="s.notes_json")},
+               d.original_filename, d.doc_type, s.doc_id
+        FROM summaries s
+        LEFT JOIN documents d ON d.doc_id = s.doc_id;
+    """)
+    # Search joins a summary to every document that owns it, including dedup
+    # hits that point at it through summary_source_doc_id
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_summary_owner
+        ON documents(COALESCE(summary_source_doc_id, doc_id), user_id);
+    """)
+
+
+def _0008_summary_chunks(conn: sqlite3.Connection):
+    # Memoized chunk summaries (map step of app/summarizer.py), keyed by a hash
+    # of the chunk text, backend and map instruction, never the template
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS summary_chunks (
+            chunk_key TEXT PRIMARY KEY,
+            summary_text TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL
+        );
+    """)
+
+
+def _0009_one_summary_per_document(conn: sqlite3.Connection):
+    # A job retried after a partial commit could insert a second summary;
+    # keep the newest one and make summaries.doc_id unique (writes upsert on it)
+    conn.execute("""
+        DELETE FROM summaries
+        WHERE summary_id NOT IN (SELECT MAX(summary_id) FROM summaries GROUP BY doc_id);
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_summaries_doc_id;")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_summaries_doc_id ON summaries(doc_id);")
+
+
+def _0010_dedup_hit_summaries(conn: sqlite3.Connection):
+    # Dedup hits used to complete without a summaries row; give each one a copy
+    # of its source's summary so digests and search see every document
+    conn.execute("""
+        INSERT INTO summaries (doc_id, summary_text, notes_json, created_at)
+        SELECT d.doc_id, s.summary_text, s.notes_json, d.updated_at
+        FROM documents d
+        JOIN summaries s ON s.doc_id = d.summary_source_doc_id
+        WHERE d.status = 'completed'
+          AND NOT EXISTS (SELECT 1 FROM summaries own WHERE own.doc_id = d.doc_id)
+        ORDER BY d.updated_at;
+    """)
+    # Search now joins every document to its own summary
+    conn.execute("DROP INDEX IF EXISTS idx_documents_summary_owner;")
+
+
+# (version, description, function) — append only; never edit an applied migration
+MIGRATIONS = [
+    (1, "base schema", _0001_base_schema),
+    (2, "content-addressed dedup", _0002_content_dedup),
+    (3, "out-of-row compressed raw text", _0003_out_of_row_text),
+    (4, "indexes for digest and reviewer queries", _0004_query_indexes),
+    (5, "ISO-8601 timestamps", _0005_iso_timestamps),
+    (6, "incremental digests and watermarks", _0006_incremental_digests),
+    (7, "full-text search over summaries", _0007_summaries_fts),
+    (8, "memoized chunk summaries", _0008_summary_chunks),
+    (9, "one summary per document", _0009_one_summary_per_document),
+    (10, "summaries for dedup hits", _0010_dedup_hit_summaries),
+]
+
+
+def current_version() -> int:
+    with get_db_connection() as conn:
+        return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def apply_migrations() -> list[int]:
+    """Apply every pending migration in order. Returns the versions applied."""
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        with transaction() as conn:
+            # Re-check inside the write lock: another process may have migrated already
+            if conn.execute("PRAGMA user_version;").fetchone()[0] >= version:
+                continue
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {version};")
+        applied.append(version)
+    return applied
+
+
+# Queries on the request/digest path that must stay index-backed.
+# name → (sql, sample params)
+HOT_QUERIES = {
+    "digest_since_watermark": ("""
+        SELECT s.summary_id, s.summary_text, s.created_at
+        FROM summaries s
+        JOIN documents d ON s.doc_id = d.doc_id
+        WHERE d.doc_type = ?
+          AND s.summary_id > ?
+        ORDER BY s.summary_id;
+    """, ("academic", 0)),
+    "digest_for_date": ("""
+        SELECT s.summary_id, s.summary_text
+        FROM summaries s
+        JOIN documents d ON s.doc_id = d.doc_id
+        WHERE d.doc_type = ?
+          AND s.created_at >= ? AND s.created_at < ?
+        ORDER BY s.summary_id;
+    """, ("academic", "2025-01-01T00:00:00", "2025-01-02T00:00:00")),
+    "summaries_for_document": (
+        "SELECT summary_text, notes_json FROM summaries WHERE doc_id = ?;", ("x",)
+    ),
+    "documents_by_status": ("""
+        SELECT doc_id, user_id, original_filename, doc_type, updated_at
+        FROM documents
+        WHERE status = ?
+        ORDER BY updated_at DESC
+        LIMIT 50;
+    """, ("pending_review",)),
+    "documents_by_type_and_date": ("""
+        SELECT doc_id FROM documents
+        WHERE doc_type = ? AND created_at >= ?;
+    """, ("academic", "2025-01-01T00:00:00")),
+    "search_own_documents": (
+        build_search_sql(scoped=True, after_cursor=True),
+        { "query": '"summary"', "user_id": "u", "score": 0.0, "summary_id": 0, "doc_id": "", "limit": 21 },
+    ),
+}
+
+
+def explain(sql: str, params: tuple | dict = ()) -> list[str]:
+    with get_db_connection() as conn:
+        return [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def check_query_plans() -> dict[str, list[str]]:
+    """
+    Run EXPLAIN QUERY PLAN for every HOT_QUERIES entry and return the ones
+    that contain a full table scan (a 'SCAN' step not using an index), with
+    their plan. An empty dict means every hot query is index-backed.
+    """
+    problems = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = explain(sql, params)
+        if any(step.startswith("SCAN") and "INDEX" not in step for step in plan):
+            problems[name] = plan
+    return problems
+
+
+if __name__ == "__main__":
+    applied = apply_migrations()
+    print(f"Schema at version {current_version()}" + (f" (applied {applied})" if applied else ""))
+    if "--check-plans" in sys.argv:
+        problems = check_query_plans()
+        for name, plan in problems.items():
+            print(f"FULL SCAN in {name}: {plan}")
+        if problems:
+            sys.exit(1)
+        print(f"All {len(HOT_QUERIES)} hot queries are index-backed.")
@@ -1,11 +1,41 @@
-from app.db import upsert_policy
-from app.cache import load_policies_into_cache
+from fastapi import HTTPException
 
-def update_policy(key_name: str, new_value: str):
+from app.db import upsert_policy, run_in_db
+from app.cache import load_policies_into_cache, publish_policy_invalidation, get_policy_snapshot, policy_value_error
+from app.summary_cache import invalidate_doc_types
+
+# Keys maintained by the server itself, not through /update_policy/
+READ_ONLY_POLICIES = ("policy_version",)
+
+
+def validate_policy(key_name: str, new_value: str):
+    """Raise 400 for a value the snapshot could not use (checked before anything is written)."""
+    if key_name in READ_ONLY_POLICIES:
+        raise HTTPException(status_code=400, detail=f"{key_name} can't be set directly")
+    error = policy_value_error(key_name, new_value)
+    if error:
+        raise HTTPException(status_code=400, detail=f"Invalid {key_name}: {error}")
+
+
+async def update_policy(key_name: str, new_value: str) -> int:
     """
-    Insert or update a policy entry in SQLite, then refresh the Redis cache.
+    Insert or update a policy entry in SQLite (bumping the policy version),
+    refresh this process's snapshot and the Redis mirror, then publish an
+    invalidation so every other API/consumer process reloads too.
     new_value should be a JSON‐encoded string if the policy is JSON (e.g. prohibited_keywords).
+    Returns the new policy version; raises 400 if the value is invalid.
     """
-    upsert_policy(key_name, new_value)
+    validate_policy(key_name, new_value)
+    previous = get_policy_snapshot()
+    version = await run_in_db(upsert_policy, key_name, new_value)
     # Immediately reload cache
-    load_policies_into_cache()
+    await load_policies_into_cache()
+    # Summaries cached for a doc_type whose template changed are no longer valid
+    current = get_policy_snapshot()
+    changed = {
+        doc_type for doc_type in set(previous.templates) | set(current.templates)
+        if previous.templates.get(doc_type) != current.templates.get(doc_type)
+    }
+    await invalidate_doc_types(changed)
+    await publish_policy_invalidation(version)
+    return version
@@ -0,0 +1,399 @@
+import json
+import math
+import time
+import threading
+from datetime import datetime
+from typing import NamedTuple
+
+import redis
+
+from fastapi import HTTPException
+
+from app.auth import validate_jwt_and_get_role
+from app.cache import async_redis_client, get_policy_snapshot, RateLimit
+from app.metrics import RATE_LIMITED
+
+# Endpoints whose requests are limited (each one is a document submission)
+RATE_LIMITED_PATHS = ("/submit_document/", "/submit_batch/")
+RATE_LIMIT_KEY_PREFIX = "ratelimit:"
+# An in-flight slot not released within this long (its process died) expires
+INFLIGHT_SLOT_TTL_MS = 10 * 60 * 1000
+# Retry-After sent when the user is at max_concurrent
+CONCURRENCY_RETRY_AFTER = 1
+# Retry-After sent when the user is at max_queued_jobs (jobs take a while to drain)
+QUEUED_JOBS_RETRY_AFTER = 10
+# The set of a user's unfinished async jobs expires this long after their last
+# submission, so ids leaked by a crashed worker don't count forever
+QUEUED_JOBS_TTL_MS = 24 * 3600 * 1000
+# While Redis is down, log the fallback at most this often (seconds)
+FALLBACK_LOG_INTERVAL = 60
+# Request body ceilings on RATE_LIMITED_PATHS, checked while the body is
+# received (before the multipart parser spools it): the role's
+# max_upload_bytes plus multipart framing, and for a batch this many uploads'
+# worth. Requests without a valid token get the largest role's ceiling.
+UPLOAD_BODY_OVERHEAD = 64 * 1024
+BATCH_BODY_UPLOADS = 20
+BATCH_PATH = "/submit_batch/"
+
+# Token buckets (user, then role) and the in-flight counter, checked and
+# updated in one atomic step on the Redis clock. Buckets are hashes
+# { tokens, ts } that expire once they would be full again.
+#   KEYS: user bucket, role bucket, user in-flight counter
+#   ARGV: user tokens/s, user burst, role tokens/s, role burst, max in-flight, slot ttl (ms)
+#         (a rate or max in-flight of 0 means unlimited)
+#   Returns { allowed, retry_after_ms, limit }
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local function level(key, rate, burst)
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    return math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+end
+
+local function take(key, tokens, rate, burst)
+    redis.call('HSET', key, 'tokens', tokens - 1, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst * 1000 / rate))
+end
+
+local rates = { tonumber(ARGV[1]), tonumber(ARGV[3]) }
+local bursts = { tonumber(ARGV[2]), tonumber(ARGV[4]) }
+local levels = {}
+for i = 1, 2 do
+    if rates[i] > 0 then
+        levels[i] = level(KEYS[i], rates[i], bursts[i])
+        if levels[i] < 1 then
+            return { 0, math.ceil((1 - levels[i]) * 1000 / rates[i]), i == 1 and 'user_rate' or 'role_rate' }
+        end
+    end
+end
+
+local max_inflight = tonumber(ARGV[5])
+if max_inflight > 0 then
+    if tonumber(redis.call('GET', KEYS[3]) or '0') >= max_inflight then
+        return { 0, 0, 'concurrency' }
+    end
+    redis.call('INCR', KEYS[3])
+    redis.call('PEXPIRE', KEYS[3], ARGV[6])
+end
+for i = 1, 2 do
+    if levels[i] then
+        take(KEYS[i], levels[i], rates[i], bursts[i])
+    end
+end
+return { 1, 0, '' }
+"""
+
+# KEYS: user in-flight counter
+_RELEASE_LUA = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') > 0 then
+    return redis.call('DECR', KEYS[1])
+end
+return 0
+"""
+
+# An async job holds a slot from enqueue until the worker finishes it (the
+# request's in-flight slot is released as soon as the 202 is sent). A set of
+# job ids rather than a counter, so releasing the same job twice is harmless.
+#   KEYS: user's queued-job set
+#   ARGV: job id, max queued jobs (0 = unlimited), set ttl (ms)
+_QUEUE_JOB_LUA = """
+local max_queued = tonumber(ARGV[2])
+if max_queued > 0 and redis.call('SCARD', KEYS[1]) >= max_queued then
+    return 0
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+def _log(msg: str):
+    print(f"[{datetime.utcnow().isoformat()}] [RATE_LIMIT] {msg}")
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    retry_after: float      # seconds
+    limit: str              # 'user_rate' | 'role_rate' | 'concurrency' when rejected
+
+
+def _bucket_args(limit: RateLimit) -> list:
+    role_burst = limit.role_burst or limit.role_requests_per_minute
+    return [limit.requests_per_minute / 60, limit.burst, limit.role_requests_per_minute / 60, role_burst]
+
+
+class LocalRateLimiter:
+    """
+    In-process version of _ACQUIRE_LUA, used while Redis is unreachable.
+    Limits then apply per API process instead of across all of them.
+    """
+
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float]] = {}     # key → (tokens, ts)
+        self._inflight: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, keys: tuple[str, str, str], limit: RateLimit) -> Decision:
+        user_rate, user_burst, role_rate, role_burst = _bucket_args(limit)
+        now = time.monotonic()
+        with self._lock:
+            levels = {}
+            for key, rate, burst, name in ((keys[0], user_rate, user_burst, "user_rate"),
+                                           (keys[1], role_rate, role_burst, "role_rate")):
+                if rate <= 0:
+                    continue
+                tokens, ts = self._buckets.get(key, (burst, now))
+                levels[key] = min(burst, tokens + (now - ts) * rate)
+                if levels[key] < 1:
+                    return Decision(False, (1 - levels[key]) / rate, name)
+            if limit.max_concurrent > 0:
+                if self._inflight.get(keys[2], 0) >= limit.max_concurrent:
+                    return Decision(False, 0, "concurrency")
+                self._inflight[keys[2]] = self._inflight.get(keys[2], 0) + 1
+            for key, tokens in levels.items():
+                self._buckets[key] = (tokens - 1, now)
+        return Decision(True, 0, "")
+
+    def release(self, key: str):
+        with self._lock:
+            count = self._inflight.get(key, 0) - 1
+            if count > 0:
+                self._inflight[key] = count
+            else:
+                self._inflight.pop(key, None)
+
+
+_local_limiter = LocalRateLimiter()
+_fallback_logged_at = float("-inf")
+
+
+def _keys(user_id: str, role: str) -> tuple[str, str, str]:
+    return (f"{RATE_LIMIT_KEY_PREFIX}user:{user_id}",
+            f"{RATE_LIMIT_KEY_PREFIX}role:{role}",
+            f"{RATE_LIMIT_KEY_PREFIX}inflight:{user_id}")
+
+
+def _queued_jobs_key(user_id: str) -> str:
+    return f"{RATE_LIMIT_KEY_PREFIX}queued:{user_id}"
+
+
+async def acquire(user_id: str, role: str) -> tuple[Decision, bool]:
+    """
+    Take one token from the user's (and role's) bucket and one in-flight slot.
+    Returns (decision, local): `local` is True when the in-process fallback
+    decided because Redis failed; pass it back to release().
+    """
+    limit = get_policy_snapshot().rate_limit_for(role)
+    keys = _keys(user_id, role)
+    try:
+        allowed, retry_after_ms, name = await async_redis_client.eval(
+            _ACQUIRE_LUA, 3, *keys, *_bucket_args(limit), limit.max_concurrent, INFLIGHT_SLOT_TTL_MS
+        )
+        return Decision(bool(allowed), int(retry_after_ms) / 1000, name), False
+    except redis.exceptions.RedisError as e:
+        global _fallback_logged_at
+        if time.monotonic() - _fallback_logged_at >= FALLBACK_LOG_INTERVAL:
+            _fallback_logged_at = time.monotonic()
+            _log(f"Redis unavailable ({e}); using the in-process limiter")
+        return _local_limiter.acquire(keys, limit), True
+
+
+async def acquire_document(user_id: str, role: str) -> Decision:
+    """
+    Take one token from the user's (and role's) bucket for an extra document
+    in a request that already holds its in-flight slot (a batch member after
+    the first), so a batch costs as many tokens as it has documents.
+    """
+    limit = get_policy_snapshot().rate_limit_for(role)._replace(max_concurrent=0)
+    keys = _keys(user_id, role)
+    try:
+        allowed, retry_after_ms, name = await async_redis_client.eval(
+            _ACQUIRE_LUA, 3, *keys, *_bucket_args(limit), 0, INFLIGHT_SLOT_TTL_MS
+        )
+        return Decision(bool(allowed), int(retry_after_ms) / 1000, name)
+    except redis.exceptions.RedisError:
+        return _local_limiter.acquire(keys, limit)
+
+
+async def release(user_id: str, role: str, local: bool):
+    """Give back the in-flight slot taken by a successful acquire()."""
+    key = _keys(user_id, role)[2]
+    if local:
+        _local_limiter.release(key)
+        return
+    try:
+        await async_redis_client.eval(_RELEASE_LUA, 1, key)
+    except redis.exceptions.RedisError as e:
+        _log(f"Failed to release in-flight slot {key}: {e}")    # expires after INFLIGHT_SLOT_TTL_MS
+
+
+async def acquire_queued_job(user_id: str, role: str, job_id: str):
+    """
+    Count job_id against the user's max_queued_jobs, or raise 429 if the user
+    already has that many unfinished async jobs. Needs Redis (so does the queue).
+    """
+    limit = get_policy_snapshot().rate_limit_for(role)
+    allowed = await async_redis_client.eval(
+        _QUEUE_JOB_LUA, 1, _queued_jobs_key(user_id), job_id, limit.max_queued_jobs, QUEUED_JOBS_TTL_MS
+    )
+    if not allowed:
+        RATE_LIMITED.inc(role, "queued_jobs")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many queued jobs for this user (at most {limit.max_queued_jobs})",
+            headers={ "Retry-After": str(QUEUED_JOBS_RETRY_AFTER) },
+        )
+
+
+async def release_queued_job(user_id: str, job_id: str):
+    """Give back the slot of a finished (or never queued) async job."""
+    try:
+        await async_redis_client.srem(_queued_jobs_key(user_id), job_id)
+    except redis.exceptions.RedisError as e:
+        _log(f"Failed to release queued job {job_id}: {e}")     # expires after QUEUED_JOBS_TTL_MS
+
+
+def _bearer_token(scope) -> str | None:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" else None
+    return None
+
+
+def body_limit(path: str, role: str | None) -> int:
+    """Most request-body bytes accepted on `path` for `role` (None: unauthenticated)."""
+    policy = get_policy_snapshot()
+    per_upload = policy.max_upload_bytes_for(role) if role else max(policy.max_upload_bytes.values())
+    return per_upload * (BATCH_BODY_UPLOADS if path == BATCH_PATH else 1) + UPLOAD_BODY_OVERHEAD
+
+
+def _content_length(scope) -> int | None:
+    for name, value in scope.get("headers", ()):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+async def _send_json(send, status: int, payload: dict, headers: list | None = None):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *(headers or []),
+        ],
+    })
+    await send({ "type": "http.response.body", "body": body })
+
+
+class _BodyLimit:
+    """
+    Wraps receive/send to stop a request body at `limit` bytes: the client
+    gets 413 and the app sees a disconnect, so at most `limit` bytes are ever
+    spooled (chunked bodies without Content-Length included).
+    """
+
+    def __init__(self, receive, send, limit: int):
+        self._receive = receive
+        self._send = send
+        self.limit = limit
+        self.received = 0
+        self.started = False
+        self.rejected = False
+
+    async def receive(self):
+        if self.rejected:
+            return { "type": "http.disconnect" }
+        message = await self._receive()
+        if message["type"] == "http.request":
+            self.received += len(message.get("body", b""))
+            if self.received > self.limit:
+                self.rejected = True
+                if not self.started:
+                    await _send_json(self._send, 413, { "detail": f"Request body exceeds {self.limit} bytes" },
+                                     [(b"connection", b"close")])
+                return { "type": "http.disconnect" }
+        return message
+
+    async def send(self, message):
+        if self.rejected:
+            return      # the app's reaction to the disconnect; the 413 is already out
+        if message["type"] == "http.response.start":
+            self.started = True
+        await self._send(message)
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware enforcing the role's RateLimit on RATE_LIMITED_PATHS.
+    It runs before the endpoint, so a rejected upload's body is never read:
+    the client gets 429 with Retry-After straight away. The in-flight slot is
+    held until the response has been fully sent (including a streamed batch);
+    an async submission is then counted by acquire_queued_job until its job
+    finishes.
+    It also caps the request body (body_limit): a declared Content-Length over
+    the ceiling gets 413 before anything is read, and a body that grows past it
+    is cut off with 413.
+    Requests without a valid token pass through (body-capped) to get their 401
+    from the endpoint.
+    """
+
+    def __init__(self, app, paths=RATE_LIMITED_PATHS):
+        self.app = app
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        token = _bearer_token(scope)
+        try:
+            user_id, role = validate_jwt_and_get_role(token) if token else (None, None)
+        except Exception:
+            user_id = role = None
+
+        limit = body_limit(scope["path"], role if user_id is not None else None)
+        declared = _content_length(scope)
+        if declared is not None and declared > limit:
+            await _send_json(send, 413, { "detail": f"Request body exceeds {limit} bytes" },
+                             [(b"connection", b"close")])
+            return
+        if user_id is None:
+            await self._call_limited(scope, receive, send, limit)
+            return
+
+        decision, local = await acquire(user_id, role)
+        if not decision.allowed:
+            RATE_LIMITED.inc(role, decision.limit)
+            await self._reject(send, decision)
+            return
+        try:
+            await self._call_limited(scope, receive, send, limit)
+        finally:
+            await release(user_id, role, local)
+
+    async def _call_limited(self, scope, receive, send, limit: int):
+        bounded = _BodyLimit(receive, send, limit)
+        try:
+            await self.app(scope, bounded.receive, bounded.send)
+        except Exception:
+            # The app failing on the cut-off body (ClientDisconnect) is expected
+            if not bounded.rejected:
+                raise
+
+    async def _reject(self, send, decision: Decision):
+        retry_after = max(1, math.ceil(decision.retry_after)) if decision.limit != "concurrency" \
+            else CONCURRENCY_RETRY_AFTER
+        detail = ("Too many documents in flight for this user" if decision.limit == "concurrency"
+                  else "Rate limit exceeded")
+        await _send_json(send, 429, { "detail": detail, "limit": decision.limit },
+                         [(b"retry-after", str(retry_after).encode())])
@@ -0,0 +1,130 @@
+import re
+import asyncio
+from datetime import datetime
+
+from app.cache import async_redis_client
+
+REVIEW_FEED_BLOCK_MS = 5000         # XREAD block time of the shared reader
+REVIEW_FEED_BATCH_SIZE = 100        # entries per XREAD
+REVIEW_FEED_QUEUE_SIZE = 1000       # events buffered per subscriber before it is disconnected
+REVIEW_FEED_REPLAY_PAGE = 1000      # entries per XRANGE when replaying after a Last-Event-ID
+REVIEW_FEED_HEARTBEAT = 15          # seconds of silence before a keep-alive
+
+STREAM_ID_RE = re.compile(r"^\d+(-\d+)?$")
+
+
+def stream_id_key(stream_id: str) -> tuple[int, int]:
+    """Sortable form of a Redis stream id ('<ms>-<seq>')."""
+    ms, _, seq = stream_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+class ReviewFeed:
+    """
+    Fan-out of a Redis stream to any number of in-process subscribers (the SSE
+    clients of GET /review/stream). A single reader task per process does a
+    blocking XREAD and copies each entry to every subscriber's queue, so Redis
+    sees one connection however many reviewers are connected. This is a plain
+    XREAD, not the consumer group: every reviewer sees every entry, and the
+    consumers' acknowledgements are unaffected.
+    """
+
+    def __init__(self, stream: str):
+        self.stream = stream
+        self._subscribers: set[asyncio.Queue] = set()
+        self._task: asyncio.Task | None = None
+        # Id of the newest entry the reader has published (None until started).
+        # Every later entry reaches all current subscribers' queues.
+        self._live_id: str | None = None
+
+    async def _run(self):
+        # Start after the newest entry; older ones are served by replay
+        self._live_id = None
+        while True:
+            try:
+                if self._live_id is None:
+                    newest = await async_redis_client.xrevrange(self.stream, count=1)
+                    self._live_id = newest[0][0] if newest else "0-0"
+                entries = await async_redis_client.xread(
+                    { self.stream: self._live_id }, count=REVIEW_FEED_BATCH_SIZE, block=REVIEW_FEED_BLOCK_MS
+                )
+                for _, messages in entries or []:
+                    for message_id, fields in messages:
+                        self._live_id = message_id
+                        self._publish((message_id, fields))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[{datetime.utcnow().isoformat()}] Error in review feed reader: {e}")
+                await asyncio.sleep(1)
+
+    def _publish(self, event: tuple[str, dict]):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too slow to keep up: end its stream. The client reconnects
+                # with Last-Event-ID and catches up from Redis.
+                self._subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def subscribe(self, last_event_id: str | None = None):
+        """
+        Async generator of (stream_id, fields) for every new entry, preceded
+        by the entries after `last_event_id` when one is given. Yields None
+        after REVIEW_FEED_HEARTBEAT seconds without an entry.
+
+        The replay pages through the stream with XRANGE until it reaches the
+        reader's live cursor (or the end of the stream); everything after that
+        arrives through the subscriber's queue.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=REVIEW_FEED_QUEUE_SIZE)
+        # Subscribe before reading the replay so nothing falls in between;
+        # live entries the replay already covered are skipped below.
+        self._subscribers.add(queue)
+        self._ensure_started()
+        try:
+            last_key = None
+            if last_event_id:
+                start = last_event_id
+                while True:
+                    page = await async_redis_client.xrange(self.stream, min=f"({start}",
+                                                           count=REVIEW_FEED_REPLAY_PAGE)
+                    for event in page:
+                        last_key = stream_id_key(event[0])
+                        yield event
+                    if len(page) < REVIEW_FEED_REPLAY_PAGE:
+                        break
+                    if self._live_id is not None and last_key >= stream_id_key(self._live_id):
+                        break
+                    start = page[-1][0]
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), REVIEW_FEED_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                if last_key is not None and stream_id_key(event[0]) <= last_key:
+                    continue
+                yield event
+        finally:
+            self._subscribers.discard(queue)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
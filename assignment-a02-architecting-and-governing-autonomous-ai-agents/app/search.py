@@ -0,0 +1,96 @@
+import json
+import base64
+import binascii
+
+from app.db import get_db_connection
+from app.matcher import tokenize
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_SNIPPET_TOKENS = 16
+# bm25() weights for summaries_fts columns: summary_text, qa_text, filename, doc_type
+SEARCH_COLUMN_WEIGHTS = (1.0, 0.75, 2.0, 0.5)
+
+
+class InvalidSearchCursor(ValueError):
+    pass
+
+
+def build_search_sql(scoped: bool, after_cursor: bool) -> str:
+    """
+    BM25-ranked search over summaries_fts, one row per document whose summary
+    matches (dedup hits have their own copy). Ordered by (score, summary_id,
+    doc_id) so pages can be fetched with a keyset cursor.
+    """
+    weights = ", ".join(str(w) for w in SEARCH_COLUMN_WEIGHTS)
+    conditions = []
+    if scoped:
+        conditions.append("user_id = :user_id")
+    if after_cursor:
+        conditions.append("(score, summary_id, doc_id) > (:score, :summary_id, :doc_id)")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+        SELECT * FROM (
+            SELECT d.doc_id, d.user_id, d.original_filename AS filename, d.doc_type, d.status, d.created_at,
+                   f.rowid AS summary_id,
+                   snippet(summaries_fts, -1, '<mark>', '</mark>', '…', {SEARCH_SNIPPET_TOKENS}) AS snippet,
+                   bm25(summaries_fts, {weights}) AS score
+            FROM summaries_fts f
+            JOIN documents d ON d.doc_id = f.doc_id
+            WHERE summaries_fts MATCH :query
+        )
+        {where}
+        ORDER BY score, summary_id, doc_id
+        LIMIT :limit;
+    """
+
+
+def to_match_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 query: every word must match (implicit AND),
+    each quoted so user input can't inject FTS syntax. The last word also
+    matches as a prefix, for search-as-you-type.
+    """
+    tokens = tokenize(text)
+    if not tokens:
+        return ""
+    quoted = [f'"{t}"' for t in tokens]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def encode_cursor(row: dict) -> str:
+    payload = json.dumps([row["score"], row["summary_id"], row["doc_id"]])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        score, summary_id, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return { "score": float(score), "summary_id": int(summary_id), "doc_id": str(doc_id) }
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise InvalidSearchCursor("Invalid cursor")
+
+
+def search_summaries(text: str, user_id: str | None, limit: int = SEARCH_DEFAULT_LIMIT,
+                     cursor: str | None = None) -> dict:
+    """
+    Full-text search over summaries, Q&A notes, filenames and doc_types.
+    user_id=None searches every user's documents. Returns
+    { "results": [...], "next_cursor": str | None }.
+    """
+    query = to_match_query(text)
+    if not query:
+        return { "results": [], "next_cursor": None }
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    params = { "query": query, "user_id": user_id, "limit": limit + 1 }
+    if cursor:
+        params.update(decode_cursor(cursor))
+
+    sql = build_search_sql(scoped=user_id is not None, after_cursor=cursor is not None)
+    with get_db_connection() as conn:
+        rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    # One extra row tells whether another page exists
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return { "results": rows[:limit], "next_cursor": next_cursor }
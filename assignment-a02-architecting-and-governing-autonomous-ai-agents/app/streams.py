@@ -0,0 +1,79 @@
+import time
+
+from app.cache import async_redis_client
+
+REVIEW_STREAM = "review_queue"
+REVIEW_GROUP = "reviewers"
+PROCESSED_STREAM = "processed_notifications"
+# doc_id → stream id of the document's review_queue entry (a string key per
+# document, expiring together with the entry)
+REVIEW_INDEX_PREFIX = "review_queue:doc:"
+
+# Trimming, applied on every XADD ('~': Redis drops whole radix-tree nodes,
+# which keeps it O(1) amortized):
+#   review_queue keeps entries younger than this (MINID)
+REVIEW_QUEUE_RETENTION_MS = 30 * 24 * 3600 * 1000
+#   processed_notifications keeps about this many entries (MAXLEN)
+PROCESSED_NOTIFICATIONS_MAXLEN = 100_000
+
+# KEYS: stream, index key. ARGV: minid, index ttl (ms), group, field, value, ...
+# A document flagged again (a retried job) replaces its previous entry.
+_ADD_REVIEW_ENTRY_LUA = """
+local previous = redis.call('GET', KEYS[2])
+if previous then
+    redis.pcall('XACK', KEYS[1], ARGV[3], previous)   -- no-op without the group
+    redis.call('XDEL', KEYS[1], previous)
+end
+local id = redis.call('XADD', KEYS[1], 'MINID', '~', ARGV[1], '*', unpack(ARGV, 4))
+redis.call('SET', KEYS[2], id, 'PX', ARGV[2])
+return id
+"""
+
+# KEYS: stream, index key. ARGV: group. Returns 1 if an entry was removed.
+_ACK_REVIEW_ENTRY_LUA = """
+local id = redis.call('GET', KEYS[2])
+if not id then
+    return 0
+end
+redis.pcall('XACK', KEYS[1], ARGV[1], id)       -- no-op without the group
+redis.call('DEL', KEYS[2])
+return redis.call('XDEL', KEYS[1], id)
+"""
+
+
+def review_index_key(doc_id: str) -> str:
+    return f"{REVIEW_INDEX_PREFIX}{doc_id}"
+
+
+async def add_review_entry(doc_id: str, fields: dict) -> str:
+    """
+    XADD a flagged document to review_queue (trimming entries older than the
+    retention) and record its stream id under the doc_id, atomically.
+    Returns the stream id.
+    """
+    minid = int(time.time() * 1000) - REVIEW_QUEUE_RETENTION_MS
+    args = [minid, REVIEW_QUEUE_RETENTION_MS, REVIEW_GROUP]
+    for name, value in fields.items():
+        args.extend((name, value))
+    return await async_redis_client.eval(
+        _ADD_REVIEW_ENTRY_LUA, 2, REVIEW_STREAM, review_index_key(doc_id), *args
+    )
+
+
+async def ack_review_entry(doc_id: str) -> bool:
+    """
+    Acknowledge and delete a document's review_queue entry once a reviewer
+    has decided on it: one index lookup, XACK and XDEL, whatever the length
+    of the stream. Returns False if the document has no entry.
+    """
+    removed = await async_redis_client.eval(
+        _ACK_REVIEW_ENTRY_LUA, 2, REVIEW_STREAM, review_index_key(doc_id), REVIEW_GROUP
+    )
+    return bool(removed)
+
+
+async def add_processed_notification(fields: dict) -> str:
+    """XADD to processed_notifications, keeping about PROCESSED_NOTIFICATIONS_MAXLEN entries."""
+    return await async_redis_client.xadd(
+        PROCESSED_STREAM, fields, maxlen=PROCESSED_NOTIFICATIONS_MAXLEN, approximate=True
+    )
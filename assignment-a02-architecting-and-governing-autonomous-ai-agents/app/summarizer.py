@@ -0,0 +1,316 @@
+"""
+Map-reduce summarization of documents of any length.
+
+1. Chunk: the text is split into sections (lines such as "Introduction:",
+   "2. Methods" or "Abstract: ...") and packed into chunks of at most
+   SUMMARY_CHUNK_WORDS words. Small sections share a chunk; a section that is
+   too big for one is split with SUMMARY_CHUNK_OVERLAP_WORDS of overlap.
+   References/bibliography sections are left out.
+2. Map: every chunk is summarized to about SUMMARY_PARTIAL_WORDS words with
+   MAP_INSTRUCTION, concurrently (at most SUMMARY_CONCURRENCY backend calls
+   in flight per event loop). Chunk summaries are memoized in the summary_chunks
+   table under a hash of (backend, instruction, chunk text). The doc_type
+   template is not part of that key, so re-summarizing a document after a
+   template change only repeats the reduce step.
+3. Reduce: partial summaries are combined SUMMARY_REDUCE_FANIN at a time
+   until they fit in one call, which applies the doc_type template.
+
+A single-chunk document skips map and reduce: it is summarized once with the
+template.
+
+Backends implement SummaryBackend.summarize(); SUMMARY_BACKEND picks one from
+BACKENDS. The built-in "local" backend is a deterministic extractive
+stand-in (no model, no network) that honours the word or bullet count in the
+instruction.
+"""
+import re
+import math
+import asyncio
+import hashlib
+import weakref
+from collections import Counter
+from typing import NamedTuple
+
+from app.db import fetch_chunk_summaries, run_in_db
+from app.metrics import SUMMARY_CHUNKS
+from app.writer import UnitOfWork
+
+SUMMARY_BACKEND = "local"
+SUMMARY_CHUNK_WORDS = 800
+SUMMARY_CHUNK_OVERLAP_WORDS = 80
+SUMMARY_PARTIAL_WORDS = 150         # target length of chunk and intermediate summaries
+SUMMARY_REDUCE_FANIN = 8            # partial summaries combined per reduce call
+SUMMARY_CONCURRENCY = 8             # backend calls in flight per event loop
+DEFAULT_SUMMARY_WORDS = 200         # when the instruction doesn't say how long
+SKIPPED_SECTIONS = ("references", "bibliography", "works cited")
+
+MAP_INSTRUCTION = "Summarize this part of a longer document, keeping its key facts, terms and findings."
+COMBINE_INSTRUCTION = "Combine these partial summaries of one document into a single summary."
+
+# "Introduction", "2. Related Work", "## Methods", optionally followed by ':'
+_HEADING_RE = re.compile(r"^(?:#{1,6}\s*)?((?:\d+(?:\.\d+)*\.?\s+)?[A-Z][\w &/,'()-]{0,60}?)\s*:?$")
+# "Abstract: This paper ..." (a short title, then the section's first text)
+_INLINE_HEADING_RE = re.compile(r"^([A-Z][\w &/-]{1,40}):\s+(\S.*)$", re.DOTALL)
+_HEADING_MAX_WORDS = 8
+_INLINE_HEADING_MAX_WORDS = 4
+
+
+class Chunk(NamedTuple):
+    index: int
+    sections: tuple[str, ...]
+    text: str
+    words: int
+
+
+class Summary(NamedTuple):
+    text: str
+    chunks: int
+    memoized: int           # chunk summaries reused from summary_chunks
+    reduce_calls: int
+
+
+def _heading(line: str) -> tuple[str, str] | None:
+    """(title, text after the title) if the block's first line is a section heading."""
+    line = line.strip()
+    match = _INLINE_HEADING_RE.match(line)
+    if match and len(match.group(1).split()) <= _INLINE_HEADING_MAX_WORDS:
+        return match.group(1).strip(), match.group(2)
+    match = _HEADING_RE.match(line)
+    if match and len(line.split()) <= _HEADING_MAX_WORDS and not line.endswith((".", ",", ";")):
+        return match.group(1).strip(), ""
+    return None
+
+
+def split_sections(text: str) -> list[tuple[str, list[str]]]:
+    """[(section title, [paragraph, ...]), ...]; text before the first heading has title ''."""
+    sections: list[tuple[str, list[str]]] = [("", [])]
+    for block in re.split(r"\n\s*\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        first, _, rest = block.partition("\n")
+        heading = _heading(first)
+        if heading is None:
+            sections[-1][1].append(block)
+            continue
+        title, remainder = heading
+        sections.append((title, []))
+        body = "\n".join(part for part in (remainder, rest) if part.strip())
+        if body:
+            sections[-1][1].append(body)
+    return [(title, paragraphs) for title, paragraphs in sections if title or paragraphs]
+
+
+def chunk_text(text: str, chunk_words: int = SUMMARY_CHUNK_WORDS,
+               overlap_words: int = SUMMARY_CHUNK_OVERLAP_WORDS) -> list[Chunk]:
+    """Pack sections into chunks of at most chunk_words words (see the module docstring)."""
+    chunks: list[Chunk] = []
+    parts: list[str] = []
+    sections: list[str] = []
+    words = 0
+
+    def flush():
+        nonlocal parts, sections, words
+        if words:
+            chunks.append(Chunk(len(chunks), tuple(sections), "\n\n".join(parts), words))
+        parts, sections, words = [], [], 0
+
+    for title, paragraphs in split_sections(text):
+        if title.lower().rstrip(":") in SKIPPED_SECTIONS:
+            continue
+        pieces = []
+        # A paragraph longer than a chunk is cut into pieces that still fit
+        # in one after the overlap is prepended
+        piece_words = max(1, chunk_words - overlap_words)
+        for paragraph in paragraphs:
+            tokens = paragraph.split()
+            for start in range(0, len(tokens), piece_words):
+                piece = tokens[start:start + piece_words]
+                pieces.append((paragraph if len(piece) == len(tokens) else " ".join(piece), len(piece)))
+        if not pieces:
+            continue
+        section_words = sum(n for _, n in pieces)
+        if words and section_words <= chunk_words and words + section_words > chunk_words:
+            flush()         # a section that fits in a chunk of its own isn't split
+        sections.append(title)
+        if title:
+            parts.append(f"{title}:")
+        for piece, n in pieces:
+            if words and words + n > chunk_words:
+                tail = " ".join(" ".join(parts).split()[-overlap_words:]) if overlap_words else ""
+                flush()
+                sections.append(title)
+                if tail:
+                    parts.append(tail)
+                    words = len(tail.split())
+            parts.append(piece)
+            words += n
+    flush()
+    return chunks
+
+
+class SummaryBackend:
+    """
+    Interface for summarization backends. summarize() receives the text, an
+    instruction (MAP_INSTRUCTION, COMBINE_INSTRUCTION or the doc_type
+    template) and, for map/combine calls, a word budget; for the template
+    call max_words is None and the length comes from the template itself.
+    `name` is part of the memo key, so change it when a backend's output changes.
+    """
+
+    name = "base"
+
+    async def summarize(self, text: str, instruction: str, max_words: int | None = None) -> str:
+        raise NotImplementedError
+
+
+_WORD_RE = re.compile(r"[a-z][a-z0-9'-]+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORDS_TARGET_RE = re.compile(r"(\d+)[\s-]*words?\b", re.IGNORECASE)
+_POINTS_TARGET_RE = re.compile(r"(\d+)[\s-]*(?:key\s+)?(?:bullet\s+)?points?\b", re.IGNORECASE)
+_STOPWORDS = frozenset("""
+    a an and are as at be been but by for from has have in into is it its of on or our that the their these
+    this those to was we were which with will can also such than then there they not more most other
+""".split())
+_MIN_SENTENCE_WORDS = 4
+
+
+def summary_target(instruction: str, max_words: int | None = None) -> tuple[int, int | None]:
+    """(word budget, number of bullet points or None) asked for by an instruction."""
+    if max_words is not None:
+        return max_words, None
+    points = _POINTS_TARGET_RE.search(instruction)
+    if points:
+        return DEFAULT_SUMMARY_WORDS, int(points.group(1))
+    words = _WORDS_TARGET_RE.search(instruction)
+    return (int(words.group(1)) if words else DEFAULT_SUMMARY_WORDS), None
+
+
+def extractive_summary(text: str, instruction: str, max_words: int | None = None) -> str:
+    """
+    Pick the sentences with the highest average word frequency (over the
+    whole text, stopwords excluded) until the budget is used, and return
+    them in their original order. Deterministic: ties go to the earlier
+    sentence.
+    """
+    sentences = list(dict.fromkeys(
+        s.strip() for s in _SENTENCE_RE.split(text) if len(s.split()) >= _MIN_SENTENCE_WORDS
+    ))
+    if not sentences:
+        return text.strip()
+    budget, points = summary_target(instruction, max_words)
+    frequency = Counter(w for w in _WORD_RE.findall(text.lower()) if w not in _STOPWORDS)
+
+    def score(sentence: str) -> float:
+        terms = [w for w in _WORD_RE.findall(sentence.lower()) if w not in _STOPWORDS]
+        return sum(frequency[w] for w in terms) / math.sqrt(len(terms)) if terms else 0.0
+
+    ranked = sorted(range(len(sentences)), key=lambda i: (-score(sentences[i]), i))
+    if points is not None:
+        return "\n".join(f"- {sentences[i]}" for i in sorted(ranked[:points]))
+    chosen, used = [], 0
+    for i in ranked:
+        n = len(sentences[i].split())
+        if used + n <= budget:
+            chosen.append(i)
+            used += n
+    if not chosen:      # even the best sentence is over budget: cut it
+        return " ".join(sentences[ranked[0]].split()[:budget])
+    return " ".join(sentences[i] for i in sorted(chosen))
+
+
+class LocalBackend(SummaryBackend):
+    """Deterministic extractive stand-in (see extractive_summary), for tests and offline runs."""
+
+    name = "local-extractive-v1"
+
+    async def summarize(self, text: str, instruction: str, max_words: int | None = None) -> str:
+        return await asyncio.to_thread(extractive_summary, text, instruction, max_words)
+
+
+BACKENDS = {
+    "local": LocalBackend,
+}
+
+_backend: SummaryBackend | None = None
+# One semaphore per event loop: a semaphore binds to the loop it is first used
+# on, and the worker and tests run several loops (asyncio.run) in one process
+_backend_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def get_backend() -> SummaryBackend:
+    """The process-wide backend selected by SUMMARY_BACKEND."""
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[SUMMARY_BACKEND]()
+    return _backend
+
+
+def _slots() -> asyncio.Semaphore:
+    """The running loop's cap of SUMMARY_CONCURRENCY backend calls in flight."""
+    loop = asyncio.get_running_loop()
+    slots = _backend_slots.get(loop)
+    if slots is None:
+        slots = _backend_slots[loop] = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    return slots
+
+
+async def _call(backend: SummaryBackend, text: str, instruction: str, max_words: int | None = None) -> str:
+    async with _slots():
+        return await backend.summarize(text, instruction, max_words)
+
+
+def chunk_key(backend: SummaryBackend, chunk: Chunk) -> str:
+    key = hashlib.sha256()
+    for part in (backend.name, MAP_INSTRUCTION, str(SUMMARY_PARTIAL_WORDS), chunk.text):
+        key.update(part.encode("utf-8"))
+        key.update(b"\0")
+    return key.hexdigest()
+
+
+async def reduce_summaries(backend: SummaryBackend, partials: list[str], template: str) -> tuple[str, int]:
+    """Combine partial summaries level by level, then apply the template. Returns (summary, calls)."""
+    calls = 0
+    while len(partials) > SUMMARY_REDUCE_FANIN:
+        groups = [partials[i:i + SUMMARY_REDUCE_FANIN] for i in range(0, len(partials), SUMMARY_REDUCE_FANIN)]
+        partials = await asyncio.gather(*(
+            _call(backend, "\n\n".join(group), COMBINE_INSTRUCTION, SUMMARY_PARTIAL_WORDS) for group in groups
+        ))
+        calls += len(groups)
+    return await _call(backend, "\n\n".join(partials), template), calls + 1
+
+
+async def summarize_document(text: str, template: str, uow: UnitOfWork | None = None,
+                             backend: SummaryBackend | None = None) -> Summary:
+    """
+    Summarize `text` with the doc_type `template`. New chunk summaries are
+    added to `uow` (committed with the caller's other writes), or committed
+    right away when no unit of work is given.
+    """
+    backend = backend or get_backend()
+    chunks = chunk_text(text)
+    if not chunks:
+        return Summary("", 0, 0, 0)
+    if len(chunks) == 1:
+        return Summary(await _call(backend, chunks[0].text, template), 1, 0, 1)
+
+    keys = [chunk_key(backend, chunk) for chunk in chunks]
+    memo = await run_in_db(fetch_chunk_summaries, sorted(set(keys)))
+    missing = { key: chunk for key, chunk in zip(keys, chunks) if key not in memo }
+    summaries = await asyncio.gather(*(
+        _call(backend, chunk.text, MAP_INSTRUCTION, SUMMARY_PARTIAL_WORDS) for chunk in missing.values()
+    ))
+    new_entries = list(zip(missing, summaries))
+    SUMMARY_CHUNKS.inc("memo", amount=len(chunks) - len(missing))
+    SUMMARY_CHUNKS.inc("backend", amount=len(missing))
+    if new_entries:
+        own_uow = uow is None
+        uow = uow or UnitOfWork()
+        uow.cache_chunk_summaries(new_entries)
+        if own_uow:
+            await uow.commit()
+
+    done = { **memo, **dict(new_entries) }
+    partials = [done[key] for key in keys]
+    summary, reduce_calls = await reduce_summaries(backend, partials, template)
+    return Summary(summary, len(chunks), len(chunks) - len(missing), reduce_calls)
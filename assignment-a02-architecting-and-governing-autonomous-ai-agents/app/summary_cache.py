@@ -0,0 +1,97 @@
+import hashlib
+from datetime import datetime
+from typing import NamedTuple
+
+import redis
+
+from app.cache import async_cache_redis_client
+from app.db import fetch_cached_summary, delete_cached_summaries, run_in_db
+
+# Redis LRU tier in front of the summary_cache table, on the evictable cache
+# instance (maxmemory-policy allkeys-lru, see docker-compose.yml). The SQL
+# table is authoritative: if the cache instance is down, lookups go to SQL.
+SUMMARY_CACHE_PREFIX = "summary_cache:"
+SUMMARY_CACHE_TTL_SECONDS = 24 * 3600
+
+
+class CachedSummary(NamedTuple):
+    doc_type: str
+    template_hash: str
+    source_doc_id: str
+    summary_text: str
+    notes_json: str
+
+
+def _log(msg: str):
+    print(f"[{datetime.utcnow().isoformat()}] [SUMMARY_CACHE] {msg}")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def template_hash(template: str) -> str:
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+
+def _entry_key(chash: str) -> str:
+    return f"{SUMMARY_CACHE_PREFIX}{chash}"
+
+
+def _doc_type_index_key(doc_type: str) -> str:
+    # Set of content hashes cached for a doc_type, so a template change can drop them
+    return f"{SUMMARY_CACHE_PREFIX}doc_type:{doc_type}"
+
+
+async def remember_summary(chash: str, entry: CachedSummary):
+    """Put an entry into the Redis tier (the SQL row is written by the caller's unit of work)."""
+    try:
+        async with async_cache_redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(_entry_key(chash), mapping=entry._asdict())
+            pipe.expire(_entry_key(chash), SUMMARY_CACHE_TTL_SECONDS)
+            pipe.sadd(_doc_type_index_key(entry.doc_type), chash)
+            pipe.expire(_doc_type_index_key(entry.doc_type), SUMMARY_CACHE_TTL_SECONDS)
+            await pipe.execute()
+    except redis.exceptions.RedisError as e:
+        _log(f"Could not cache {chash}: {e}")
+
+
+async def lookup_summary(chash: str) -> CachedSummary | None:
+    """Redis first, then the summary_cache table (re-warming Redis on a hit)."""
+    try:
+        data = await async_cache_redis_client.hgetall(_entry_key(chash))
+    except redis.exceptions.RedisError as e:
+        _log(f"Cache lookup failed, reading SQL: {e}")
+        data = None
+    if data:
+        return CachedSummary(**data)
+    row = await run_in_db(fetch_cached_summary, chash)
+    if row is None:
+        return None
+    entry = CachedSummary(
+        doc_type=row["doc_type"],
+        template_hash=row["template_hash"],
+        source_doc_id=row["source_doc_id"],
+        summary_text=row["summary_text"] or "",
+        notes_json=row["notes_json"] or "",
+    )
+    await remember_summary(chash, entry)
+    return entry
+
+
+async def invalidate_doc_types(doc_types: set[str]):
+    """
+    Drop every cached summary for these doc_types from SQL and Redis. Entries
+    the Redis tier misses (or keeps, if it is down) are still rejected on read
+    by their template hash.
+    """
+    if not doc_types:
+        return
+    await run_in_db(delete_cached_summaries, sorted(doc_types))
+    try:
+        for doc_type in doc_types:
+            hashes = await async_cache_redis_client.smembers(_doc_type_index_key(doc_type))
+            keys = [_entry_key(h) for h in hashes] + [_doc_type_index_key(doc_type)]
+            await async_cache_redis_client.delete(*keys)
+    except redis.exceptions.RedisError as e:
+        _log(f"Could not drop cached summaries for {sorted(doc_types)}: {e}")
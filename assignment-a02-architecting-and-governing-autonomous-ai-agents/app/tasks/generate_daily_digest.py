@@ -1,61 +1,304 @@
 import os
-import sqlite3
-from datetime import datetime, timedelta
+import fcntl
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "notegpt.db")
+from app.db import get_db_connection, transaction, utc_now, initialize_database
 
-def generate_daily_digest():
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "archives")
+DIGEST_DOC_TYPES = ["academic"]     # doc_types that get a daily digest by default
+DIGEST_FETCH_SIZE = 500             # rows streamed per fetchmany / committed per checkpoint
+DIGEST_WORKERS = 4                  # digests built in parallel (each holds at most 2 pooled connections)
+
+# New summaries of one doc_type since the watermark, in commit order
+SUMMARIES_SINCE_SQL = """
+    SELECT s.summary_id, s.summary_text, s.created_at
+    FROM summaries s
+    JOIN documents d ON s.doc_id = d.doc_id
+    WHERE d.doc_type = ?
+      AND s.summary_id > ?
+    ORDER BY s.summary_id;
+"""
+# Every summary of one doc_type created on one UTC date (for rebuilds/backfill)
+SUMMARIES_FOR_DATE_SQL = """
+    SELECT s.summary_id, s.summary_text
+    FROM summaries s
+    JOIN documents d ON s.doc_id = d.doc_id
+    WHERE d.doc_type = ?
+      AND s.created_at >= ? AND s.created_at < ?
+    ORDER BY s.summary_id;
+"""
+SELECT_DIGEST_SQL = """
+    SELECT file_path, last_summary_id, entry_count, file_size
+    FROM digests
+    WHERE digest_date = ? AND doc_type = ?;
+"""
+UPSERT_DIGEST_SQL = """
+    INSERT INTO digests (digest_date, doc_type, file_path, last_summary_id, entry_count, file_size, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(digest_date, doc_type) DO UPDATE SET
+        file_path=excluded.file_path,
+        last_summary_id=excluded.last_summary_id,
+        entry_count=excluded.entry_count,
+        file_size=excluded.file_size,
+        updated_at=excluded.updated_at;
+"""
+SELECT_WATERMARK_SQL = "SELECT last_summary_id FROM digest_watermarks WHERE doc_type = ?;"
+UPSERT_WATERMARK_SQL = """
+    INSERT INTO digest_watermarks (doc_type, last_summary_id, updated_at)
+    VALUES (?, ?, ?)
+    ON CONFLICT(doc_type) DO UPDATE SET
+        last_summary_id=excluded.last_summary_id,
+        updated_at=excluded.updated_at;
+"""
+
+
+def digest_path(digest_date: str, doc_type: str) -> str:
+    # Academic digests keep their original file name
+    if doc_type == "academic":
+        return os.path.join(ARCHIVE_DIR, f"digest_{digest_date}.txt")
+    return os.path.join(ARCHIVE_DIR, f"digest_{doc_type}_{digest_date}.txt")
+
+
+def _lock_digest(digest_date: str, doc_type: str):
+    """
+    Exclusive lock on one (date, doc_type) digest, held by whoever rewrites
+    (build_digest) or appends to (DigestFile) it, across threads and
+    processes. Returns the lock file; closing it releases the lock.
+    """
+    lock_file = open(f"{digest_path(digest_date, doc_type)}.lock", "a")
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    return lock_file
+
+
+def _digest_header(digest_date: str, doc_type: str) -> bytes:
+    return (f"Daily {doc_type.title()} Study Guide for {digest_date}\n" + "="*50 + "\n\n").encode("utf-8")
+
+
+def _digest_entry(index: int, summary: str | None) -> bytes:
+    return f"{index}. {summary}\n\n".encode("utf-8")
+
+
+def _day_bounds(digest_date: str) -> tuple[str, str]:
+    start = date.fromisoformat(digest_date)
+    return f"{start.isoformat()}T00:00:00", f"{(start + timedelta(days=1)).isoformat()}T00:00:00"
+
+
+class DigestFile:
+    """
+    Append-only writer for one (date, doc_type) digest. The digests row records
+    how many bytes of the file are committed; reopening truncates anything
+    written after that (an interrupted run), so re-running never duplicates
+    entries. Holds the digest's lock (`lock_file`) until closed, so a backfill
+    can't replace the file underneath it.
+    """
+
+    def __init__(self, digest_date: str, doc_type: str, last_summary_id: int, entry_count: int, file_size: int,
+                 lock_file):
+        self._lock_file = lock_file
+        self.digest_date = digest_date
+        self.doc_type = doc_type
+        self.path = digest_path(digest_date, doc_type)
+        self.last_summary_id = last_summary_id
+        self.entry_count = entry_count
+        self._file = open(self.path, "r+b")
+        self._file.truncate(file_size)
+        self._file.seek(file_size)
+
+    def append(self, summary_id: int, summary: str | None):
+        if summary_id <= self.last_summary_id:
+            return      # already in the file (e.g. written by a backfill)
+        self.entry_count += 1
+        self._file.write(_digest_entry(self.entry_count, summary))
+        self.last_summary_id = summary_id
+
+    def checkpoint(self) -> tuple:
+        """Make the appended bytes durable; returns the UPSERT_DIGEST_SQL params to commit."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return (self.digest_date, self.doc_type, self.path, self.last_summary_id,
+                self.entry_count, self._file.tell(), utc_now())
+
+    def close(self):
+        self._file.close()
+        self._lock_file.close()
+
+
+def build_digest(digest_date: str, doc_type: str) -> int:
     """
-    1) Query all academic summaries created in the last day
-    2) Write them to archives/digest_{date}.txt
-    3) Insert a record into the digests table
+    (Re)build the digest for one date and doc_type from scratch, streaming the
+    rows into a temporary file that replaces the old one. Returns the number
+    of entries (0 → no file is written). Waits for any run appending to it.
     """
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+    lock_file = _lock_digest(digest_date, doc_type)
+    try:
+        return _build_digest_locked(digest_date, doc_type)
+    finally:
+        lock_file.close()
+
+
+def _build_digest_locked(digest_date: str, doc_type: str) -> int:
+    start, end = _day_bounds(digest_date)
+    path = digest_path(digest_date, doc_type)
+    tmp_path = f"{path}.tmp"
+    entry_count, last_summary_id = 0, 0
+    with get_db_connection() as conn:
+        cur = conn.execute(SUMMARIES_FOR_DATE_SQL, (doc_type, start, end))
+        with open(tmp_path, "wb") as f:
+            f.write(_digest_header(digest_date, doc_type))
+            while True:
+                rows = cur.fetchmany(DIGEST_FETCH_SIZE)
+                if not rows:
+                    break
+                for summary_id, summary in rows:
+                    entry_count += 1
+                    f.write(_digest_entry(entry_count, summary))
+                    last_summary_id = summary_id
+            f.flush()
+            os.fsync(f.fileno())
+            file_size = f.tell()
+
+    if entry_count == 0:
+        os.remove(tmp_path)
+        return 0
+    os.replace(tmp_path, path)
+    with transaction() as conn:
+        conn.execute(UPSERT_DIGEST_SQL, (digest_date, doc_type, path, last_summary_id,
+                                         entry_count, file_size, utc_now()))
+    return entry_count
+
+
+def _open_digest(digest_date: str, doc_type: str) -> DigestFile:
+    # The digests row is read under the lock, so it matches the file on disk
+    lock_file = _lock_digest(digest_date, doc_type)
+    try:
+        with get_db_connection() as conn:
+            row = conn.execute(SELECT_DIGEST_SQL, (digest_date, doc_type)).fetchone()
+        path = digest_path(digest_date, doc_type)
+        if row is None:
+            # First entry of this day: start a new file with just the header
+            with open(path, "wb") as f:
+                f.write(_digest_header(digest_date, doc_type))
+            return DigestFile(digest_date, doc_type, 0, 0, len(_digest_header(digest_date, doc_type)), lock_file)
+        if row["file_size"] is None or not os.path.exists(path) or os.path.getsize(path) < row["file_size"]:
+            # Legacy digest row or the file went missing: rebuild, then extend it
+            _build_digest_locked(digest_date, doc_type)
+            with get_db_connection() as conn:
+                row = conn.execute(SELECT_DIGEST_SQL, (digest_date, doc_type)).fetchone()
+        return DigestFile(digest_date, doc_type, row["last_summary_id"], row["entry_count"], row["file_size"],
+                          lock_file)
+    except BaseException:
+        lock_file.close()
+        raise
 
-    # Compute yesterday’s midnight in UTC
+
+def _initial_watermark(doc_type: str) -> int:
+    """Without a watermark, start from yesterday's midnight (the original nightly window)."""
     yesterday_midnight = (datetime.utcnow() - timedelta(days=1)).replace(
         hour=0, minute=0, second=0, microsecond=0
-    ).strftime("%Y-%m-%d %H:%M:%S")
-
-    # Fetch academic summaries created since yesterday midnight
-    cur.execute("""
-        SELECT s.summary_text 
-        FROM summaries s
-        JOIN documents d ON s.doc_id = d.doc_id
-        WHERE d.doc_type = 'academic'
-          AND s.created_at >= ?
-    """, (yesterday_midnight,))
-    rows = cur.fetchall()
-
-    if not rows:
-        print("No academic summaries found for yesterday.")
-        conn.close()
-        return
-
-    # Prepare archive directory
-    archive_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "archives")
-    os.makedirs(archive_dir, exist_ok=True)
-
-    today_str = datetime.utcnow().strftime("%Y-%m-%d")
-    digest_filename = os.path.join(archive_dir, f"digest_{today_str}.txt")
-
-    with open(digest_filename, "w", encoding="utf-8") as f:
-        f.write(f"Daily Academic Study Guide for {today_str}\n")
-        f.write("="*50 + "\n\n")
-        for idx, (summary,) in enumerate(rows, start=1):
-            f.write(f"{idx}. {summary}\n\n")
-
-    # Record digest in SQL
-    digest_date = today_str  # just the date portion
-    cur.execute("""
-        INSERT INTO digests (digest_date, file_path)
-        VALUES (?, ?);
-    """, (digest_date, digest_filename))
-    conn.commit()
-    conn.close()
-
-    print(f"Generated daily digest: {digest_filename}")
+    ).isoformat()
+    with get_db_connection() as conn:
+        row = conn.execute("SELECT MIN(summary_id) FROM summaries WHERE created_at >= ?;",
+                           (yesterday_midnight,)).fetchone()
+    if row[0] is None:
+        with get_db_connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(summary_id), 0) FROM summaries;").fetchone()[0]
+    return row[0] - 1
+
+
+def update_digests(doc_type: str) -> int:
+    """
+    Fold the summaries created since the last successful run into the per-date
+    digest files of `doc_type`. Rows are streamed with fetchmany, appended to
+    the file of the day they were created on, and every DIGEST_FETCH_SIZE rows
+    the files are fsynced and the digests rows + watermark committed together,
+    so memory stays flat and an interrupted run resumes where it stopped.
+    Returns the number of summaries processed.
+    """
+    with get_db_connection() as conn:
+        row = conn.execute(SELECT_WATERMARK_SQL, (doc_type,)).fetchone()
+    watermark = row["last_summary_id"] if row else _initial_watermark(doc_type)
+
+    open_digests: dict[str, DigestFile] = {}
+    processed = 0
+    try:
+        with get_db_connection() as conn:
+            cur = conn.execute(SUMMARIES_SINCE_SQL, (doc_type, watermark))
+            while True:
+                rows = cur.fetchmany(DIGEST_FETCH_SIZE)
+                if not rows:
+                    break
+                touched = set()
+                for summary_id, summary, created_at in rows:
+                    digest_date = created_at[:10]
+                    digest = open_digests.get(digest_date)
+                    if digest is None:
+                        digest = open_digests[digest_date] = _open_digest(digest_date, doc_type)
+                    digest.append(summary_id, summary)
+                    touched.add(digest_date)
+                watermark = rows[-1][0]
+                checkpoints = [open_digests[d].checkpoint() for d in touched]
+                with transaction() as wconn:
+                    for params in checkpoints:
+                        wconn.execute(UPSERT_DIGEST_SQL, params)
+                    wconn.execute(UPSERT_WATERMARK_SQL, (doc_type, watermark, utc_now()))
+                processed += len(rows)
+                # Summaries arrive in commit order, so older days are finished
+                newest = max(touched)
+                for d in [d for d in open_digests if d < newest]:
+                    open_digests.pop(d).close()
+    finally:
+        for digest in open_digests.values():
+            digest.close()
+    return processed
+
+
+def _dates(date_from: str, date_to: str) -> list[str]:
+    start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+def backfill_digests(date_from: str, date_to: str, doc_types: list[str], workers: int = DIGEST_WORKERS):
+    """Rebuild the digests for every date in [date_from, date_to] × doc_types in parallel."""
+    jobs = [(d, doc_type) for d in _dates(date_from, date_to) for doc_type in doc_types]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (d, doc_type), count in zip(jobs, pool.map(lambda job: build_digest(*job), jobs)):
+            if count:
+                print(f"Rebuilt {doc_type} digest for {d}: {count} summaries → {digest_path(d, doc_type)}")
+            else:
+                print(f"No {doc_type} summaries found for {d}.")
+
+
+def generate_daily_digest(doc_types: list[str] = None, workers: int = DIGEST_WORKERS):
+    """
+    1) Stream the summaries of each doc_type created since that doc_type's watermark
+    2) Append them to archives/digest_{date}.txt for the day they were created
+    3) Record each digest (and the new watermark) in the digests tables
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    doc_types = doc_types or DIGEST_DOC_TYPES
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for doc_type, count in zip(doc_types, pool.map(update_digests, doc_types)):
+            if count:
+                print(f"Added {count} {doc_type} summaries to the daily digests.")
+            else:
+                print(f"No new {doc_type} summaries since the last digest run.")
+
 
 if __name__ == "__main__":
-    generate_daily_digest()
+    parser = argparse.ArgumentParser(description="Build the daily study-guide digests.")
+    parser.add_argument("--from", dest="date_from", help="backfill: first date to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="backfill: last date to rebuild (default: --from)")
+    parser.add_argument("--doc-type", dest="doc_types", action="append",
+                        help=f"doc_type to digest; repeatable (default: {', '.join(DIGEST_DOC_TYPES)})")
+    parser.add_argument("--workers", type=int, default=DIGEST_WORKERS)
+    args = parser.parse_args()
+
+    initialize_database()
+    if args.date_from:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        backfill_digests(args.date_from, args.date_to or args.date_from,
+                         args.doc_types or DIGEST_DOC_TYPES, args.workers)
+    else:
+        generate_daily_digest(args.doc_types, args.workers)
@@ -0,0 +1,206 @@
+import os
+import socket
+import asyncio
+import argparse
+from datetime import datetime
+
+from fastapi import HTTPException
+
+from app.agent_logic import process_document
+from app.cache import async_redis_client, reload_policy_snapshot, start_policy_listener
+from app.db import run_in_db
+from app.jobs import JOB_STREAM, JOB_GROUP, StoredUpload, ensure_job_group, remove_upload, set_job_status
+from app.rate_limit import release_queued_job
+
+WORKER_CONCURRENCY = 4              # jobs processed concurrently per worker process
+WORKER_BLOCK_MS = 5000              # XREADGROUP block time
+JOB_VISIBILITY_TIMEOUT_MS = 60_000  # a job pending longer than this is reclaimed by another worker
+JOB_LEASE_RENEW_SECONDS = JOB_VISIBILITY_TIMEOUT_MS / 3000   # running jobs reset their idle time this often
+JOB_MAX_ATTEMPTS = 3                # deliveries before a job is marked failed
+
+# Stream ids of the jobs running in this process. All slots share one
+# consumer name, so XAUTOCLAIM can't tell them apart from a stalled job.
+_running_jobs: set[str] = set()
+
+
+def log(msg: str):
+    print(f"[{datetime.utcnow().isoformat()}] [WORKER] {msg}")
+
+
+async def _finish_job(job: dict, message_id: str, status: str, **fields):
+    """Record a final status, acknowledge the entry and free the user's queued-job slot."""
+    await set_job_status(job["job_id"], status, **fields)
+    await async_redis_client.xack(JOB_STREAM, JOB_GROUP, message_id)
+    await release_queued_job(job["user_id"], job["job_id"])
+    await asyncio.to_thread(remove_upload, job["path"])
+
+
+async def _renew_lease(consumer_name: str, message_id: str):
+    """
+    Keep a running job's pending entry fresh (XCLAIM ... JUSTID resets its idle
+    time without counting a delivery), so no worker reclaims a job that is
+    merely slow.
+    """
+    while True:
+        await asyncio.sleep(JOB_LEASE_RENEW_SECONDS)
+        try:
+            await async_redis_client.xclaim(
+                JOB_STREAM, JOB_GROUP, consumer_name, min_idle_time=0, message_ids=[message_id], justid=True
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"Failed to renew the lease on {message_id}: {e}")
+
+
+async def run_job(consumer_name: str, message_id: str, fields: dict, attempt: int):
+    """
+    Run process_document for one queued upload. Governance outcomes (rejection,
+    review) are final; unexpected errors leave the entry pending so it is
+    retried after JOB_VISIBILITY_TIMEOUT_MS, up to JOB_MAX_ATTEMPTS deliveries.
+    While the job runs its lease is renewed, so only a crashed or stuck worker
+    loses it.
+    """
+    _running_jobs.add(message_id)
+    lease = asyncio.create_task(_renew_lease(consumer_name, message_id))
+    try:
+        await _run_job(consumer_name, message_id, fields, attempt)
+    finally:
+        lease.cancel()
+        _running_jobs.discard(message_id)
+
+
+async def _run_job(consumer_name: str, message_id: str, fields: dict, attempt: int):
+    job_id = fields["job_id"]
+    upload = StoredUpload(fields["path"], fields["filename"], fields["content_type"])
+    await set_job_status(job_id, "running", attempts=str(attempt), worker=consumer_name)
+    try:
+        # doc_id = job_id, so a retried job reuses the same document row
+        result = await process_document(fields["user_id"], fields["role"], upload, doc_id=job_id)
+    except HTTPException as he:
+        await _finish_job(fields, message_id, "rejected",
+                          error=str(he.detail), status_code=str(he.status_code))
+        return
+    except Exception as e:
+        if attempt >= JOB_MAX_ATTEMPTS:
+            log(f"Job {job_id} failed after {attempt} attempts: {e}")
+            await _finish_job(fields, message_id, "failed", error=str(e))
+        else:
+            log(f"Job {job_id} attempt {attempt} failed, will retry: {e}")
+            await set_job_status(job_id, "retrying", error=str(e))
+        return
+    finally:
+        upload.close()
+    await _finish_job(fields, message_id, result["status"], result=result)
+
+
+async def consume_new_jobs(consumer_name: str):
+    """One processing slot: read new jobs for this consumer and run them one at a time."""
+    while True:
+        try:
+            entries = await async_redis_client.xreadgroup(
+                JOB_GROUP, consumer_name, { JOB_STREAM: ">" }, count=1, block=WORKER_BLOCK_MS
+            )
+            for _, messages in entries or []:
+                for message_id, fields in messages:
+                    await run_job(consumer_name, message_id, fields, attempt=1)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"Error reading jobs: {e}")
+            await asyncio.sleep(1)
+
+
+async def _run_reclaimed(slots: asyncio.Semaphore, consumer_name: str, message_id: str, fields: dict,
+                         attempt: int):
+    try:
+        await run_job(consumer_name, message_id, fields, attempt=attempt)
+    except Exception as e:
+        log(f"Error running reclaimed job {message_id}: {e}")
+    finally:
+        slots.release()
+
+
+async def reclaim_stale_jobs(consumer_name: str, concurrency: int = WORKER_CONCURRENCY):
+    """
+    Periodically take over jobs whose consumer crashed or stalled (pending
+    longer than the visibility timeout) and retry them here, up to
+    `concurrency` at a time. A job is only claimed once a slot is free, so it
+    never waits here without its lease being renewed. A job delivered more
+    than JOB_MAX_ATTEMPTS times (it keeps killing its worker before run_job
+    can record the failure) is marked failed instead of being run again.
+    """
+    slots = asyncio.Semaphore(concurrency)
+    tasks: set[asyncio.Task] = set()
+    while True:
+        try:
+            await asyncio.sleep(JOB_VISIBILITY_TIMEOUT_MS / 2000)
+            start_id = "0-0"
+            while True:
+                await slots.acquire()
+                started = False
+                try:
+                    claimed = await async_redis_client.xautoclaim(
+                        JOB_STREAM, JOB_GROUP, consumer_name,
+                        min_idle_time=JOB_VISIBILITY_TIMEOUT_MS, start_id=start_id, count=1,
+                    )
+                    if not claimed:
+                        break
+                    start_id, messages = claimed[0], claimed[1]
+                    for message_id, fields in messages:
+                        if message_id in _running_jobs:
+                            # Running in another slot of this process (its lease
+                            # renewal was late); don't start it twice
+                            continue
+                        if not fields:
+                            # Entry was trimmed/deleted from the stream; nothing to retry
+                            await async_redis_client.xack(JOB_STREAM, JOB_GROUP, message_id)
+                            continue
+                        pending = await async_redis_client.xpending_range(
+                            JOB_STREAM, JOB_GROUP, min=message_id, max=message_id, count=1
+                        )
+                        attempt = pending[0]["times_delivered"] if pending else JOB_MAX_ATTEMPTS + 1
+                        if attempt > JOB_MAX_ATTEMPTS:
+                            log(f"Job {fields['job_id']} was delivered {attempt} times without finishing; "
+                                f"marking it failed")
+                            await _finish_job(fields, message_id, "failed",
+                                              error=f"Worker stopped while processing ({attempt - 1} attempts)")
+                            continue
+                        task = asyncio.create_task(
+                            _run_reclaimed(slots, consumer_name, message_id, fields, attempt)
+                        )
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                        started = True
+                finally:
+                    if not started:
+                        slots.release()
+                if start_id == "0-0":
+                    break
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        except Exception as e:
+            log(f"Error reclaiming jobs: {e}")
+
+
+async def run_worker(concurrency: int = WORKER_CONCURRENCY, name: str | None = None):
+    consumer_name = name or f"{socket.gethostname()}-{os.getpid()}"
+    await run_in_db(reload_policy_snapshot)
+    start_policy_listener()
+    await ensure_job_group()
+    log(f"Worker '{consumer_name}' started with concurrency {concurrency}")
+    # Every slot reads under the same consumer name, so the pending list and
+    # XAUTOCLAIM treat this process as one consumer.
+    tasks = [asyncio.create_task(consume_new_jobs(consumer_name)) for _ in range(concurrency)]
+    tasks.append(asyncio.create_task(reclaim_stale_jobs(consumer_name, concurrency)))
+    await asyncio.gather(*tasks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a document-processing worker for async /submit_document/ jobs.")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY)
+    parser.add_argument("--name", default=None, help="consumer name (default: <hostname>-<pid>)")
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.concurrency, args.name))
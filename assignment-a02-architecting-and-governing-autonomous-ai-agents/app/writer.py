@@ -0,0 +1,201 @@
+import asyncio
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app.db import (
+    transaction,
+    utc_now,
+    document_statements,
+    UPDATE_DOCUMENT_STATUS_SQL,
+    UPDATE_DOCUMENT_STATUS_AND_TYPE_SQL,
+    UPSERT_SUMMARY_SQL,
+    UPSERT_SUMMARY_CACHE_SQL,
+    UPSERT_CHUNK_SUMMARY_SQL,
+)
+from app.metrics import timed
+
+# Group-commit tuning
+WRITER_FLUSH_INTERVAL = 0.005   # seconds to wait for more units after the first one arrives
+WRITER_MAX_BATCH = 64           # max units of work merged into one transaction
+
+
+class UnitOfWork:
+    """
+    Collects one document's state transitions so they are applied together in
+    a single transaction (instead of one commit/fsync per step).
+
+    Usage:
+        uow = UnitOfWork()
+        uow.insert_document(...)
+        uow.update_document_status(...)
+        await uow.commit()
+    """
+
+    def __init__(self):
+        self.statements: list[tuple[str, tuple]] = []
+
+    def execute(self, sql: str, params: tuple = ()):
+        self.statements.append((sql, params))
+
+    def insert_document(self, doc_id: str, user_id: str, filename: str, raw_text: str, doc_type: str, status: str,
+                        content_hash: str = None, summary_source_doc_id: str = None):
+        # raw_text is compressed into document_texts when the writer binds it
+        self.statements.extend(document_statements(doc_id, user_id, filename, raw_text, doc_type, status,
+                                                   utc_now(), content_hash, summary_source_doc_id))
+
+    def update_document_status(self, doc_id: str, status: str, doc_type: str = None):
+        now = utc_now()
+        if doc_type:
+            self.execute(UPDATE_DOCUMENT_STATUS_AND_TYPE_SQL, (status, doc_type, now, doc_id))
+        else:
+            self.execute(UPDATE_DOCUMENT_STATUS_SQL, (status, now, doc_id))
+
+    def insert_summary(self, doc_id: str, summary_text: str, notes_json: str):
+        self.execute(UPSERT_SUMMARY_SQL, (doc_id, summary_text, notes_json, utc_now()))
+
+    def cache_summary(self, content_hash: str, doc_type: str, template_hash: str, source_doc_id: str,
+                      summary_text: str, notes_json: str):
+        self.execute(UPSERT_SUMMARY_CACHE_SQL, (content_hash, doc_type, template_hash, source_doc_id,
+                                                summary_text, notes_json, utc_now()))
+
+    def cache_chunk_summaries(self, entries: list[tuple[str, str]]):
+        """Memoize (chunk_key, summary_text) pairs from the summarizer's map step."""
+        now = utc_now()
+        for chunk_key, summary_text in entries:
+            self.execute(UPSERT_CHUNK_SUMMARY_SQL, (chunk_key, summary_text, now))
+
+    def submit(self) -> Future:
+        """Hand the recorded statements to the background writer; returns a Future."""
+        pending, self.statements = self.statements, []
+        return group_writer.submit(pending)
+
+    @timed("pipeline.sqlite_write")
+    async def commit(self):
+        """Submit and wait (without blocking the event loop) until the group commit lands."""
+        await asyncio.wrap_future(self.submit())
+
+
+class GroupCommitWriter:
+    """
+    Single background thread that owns all pipeline writes.
+    Units of work from concurrent requests are queued; the writer takes the
+    first one, waits up to `flush_interval` for more (or until `max_batch`
+    units are queued) and applies the whole batch in one transaction.
+    Each unit runs inside its own SAVEPOINT, so a failing unit is rolled back
+    and reported to its caller without affecting the rest of the batch.
+    """
+
+    def __init__(self, flush_interval: float = WRITER_FLUSH_INTERVAL, max_batch: int = WRITER_MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.commits = 0        # transactions (≈ fsyncs) issued
+        self.units = 0          # units of work applied
+
+    def submit(self, statements: list[tuple[str, tuple]]) -> Future:
+        future = Future()
+        if not statements:
+            future.set_result(None)
+            return future
+        self._ensure_started()
+        self._queue.put((statements, future))
+        return future
+
+    def stats(self) -> dict:
+        return {
+            "commits": self.commits,
+            "units": self.units,
+            "avg_batch": round(self.units / self.commits, 2) if self.commits else 0.0,
+        }
+
+    def shutdown(self, timeout: float = 5.0):
+        """Flush everything already queued, then stop the writer thread."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._queue.put(None)
+            thread, self._thread = self._thread, None
+        thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self, first) -> tuple[list, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                stop = True
+                batch = []
+                # drain whatever was queued before the stop marker
+                while True:
+                    try:
+                        extra = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if extra is not None:
+                        batch.append(extra)
+            else:
+                batch, stop = self._collect_batch(item)
+            if batch:
+                self._flush(batch)
+            if stop:
+                return
+
+    @timed("db.group_commit")
+    def _flush(self, batch: list):
+        results = []
+        try:
+            with transaction() as conn:
+                for statements, future in batch:
+                    conn.execute("SAVEPOINT uow;")
+                    try:
+                        for sql, params in statements:
+                            conn.execute(sql, params)
+                        conn.execute("RELEASE uow;")
+                        results.append((future, None))
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO uow;")
+                        conn.execute("RELEASE uow;")
+                        results.append((future, e))
+        except Exception as e:
+            # The commit itself failed: nothing in this batch was applied.
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.commits += 1
+        self.units += len(batch)
+        for future, error in results:
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+
+group_writer = GroupCommitWriter()
+atexit.register(group_writer.shutdown)
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# Make the `app` package importable when pytest is run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Point the connection pool at an empty database file for the test."""
+    pool = db.ConnectionPool(str(tmp_path / "notegpt.db"))
+    monkeypatch.setattr(db, "DB_PATH", pool.db_path)
+    monkeypatch.setattr(db, "_pool", pool)
+    yield pool
+    pool.close_all()
@@ -0,0 +1,11 @@
+from app import migrations
+
+
+def test_migrations_reach_latest_version(temp_db):
+    migrations.apply_migrations()
+    assert migrations.current_version() == migrations.MIGRATIONS[-1][0]
+
+
+def test_hot_queries_are_index_backed(temp_db):
+    migrations.apply_migrations()
+    assert migrations.check_query_plans() == {}
@@ -0,0 +1,24 @@
+import asyncio
+
+from app import summarizer
+
+
+class SlowBackend(summarizer.SummaryBackend):
+    name = "slow-test"
+
+    async def summarize(self, text, instruction, max_words=None):
+        await asyncio.sleep(0.01)
+        return text
+
+
+async def _contended_calls(backend, n: int) -> list[str]:
+    return await asyncio.gather(*(summarizer._call(backend, str(i), "") for i in range(n)))
+
+
+def test_backend_slots_work_across_event_loops(monkeypatch):
+    # Callers wait on the semaphore (binding it to a loop), then a second
+    # asyncio.run (the worker, tests) uses it again from a new loop
+    monkeypatch.setattr(summarizer, "SUMMARY_CONCURRENCY", 1)
+    backend = SlowBackend()
+    assert asyncio.run(_contended_calls(backend, 3)) == ["0", "1", "2"]
+    assert asyncio.run(_contended_calls(backend, 3)) == ["0", "1", "2"]